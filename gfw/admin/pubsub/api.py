@@ -41,6 +41,11 @@ handlers = webapp2.WSGIApplication([
     webapp2.Route(r'/manage/pubsub/tasks/publish_subscription',
         handler=PubSubTaskApi,
         handler_method='publish_subscription',
+        methods=['POST']),
+
+    webapp2.Route(r'/manage/pubsub/tasks/prepare_subscriptions',
+        handler=PubSubTaskApi,
+        handler_method='prepare_subscriptions',
         methods=['POST'])
 
 
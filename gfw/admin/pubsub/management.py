@@ -40,10 +40,20 @@ def get_subscriptions(event):
     subscriptions = Subscription.query(Subscription.topic ==
             event.topic, Subscription.confirmed == True)
 
+    subscriptions = list(subscriptions.iter())
+    try:
+        topic_results = Subscription.run_analyses(
+            Topic.get_by_id(event.topic), subscriptions, event.begin, event.end)
+    except Exception, e:
+        # Analyzed one by one below
+        logging.exception(e)
+        topic_results = [None] * len(subscriptions)
+
     alerts = []
-    for subscription in subscriptions.iter():
+    for subscription, topic_result in zip(subscriptions, topic_results):
         try:
-            topic_result = subscription.run_analysis(event.begin, event.end)
+            if topic_result is None:
+                topic_result = subscription.run_analysis(event.begin, event.end)
 
             if (topic_result.is_zero() == False):
                 alerts.append({
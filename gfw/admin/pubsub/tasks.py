@@ -15,26 +15,61 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
+import logging
 import webapp2
 
 from gfw.middlewares.cors import CORSRequestHandler
 from gfw.mailers.subscription import SubscriptionMailer
 from gfw.models.event import Event
 from gfw.models.subscription import Subscription
+from gfw.models.topic import Topic
 
 from google.appengine.api import taskqueue
 from google.appengine.ext import ndb
 
+# Subscriptions analyzed together by each prepare_subscriptions task
+PREPARE_CHUNK = 200
+
+
+def _publish(event_key, subscription_keys):
+    for key in subscription_keys:
+        taskqueue.add(url='/manage/pubsub/tasks/publish_subscription',
+            queue_name='pubsub-publish-sub',
+            params=dict(event=event_key, subscription=key))
+
 class PubSubTaskApi(CORSRequestHandler):
     def publish_subscriptions(self):
         event = ndb.Key(urlsafe=self.args().get('event')).get()
-        subscriptions = Subscription.query(Subscription.topic ==
-                event.topic, Subscription.confirmed == True)
+        keys = [key.urlsafe() for key in Subscription.query(
+                Subscription.topic == event.topic,
+                Subscription.confirmed == True).iter(keys_only=True)]
+
+        if not Topic.get_by_id(event.topic).can_batch():
+            _publish(event.key.urlsafe(), keys)
+            return
+
+        # Topics analyzed in batches are prepared by their own tasks, which
+        # send their subscriptions once they've filled the analysis cache
+        for i in range(0, len(keys), PREPARE_CHUNK):
+            taskqueue.add(url='/manage/pubsub/tasks/prepare_subscriptions',
+                queue_name='pubsub-prepare-subs',
+                params=dict(event=event.key.urlsafe(),
+                            subscription=keys[i:i + PREPARE_CHUNK]))
 
-        for subscription in subscriptions.iter():
-            taskqueue.add(url='/manage/pubsub/tasks/publish_subscription',
-                queue_name='pubsub-publish-sub',
-                params=dict(event=event.key.urlsafe(), subscription=subscription.key.urlsafe()))
+    def prepare_subscriptions(self):
+        event_key = self.request.get('event')
+        keys = self.request.get_all('subscription')
+        try:
+            event = ndb.Key(urlsafe=event_key).get()
+            subscriptions = ndb.get_multi([ndb.Key(urlsafe=key)
+                for key in keys])
+            Subscription.prepare_analyses(Topic.get_by_id(event.topic),
+                [s for s in subscriptions if s], event.begin, event.end)
+        except Exception, e:
+            # Not retried, since that would send the subscriptions twice;
+            # each is analyzed on its own instead
+            logging.exception(e)
+        _publish(event_key, keys)
 
     def publish_subscription(self):
         event = ndb.Key(urlsafe=self.args().get('event')).get()
@@ -0,0 +1,492 @@
+# Global Forest Watch API
+# Copyright (C) 2015 World Resource Institute
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""This module supports tiered caching of API results.
+
+Results are looked up in a small per-instance LRU first, then memcache,
+then a durable tier in the datastore (or GCS for values too big for an
+entity). A hit in a lower tier is written back to the tiers above it.
+
+Values are pickled and zlib compressed, and values bigger than a memcache
+item are sharded over several keys behind a manifest with a checksum.
+
+Entries may carry a soft expiry, after which they are still served but
+reported as stale so the caller can refresh them in the background."""
+
+import collections
+import cPickle as pickle
+import datetime
+import json
+import logging
+import threading
+import time
+import uuid
+import zlib
+from hashlib import md5
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+from gfw import gcs
+from gfw import geometry
+
+# Per-instance LRU bounds:
+LOCAL_MAX_ENTRIES = 256
+LOCAL_MAX_BYTES = 16 * 1024 * 1024
+
+# Seconds a result lives in the per-instance LRU, so a bust or refresh on
+# another instance is seen here soon after:
+LOCAL_TTL = 5 * 60
+
+# Seconds a result lives in memcache:
+MEMCACHE_TTL = 24 * 60 * 60
+
+# Results at least this big, or slower than DURABLE_MIN_SECONDS to compute,
+# are also written to the durable tier:
+DURABLE_MIN_BYTES = 100 * 1024
+DURABLE_MIN_SECONDS = 5
+DURABLE_TTL = datetime.timedelta(days=7)
+
+# Values are prefixed with the codec version so old formats read as misses:
+CODEC = 'z1:'
+
+# Bytes per memcache item, under the 1 MB limit with room for overhead:
+CHUNK_BYTES = 950 * 1000
+
+# Seconds a stale entry is still served past its soft expiry:
+MAX_STALE_SECONDS = 7 * 24 * 60 * 60
+
+# Memcache treats expiry times beyond 30 days as absolute timestamps:
+MEMCACHE_MAX_RELATIVE = 30 * 24 * 60 * 60
+
+# Larger durable values go to GCS instead of the datastore entity:
+DATASTORE_MAX_BYTES = 900 * 1024
+
+TIERS = ['local', 'memcache', 'durable']
+
+# Seconds a compute lease is held before other callers may take it over,
+# so a crashed worker does not block a key for long:
+LEASE_SECONDS = 60
+
+# Value of a released lease, which any caller may acquire again
+RELEASED = ''
+
+# How long and how often callers poll for a value a lease holder computes:
+LEASE_WAIT_SECONDS = 30
+LEASE_POLL_SECONDS = 0.25
+
+
+class LocalCache(object):
+    """Thread-safe LRU of pickled values bounded by entries and bytes.
+
+    sizeof returns the size in bytes of a value, for caches of values that
+    are not strings. With ttl, entries expire that many seconds after they
+    are set unless set() is given a shorter ttl."""
+
+    def __init__(self, max_entries=LOCAL_MAX_ENTRIES,
+                 max_bytes=LOCAL_MAX_BYTES, sizeof=len, ttl=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.ttl = ttl
+        self.size = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires is not None and expires <= time.time():
+                self.size -= self.sizeof(value)
+                return None
+            self._entries[key] = entry
+            return value
+
+    def set(self, key, value, ttl=None):
+        if self.sizeof(value) > self.max_bytes:
+            return
+        ttls = [t for t in (ttl, self.ttl) if t is not None]
+        expires = time.time() + min(ttls) if ttls else None
+        with self._lock:
+            self._pop(key)
+            self._entries[key] = (expires, value)
+            self.size += self.sizeof(value)
+            while (len(self._entries) > self.max_entries or
+                    self.size > self.max_bytes):
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.size -= self.sizeof(evicted)
+
+    def delete(self, key):
+        with self._lock:
+            self._pop(key)
+
+    def _pop(self, key):
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.size -= self.sizeof(old[1])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+class CachedResult(ndb.Model):
+    """Durable cache entry, with large values stored in GCS."""
+    value = ndb.BlobProperty()
+    gcs_path = ndb.StringProperty(indexed=False)
+    expires = ndb.DateTimeProperty(indexed=False)
+
+    kind = 'CachedResult'
+
+
+_local = LocalCache(ttl=LOCAL_TTL)
+_stats = dict((tier, dict(hit=0, miss=0)) for tier in TIERS)
+_stats['lease'] = dict(acquired=0, coalesced=0, timeout=0)
+
+
+def stats():
+    """Return per-instance hit/miss counters and LRU usage by tier."""
+    result = dict((name, dict(counts)) for name, counts in _stats.iteritems())
+    result['local'].update(entries=len(_local._entries), bytes=_local.size)
+    return result
+
+
+def _json_default(obj):
+    if isinstance(obj, (datetime.date, datetime.datetime)):
+        return obj.isoformat()
+    if isinstance(obj, ndb.Key):
+        return obj.id()
+
+
+def get_key(path, params, version=None):
+    """Return the cache key for a request path, params and data version.
+
+    Logically identical requests share a key: the host is ignored, bust is
+    dropped and GeoJSON is normalized with geometry.fingerprint(). Areas
+    given by geostore id are keyed on the id alone."""
+    params = dict(params)
+    params.pop('bust', None)
+    if params.get('geostore'):
+        params.pop('geojson', None)
+    elif params.get('geojson'):
+        params['geojson'] = geometry.fingerprint(params['geojson'])
+    normalized = json.dumps(params, sort_keys=True, separators=(',', ':'),
+                            default=_json_default)
+    path = path.strip('/').lower()
+    return md5('%s?%s#%s' % (path, normalized, version or '')).hexdigest()
+
+
+def _count(tier, hit):
+    _stats[tier]['hit' if hit else 'miss'] += 1
+
+
+def _gcs_filename(key):
+    return '/cache/%s' % key
+
+
+def _durable_get(key):
+    entry = CachedResult.get_by_id(key)
+    if entry is None:
+        return None
+    if entry.expires and entry.expires < datetime.datetime.utcnow():
+        _durable_delete(key, entry)
+        return None
+    if entry.gcs_path:
+        return gcs.read_file(entry.gcs_path)
+    return entry.value
+
+
+def _durable_set(key, value, ttl=None):
+    ttl = max(DURABLE_TTL, datetime.timedelta(seconds=ttl or 0))
+    entry = CachedResult(id=key, expires=datetime.datetime.utcnow() + ttl)
+    if len(value) > DATASTORE_MAX_BYTES:
+        entry.gcs_path = _gcs_filename(key)
+        gcs.create_file(value, entry.gcs_path, 'application/octet-stream')
+    else:
+        entry.value = value
+    entry.put()
+
+
+def _durable_delete(key, entry=None):
+    entry = entry or CachedResult.get_by_id(key)
+    if entry is None:
+        return
+    if entry.gcs_path:
+        gcs.delete_file(entry.gcs_path)
+    entry.key.delete()
+
+
+def _get_shared_raw(key):
+    """Return pickled value for key from memcache or the durable tier."""
+    value = _memcache_get(key)
+    _count('memcache', value is not None)
+    if value is not None:
+        _local.set(key, value)
+        return value
+
+    return _get_durable_raw(key)
+
+
+def _get_durable_raw(key):
+    """Return pickled value for key from the durable tier and promote it."""
+    try:
+        value = _durable_get(key)
+    except Exception as e:
+        logging.exception(e)
+        value = None
+    _count('durable', value is not None)
+    if value is not None:
+        _local.set(key, value)
+        _memcache_set(key, value)
+    return value
+
+
+def _get_raw_multi(keys):
+    """Return {key: pickled value} for keys, with one memcache round trip."""
+    values = {}
+    missing = []
+    for key in keys:
+        value = _local.get(key)
+        _count('local', value is not None)
+        if value is not None:
+            values[key] = value
+        else:
+            missing.append(key)
+    if not missing:
+        return values
+
+    entries = memcache.get_multi(missing)
+    for key in missing:
+        value = _memcache_join(key, entries.get(key))
+        _count('memcache', value is not None)
+        if value is None:
+            value = _get_durable_raw(key)
+        else:
+            _local.set(key, value)
+        if value is not None:
+            values[key] = value
+    return values
+
+
+def _chunk_keys(key, count):
+    return ['%s:%s' % (key, index) for index in range(count)]
+
+
+def _memcache_get(key):
+    """Return raw value for key, joining it if it was sharded."""
+    return _memcache_join(key, memcache.get(key))
+
+
+def _memcache_join(key, value):
+    """Return raw value of a memcache entry, joining it if it is sharded."""
+    if not isinstance(value, tuple):
+        return value
+    count, digest = value
+    chunks = memcache.get_multi(_chunk_keys(key, count))
+    if len(chunks) != count:
+        return None
+    value = ''.join(chunks[k] for k in _chunk_keys(key, count))
+    if md5(value).hexdigest() != digest:
+        logging.warning('Cache checksum mismatch for %s' % key)
+        return None
+    return value
+
+
+def _memcache_set(key, value, ttl=None):
+    """Store raw value under key, sharding it when it is too big."""
+    ttl = max(MEMCACHE_TTL, ttl or 0)
+    if ttl > MEMCACHE_MAX_RELATIVE:
+        ttl = time.time() + ttl
+    try:
+        if len(value) <= CHUNK_BYTES:
+            memcache.set(key=key, value=value, time=ttl)
+            return
+        chunks = [value[i:i + CHUNK_BYTES]
+                  for i in range(0, len(value), CHUNK_BYTES)]
+        keys = _chunk_keys(key, len(chunks))
+        failed = memcache.set_multi(dict(zip(keys, chunks)), time=ttl)
+        if failed:
+            raise Exception('Failed to cache chunks %s' % failed)
+        # The manifest goes last so readers never see partial chunks
+        memcache.set(key=key, value=(len(chunks), md5(value).hexdigest()),
+                     time=ttl)
+    except Exception as e:
+        logging.exception(e)
+
+
+def _memcache_delete(key):
+    value = memcache.get(key)
+    if isinstance(value, tuple):
+        memcache.delete_multi(_chunk_keys(key, value[0]))
+    memcache.delete(key)
+
+
+def _dumps(value, soft_ttl=None):
+    stale_at = time.time() + soft_ttl if soft_ttl else None
+    return CODEC + zlib.compress(
+        pickle.dumps((stale_at, value), pickle.HIGHEST_PROTOCOL))
+
+
+def _loads(raw):
+    """Return (value, stale) for an encoded entry.
+
+    Raises ValueError for entries written with another codec."""
+    if not raw.startswith(CODEC):
+        raise ValueError('Unknown cache codec')
+    stale_at, value = pickle.loads(zlib.decompress(raw[len(CODEC):]))
+    return value, bool(stale_at and stale_at < time.time())
+
+
+def _decode(key, raw):
+    if raw is None:
+        return None, False
+    try:
+        return _loads(raw)
+    except Exception as e:
+        logging.exception(e)
+        delete(key)
+        return None, False
+
+
+def lookup(key):
+    """Return (value, stale) for key, or (None, False) on a miss.
+
+    A stale local copy is checked against the shared tiers first, where
+    another instance may already have refreshed it."""
+    raw = _local.get(key)
+    _count('local', raw is not None)
+    if raw is None:
+        return _decode(key, _get_shared_raw(key))
+    value, stale = _decode(key, raw)
+    if stale:
+        _local.delete(key)
+        shared = _decode(key, _get_shared_raw(key))
+        if shared[0] is not None:
+            return shared
+    return value, stale
+
+
+def get(key):
+    """Return cached value for key or None, whether stale or not."""
+    return lookup(key)[0]
+
+
+def get_multi(keys):
+    """Return {key: value} for the keys cached, whether stale or not."""
+    result = {}
+    for key, raw in _get_raw_multi(keys).iteritems():
+        try:
+            result[key] = _loads(raw)[0]
+        except Exception as e:
+            logging.exception(e)
+            delete(key)
+    return result
+
+
+def set(key, value, durable=False, soft_ttl=None):
+    """Cache value under key in every tier it qualifies for.
+
+    Values are also written to the durable tier when durable is True or
+    when they are at least DURABLE_MIN_BYTES big. With soft_ttl, the entry
+    turns stale after that many seconds and is kept for MAX_STALE_SECONDS
+    more."""
+    raw = _dumps(value, soft_ttl)
+    ttl = soft_ttl + MAX_STALE_SECONDS if soft_ttl else None
+    # Locally the entry lives no longer than it stays fresh
+    _local.set(key, raw, soft_ttl)
+    _memcache_set(key, raw, ttl)
+    if durable or len(raw) >= DURABLE_MIN_BYTES:
+        try:
+            _durable_set(key, raw, ttl)
+        except Exception as e:
+            logging.exception(e)
+
+
+def delete(key):
+    """Remove key from all tiers."""
+    _local.delete(key)
+    _memcache_delete(key)
+    try:
+        _durable_delete(key)
+    except Exception as e:
+        logging.exception(e)
+
+
+def _lease_key(key):
+    return 'lease:%s' % key
+
+
+def acquire_lease(key):
+    """Return a lease token if the caller should compute key, else None."""
+    token = uuid.uuid4().hex
+    lease_key = _lease_key(key)
+    acquired = memcache.add(lease_key, token, time=LEASE_SECONDS)
+    if not acquired:
+        client = memcache.Client()
+        acquired = client.gets(lease_key) == RELEASED and \
+            client.cas(lease_key, token, time=LEASE_SECONDS)
+    if acquired:
+        _stats['lease']['acquired'] += 1
+        return token
+    return None
+
+
+def release_lease(key, token):
+    """Release the lease on key if it is still held under token.
+
+    The lease is marked RELEASED with compare-and-set, so a lease taken
+    over by another caller in the meantime is left alone."""
+    lease_key = _lease_key(key)
+    client = memcache.Client()
+    if client.gets(lease_key) == token:
+        client.cas(lease_key, RELEASED, time=LEASE_SECONDS)
+
+
+def wait(key, timeout=LEASE_WAIT_SECONDS):
+    """Wait for the current lease holder to fill key and return its value.
+
+    Returns None when the lease is released or expires without a value, or
+    after timeout seconds."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        time.sleep(LEASE_POLL_SECONDS)
+        raw = _memcache_get(key)
+        if raw is not None:
+            _stats['lease']['coalesced'] += 1
+            _local.set(key, raw)
+            return _loads(raw)[0]
+        if not memcache.get(_lease_key(key)):
+            return None
+    _stats['lease']['timeout'] += 1
+    return None
+
+
+def _refresh_key(key):
+    return 'refresh:%s' % key
+
+
+def acquire_refresh(key, seconds=LEASE_SECONDS * 10):
+    """Return True if the caller should schedule a refresh of stale key."""
+    return memcache.add(_refresh_key(key), 1, time=seconds)
+
+
+def release_refresh(key):
+    memcache.delete(_refresh_key(key))
@@ -0,0 +1,139 @@
+# Global Forest Watch API
+# Copyright (C) 2015 World Resource Institute
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Task handlers that keep cached results fresh in the background."""
+
+import importlib
+import json
+import logging
+import webapp2
+
+from gfw import cache
+from gfw import common
+from gfw import exports
+from gfw import warmer
+from gfw.forestchange import cube
+from gfw.forestchange import grid
+from gfw.forestchange import versions
+from gfw.middlewares.cors import CORSRequestHandler
+
+
+class CacheTaskApi(CORSRequestHandler):
+    def refresh(self):
+        rid = self.request.get('rid')
+        name = self.request.get('target')
+        soft_ttl = self.request.get('soft_ttl')
+        args_key = self._refresh_args_key(rid)
+        try:
+            if not name.startswith('gfw.'):
+                raise ValueError('Unsupported refresh target %s' % name)
+            target = importlib.import_module(name)
+            args = cache.get(args_key)
+            if args is None:
+                raise ValueError('Missing refresh args for %s' % rid)
+            self.execute_and_cache(args, target, rid,
+                                   float(soft_ttl) if soft_ttl else None)
+        except Exception, e:
+            # Not retried; the next stale hit schedules another refresh
+            logging.exception(e)
+        finally:
+            cache.delete(args_key)
+            cache.release_refresh(rid)
+
+    def versions(self):
+        """Refreshes dataset version tokens so new data gets new keys."""
+        changes = versions.refresh()
+        for dataset, (old, new) in changes.iteritems():
+            if old != new:
+                logging.info('Dataset %s version %s -> %s' % (dataset, old, new))
+                for start, datasets in [(cube.start, cube.CUBE_SQL),
+                                        (grid.start, grid.GRID_SQL)]:
+                    if dataset in datasets:
+                        try:
+                            start(dataset)
+                        except Exception, e:
+                            logging.exception(e)
+        self.complete('respond', changes)
+
+    def warm(self):
+        """Enqueues a warm task per configured combination."""
+        self.complete('respond', warmer.start())
+
+    def warm_one(self):
+        warmer.warm(json.loads(self.request.get('entry')),
+                    self.request.get('run'))
+
+    def export(self):
+        """Runs a CartoDB export and stores the file in GCS."""
+        exports.run(self.request.get('id'))
+
+    def cube(self):
+        """Builds the alert cube of one dataset and country."""
+        cube.build(self.request.get('dataset'), self.request.get('iso'))
+
+    def grid(self):
+        """Builds the alert grid of one dataset tile."""
+        grid.build(self.request.get('dataset'),
+                   (int(self.request.get('x')), int(self.request.get('y'))),
+                   self.request.get('version'))
+
+    def warm_report(self):
+        self.complete('respond', warmer.report(self.request.get('run')))
+
+routes = [
+    webapp2.Route(r'/cache/tasks/refresh',
+        handler=CacheTaskApi,
+        handler_method='refresh',
+        methods=['POST']),
+
+    webapp2.Route(r'/cache/tasks/versions',
+        handler=CacheTaskApi,
+        handler_method='versions',
+        methods=['GET']),
+
+    webapp2.Route(r'/cache/tasks/warm',
+        handler=CacheTaskApi,
+        handler_method='warm',
+        methods=['GET']),
+
+    webapp2.Route(r'/cache/tasks/warm_one',
+        handler=CacheTaskApi,
+        handler_method='warm_one',
+        methods=['POST']),
+
+    webapp2.Route(r'/cache/tasks/export',
+        handler=CacheTaskApi,
+        handler_method='export',
+        methods=['POST']),
+
+    webapp2.Route(r'/cache/tasks/cube',
+        handler=CacheTaskApi,
+        handler_method='cube',
+        methods=['POST']),
+
+    webapp2.Route(r'/cache/tasks/grid',
+        handler=CacheTaskApi,
+        handler_method='grid',
+        methods=['POST']),
+
+    webapp2.Route(r'/cache/tasks/warm_report',
+        handler=CacheTaskApi,
+        handler_method='warm_report',
+        methods=['GET'])
+]
+
+handlers = webapp2.WSGIApplication(routes, debug=common.IS_DEV)
@@ -18,10 +18,12 @@
 """This module supports executing CartoDB queries."""
 
 import copy
+import json
 import urllib
 import logging
 
 from appengine_config import runtime_config
+from google.appengine.api import apiproxy_stub_map
 from google.appengine.api import urlfetch
 
 # CartoDB endpoint:
@@ -30,6 +32,13 @@ if runtime_config.get('cdb_endpoint'):
 else:
     ENDPOINT = 'https://wri-01.cartodb.com/api/v2/sql'
 
+# Default urlfetch deadline in seconds for a query:
+DEADLINE = 50
+
+# Wraps one statement of a batch as a JSON array column:
+BATCH_COLUMN = """(SELECT COALESCE(json_agg(b), '[]'::json)
+    FROM ({query}) b) AS q{index}"""
+
 
 def _get_api_key():
     """Return CartoDB API key stored in cdb.txt file."""
@@ -75,14 +84,117 @@ def get_body(query, params, auth=False):
     return body
 
 
-def execute(query, params={}, auth=False):
-    """Exectues supplied query on CartoDB and returns response body as JSON."""
-    #import logging
-    #logging.info(query)
-    rpc = urlfetch.create_rpc(deadline=50)
-    payload = get_body(query, params, auth=auth)
+class Future(object):
+    """Pending result of a CartoDB query started with execute_async().
+
+    get_result() blocks on the underlying urlfetch RPC and returns the
+    response, passed through any callbacks added with then()."""
+
+    def __init__(self, rpc=None, callbacks=None, value=None):
+        self.rpc = rpc
+        self.callbacks = callbacks or []
+        self._value = value
+        self._done = rpc is None
+
+    @classmethod
+    def resolved(cls, value):
+        """Return a future that is already done with supplied value."""
+        return cls(value=value)
+
+    def then(self, callback):
+        """Return a new future for callback applied to this result."""
+        if self._done:
+            return Future(value=callback(self._value))
+        return Future(self.rpc, self.callbacks + [callback])
+
+    def done(self):
+        return self._done
+
+    def get_result(self):
+        if not self._done:
+            value = self.rpc.get_result()
+            for callback in self.callbacks:
+                value = callback(value)
+            self._value, self._done = value, True
+        return self._value
+
+
+def execute_async(query, params={}, auth=False, deadline=DEADLINE):
+    """Starts supplied query on CartoDB and returns a Future for the response.
+
+    The query runs while the caller does other work; call get_result() on
+    the returned Future to wait for the urlfetch response."""
+    rpc = urlfetch.create_rpc(deadline=deadline)
+    payload = get_body(query, copy.copy(params), auth=auth)
     if runtime_config.get('IS_DEV'):
         logging.info(query)
         logging.info(payload)
     urlfetch.make_fetch_call(rpc, ENDPOINT, method='POST', payload=payload)
-    return rpc.get_result()
+    return Future(rpc)
+
+
+def execute(query, params={}, auth=False):
+    """Exectues supplied query on CartoDB and returns response body as JSON."""
+    return execute_async(query, params, auth=auth).get_result()
+
+
+def get_batch_query(queries):
+    """Return a single query returning the rows of each supplied query.
+
+    The result has one row with a JSON array column per query, so N
+    statements cost one request to the SQL API."""
+    columns = [BATCH_COLUMN.format(query=query, index=index)
+               for index, query in enumerate(queries)]
+    return 'SELECT %s' % ', '.join(columns)
+
+
+def _split_batch(queries):
+    def split(response):
+        if response.status_code != 200:
+            raise Exception('CartoDB batch error: %s' % response.content)
+        row = json.loads(response.content)['rows'][0]
+        results = []
+        for index in range(len(queries)):
+            rows = row['q%s' % index]
+            if isinstance(rows, basestring):
+                rows = json.loads(rows)
+            results.append(rows or [])
+        return results
+    return split
+
+
+def execute_batch_async(queries, params={}, auth=False, deadline=DEADLINE):
+    """Starts supplied queries as one CartoDB request and returns a Future.
+
+    The future resolves to a list with the rows of each query, in the order
+    of the supplied queries. Statements must return plain JSON rows, so
+    this is not for format=topojson or download queries."""
+    query = get_batch_query(queries)
+    return execute_async(query, params, auth=auth, deadline=deadline).then(
+        _split_batch(queries))
+
+
+def execute_batch(queries, params={}, auth=False):
+    """Executes supplied queries in one CartoDB request.
+
+    Returns a list with the rows of each query."""
+    return execute_batch_async(queries, params, auth=auth).get_result()
+
+
+def wait_any(futures):
+    """Blocks until one of the supplied futures is done and returns it."""
+    futures = list(futures)
+    for future in futures:
+        if future.done():
+            return future
+    if not futures:
+        return None
+    rpcs = dict((future.rpc, future) for future in futures)
+    return rpcs[apiproxy_stub_map.UserRPC.wait_any(rpcs.keys())]
+
+
+def wait_all(futures):
+    """Blocks until all supplied futures are done and returns their results.
+
+    Results are returned in the order of the supplied futures."""
+    return [future.get_result() for future in futures]
@@ -22,6 +22,7 @@ import logging
 import re
 import webapp2
 
+from gfw import cache
 from gfw.countries import countries
 from gfw.countries import args
 from gfw.middlewares.cors import CORSRequestHandler
@@ -33,6 +34,28 @@ META = {
 
 }
 
+# Query args supported by the countries API
+PARAMS = ['dev', 'bust', 'thresh']
+
+# Seconds before a cached country profile is refreshed in the background
+SOFT_TTL = 24 * 60 * 60
+
+
+def get_params(path, rtype, raw_args):
+    """Return processed params for a countries request."""
+    query_args = args.process(
+        dict((k, v) for k, v in raw_args.iteritems() if k in PARAMS))
+    if rtype == 'index':
+        path_args = {'index': True}
+    else:
+        path_args = args.process_path(path, rtype)
+    return dict(query_args, **path_args)
+
+
+def get_rid(path, params):
+    """Return the cache key for a countries request."""
+    return cache.get_key(path, params)
+
 
 def _classify_request(path):
     """Classify request based on supplied path."""
@@ -60,12 +83,10 @@ class Handler(CORSRequestHandler):
                 self.error(404)
                 return
 
-            # Return API meta
-            if path == 'countries':
-                action, data = self._action_data()
-            else:   
-                path_args = args.process_path(path, rtype)
-                action, data = self._action_data(path_args)
+            params = get_params(path, rtype, self.args(only=PARAMS))
+            rid = get_rid(path, params)
+            action, data = self.get_or_execute(params, countries, rid,
+                                               soft_ttl=SOFT_TTL)
 
             self.complete(action, data)
 
@@ -75,11 +96,5 @@ class Handler(CORSRequestHandler):
             self.write(json.dumps(META, sort_keys=True))
 
 
-    def _action_data(self,path_args={'index': True}):
-        query_args = args.process(self.args(only=['dev', 'bust', 'thresh']))
-        params = dict(query_args, **path_args)
-        rid = self.get_id(params)
-        return self.get_or_execute(params, countries, rid)
-
 
 handlers = webapp2.WSGIApplication([(r'/countries.*', Handler)], debug=True)
@@ -18,11 +18,18 @@
 """This module supports accessing countries data. todo- add loss outside plantations to umd"""
 
 import json
+import logging
 
 from gfw import cdb
 from gfw.forestchange import umd
 from gfw import stories
 
+# Upper bound on CartoDB RPCs in flight while building one country profile.
+MAX_CONCURRENT_RPCS = 8
+
+# Default urlfetch deadline in seconds for a single profile section.
+SECTION_DEADLINE = 20
+
 class CountrySql(object):
 
     INDEX = """
@@ -159,16 +166,10 @@ def _index(args):
     rows = _handler(cdb.execute(query))
     return dict(countries=rows)
 
-def _show(args):
-    query = CountrySql.SHOW.format(**args)
-    rows = _handler(cdb.execute(query))
+def _show(rows):
     return rows[0]
 
-def _getTopoJson(args):
-    query = CountrySql.TOPO_JSON.format(**args)
-
-    rows = _handler(
-        cdb.execute(query, params=dict(format='topojson')))
+def _getTopoJson(rows):
     return dict(topojson=rows)
 
 def _processSubnatRow(x):
@@ -176,58 +177,37 @@ def _processSubnatRow(x):
     return x
 
 
-def _getSubnatBounds(args):
-    query = CountrySql.SUBNAT_BOUNDS.format(**args)
-
-    rows = _handler(cdb.execute(query))
+def _getSubnatBounds(rows):
     results = map(_processSubnatRow, rows)
     return dict(subnat_bounds=results)
 
 
-def _getForma(args):
-    query = CountrySql.FORMA.format(**args)
-
-    return dict(forma=_handler(cdb.execute(query)))
-
-
-def _getForests(args):
-    query = CountrySql.FORESTS.format(**args)
-
-    return dict(forests=_handler(cdb.execute(query)))
-
-
-def _getTenure(args):
-    query = CountrySql.TENURE.format(**args)
+def _getForma(rows):
+    return dict(forma=rows)
 
-    return dict(tenure=_handler(cdb.execute(query)))
 
+def _getForests(rows):
+    return dict(forests=rows)
 
-def _getBurnedForests(args):
-    query = CountrySql.BURNED_FOREST.format(**args)
 
-    return dict(burned_forests=_handler(cdb.execute(query)))
+def _getTenure(rows):
+    return dict(tenure=rows)
 
-def _getReforestation(args):
-    query = CountrySql.REFORESTATION.format(**args)
 
-    return dict(reforestation=_handler(cdb.execute(query)))
+def _getBurnedForests(rows):
+    return dict(burned_forests=rows)
 
-def _getForestCertification(args):
-    query = CountrySql.FOREST_CERTIFICATION.format(**args)
+def _getReforestation(rows):
+    return dict(reforestation=rows)
 
-    return dict(forest_certification=_handler(cdb.execute(query)))
+def _getForestCertification(rows):
+    return dict(forest_certification=rows)
 
-def _getLossOutsidePlantations(args):
-    if 'thresh' not in args:
-        args['thresh'] = 30
-    query = CountrySql.LOSS_OUTSIDE_PLANTATION.format(**args)
+def _getLossOutsidePlantations(rows):
+    return dict(loss_outside_plantations=rows)
 
-    return dict(loss_outside_plantations=_handler(cdb.execute(query)))
-
-def _getBounds(args):
-    query = CountrySql.BOUNDS.format(**args)
-
-    return dict(bounds=json.loads(_handler(cdb.execute(query))[0]['bounds']))
+def _getBounds(rows):
+    return dict(bounds=json.loads(rows[0]['bounds']))
 
 def _getstory(args):
     return dict(story=stories.get_country_story(args))
@@ -244,6 +224,137 @@ def _getIfl(args):
         
     return dict(ifl=ifl)
 
+
+def _section_error(e):
+    return '%s: %s' % (e.__class__.__name__, e)
+
+
+class Section(object):
+    """A country profile section backed by a single CartoDB query."""
+
+    def __init__(self, name, sql, process, params={},
+                 deadline=SECTION_DEADLINE):
+        self.name = name
+        self.sql = sql
+        self.process = process
+        self.params = params
+        self.deadline = deadline
+
+    def start(self, args):
+        """Start the section query and return its cdb.Future."""
+        return cdb.execute_async(
+            self.sql.format(**args), self.params, deadline=self.deadline)
+
+    def finish(self, future, errors):
+        try:
+            return self.process(_handler(future.get_result()))
+        except Exception, e:
+            logging.exception(e)
+            errors[self.name] = _section_error(e)
+            return {}
+
+
+class SectionBatch(object):
+    """Small sections packed into a single CartoDB request.
+
+    If the batch request fails its sections are retried one by one."""
+
+    def __init__(self, name, sections, deadline=SECTION_DEADLINE):
+        self.name = name
+        self.sections = sections
+        self.deadline = deadline
+
+    def start(self, args):
+        """Start the batch query and return its cdb.Future."""
+        queries = [section.sql.format(**args) for section in self.sections]
+        return cdb.execute_batch_async(queries, deadline=self.deadline)
+
+    def finish(self, future, errors):
+        result = {}
+        for section, rows in zip(self.sections, future.get_result()):
+            try:
+                result.update(section.process(rows))
+            except Exception, e:
+                logging.exception(e)
+                errors[section.name] = _section_error(e)
+        return result
+
+
+SECTIONS = [
+    SectionBatch('gfw2_countries', [
+        Section('show', CountrySql.SHOW, _show),
+        Section('forests', CountrySql.FORESTS, _getForests),
+        Section('tenure', CountrySql.TENURE, _getTenure),
+        Section('reforestation', CountrySql.REFORESTATION,
+                _getReforestation),
+        Section('forest_certification', CountrySql.FOREST_CERTIFICATION,
+                _getForestCertification),
+        Section('bounds', CountrySql.BOUNDS, _getBounds),
+    ]),
+    Section('topojson', CountrySql.TOPO_JSON, _getTopoJson,
+            params=dict(format='topojson'), deadline=40),
+    Section('subnat_bounds', CountrySql.SUBNAT_BOUNDS, _getSubnatBounds),
+    Section('forma', CountrySql.FORMA, _getForma),
+    Section('burned_forests', CountrySql.BURNED_FOREST, _getBurnedForests),
+    Section('loss_outside_plantations', CountrySql.LOSS_OUTSIDE_PLANTATION,
+            _getLossOutsidePlantations),
+]
+
+# Sections that go through other modules and block on their own requests.
+# They run while the section RPCs above are in flight.
+BLOCKING_SECTIONS = [
+    ('umd', _getUmd),
+    ('ifl', _getIfl),
+    ('story', _getstory),
+]
+
+
+def _fetch_sections(args, sections, blocking_sections):
+    """Return (result, errors) for supplied profile sections.
+
+    Section queries run concurrently with at most MAX_CONCURRENT_RPCS
+    CartoDB queries in flight. Failed or timed out sections are reported in
+    errors by section name instead of failing the whole profile."""
+    result, errors = {}, {}
+    pending = list(sections)
+    in_flight = {}
+
+    def failed(section, e):
+        logging.exception(e)
+        if isinstance(section, SectionBatch):
+            pending.extend(section.sections)
+        else:
+            errors[section.name] = _section_error(e)
+
+    def fill():
+        while pending and len(in_flight) < MAX_CONCURRENT_RPCS:
+            section = pending.pop(0)
+            try:
+                in_flight[section.start(args)] = section
+            except Exception, e:
+                failed(section, e)
+
+    fill()
+
+    for name, func in blocking_sections:
+        try:
+            result.update(func(args))
+        except Exception, e:
+            logging.exception(e)
+            errors[name] = _section_error(e)
+
+    while in_flight:
+        future = cdb.wait_any(in_flight.keys())
+        section = in_flight.pop(future)
+        try:
+            result.update(section.finish(future, errors))
+        except Exception, e:
+            failed(section, e)
+        fill()
+
+    return result, errors
+
+
 def execute(args):
     result = dict(params=args)
 
@@ -251,19 +362,12 @@ def execute(args):
         result.update(_index(args))
 
     else:
-        result.update(_show(args))
-        result.update(_getTopoJson(args))
-        result.update(_getSubnatBounds(args))
-        result.update(_getForma(args))
-        result.update(_getForests(args))
-        result.update(_getTenure(args))
-        result.update(_getBurnedForests(args))
-        result.update(_getReforestation(args))
-        result.update(_getForestCertification(args))
-        result.update(_getLossOutsidePlantations(args))
-        result.update(_getBounds(args))
-        result.update(_getUmd(args))
-        result.update(_getIfl(args))
-        result.update(_getstory(args))
+        if 'thresh' not in args:
+            args['thresh'] = 30
+        sections, errors = _fetch_sections(
+            args, SECTIONS, BLOCKING_SECTIONS)
+        result.update(sections)
+        if errors:
+            result['errors'] = errors
 
     return 'respond', result
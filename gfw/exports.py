@@ -0,0 +1,179 @@
+# Global Forest Watch API
+# Copyright (C) 2015 World Resource Institute
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""This module materializes CartoDB downloads in Cloud Storage.
+
+The first request for a download enqueues a task that runs the CartoDB
+export once and writes the file to the analysis bucket. Requests for the
+same query and dataset version are then redirected to the stored file.
+
+The export is fetched in one urlfetch response, so files over its 32 MB
+limit fail with an error rather than being stored truncated."""
+
+import datetime
+import logging
+from hashlib import md5
+
+from google.appengine.api import taskqueue
+from google.appengine.api import urlfetch
+from google.appengine.ext import ndb
+
+from gfw import gcs
+from gfw.common import APP_BASE_URL
+from gfw.common import CONTENT_TYPES
+from gfw.common import GCS_URL_TMPL
+
+QUEUE = 'exports'
+
+# Seconds an export task waits for CartoDB
+FETCH_DEADLINE = 600
+
+# Pending exports older than this are taken as failed, since a task that
+# hits the request deadline dies without recording its failure
+PENDING_SECONDS = 3 * FETCH_DEADLINE
+
+# Failed exports are started again this many times, waiting RETRY_SECONDS
+# after the first failure and twice as long after each next one
+MAX_ATTEMPTS = 3
+RETRY_SECONDS = 5 * 60
+
+PENDING = 'pending'
+DONE = 'done'
+ERROR = 'error'
+
+
+class Export(ndb.Model):
+    """A CartoDB download and where it stands, keyed by get_id()."""
+    url = ndb.TextProperty()
+    fmt = ndb.StringProperty(indexed=False)
+    status = ndb.StringProperty()
+    error = ndb.TextProperty()
+    attempts = ndb.IntegerProperty(default=0, indexed=False)
+    started = ndb.DateTimeProperty(indexed=False)
+    created = ndb.DateTimeProperty(auto_now_add=True)
+    updated = ndb.DateTimeProperty(auto_now=True)
+
+
+def get_id(url, version=None):
+    """Return the export id for a CartoDB download URL and data version."""
+    return md5('%s#%s' % (url, version)).hexdigest()
+
+
+def _filename(export_id):
+    return '/exports/%s' % export_id
+
+
+def file_url(export):
+    """Return the public URL of a stored export."""
+    return GCS_URL_TMPL % (_filename(export.key.id()), export.fmt)
+
+
+def status_url(export_id):
+    return '%s/forest-change/exports/%s' % (APP_BASE_URL, export_id)
+
+
+def status(export):
+    """Return the status response for an export."""
+    result = dict(id=export.key.id(), status=export.status,
+                  status_url=status_url(export.key.id()))
+    if export.status == DONE:
+        result['url'] = file_url(export)
+    elif export.status == ERROR:
+        result['error'] = export.error
+    return dict(export=result)
+
+
+def _retry_at(export):
+    """Return when a failed export may be started again, or None."""
+    if export.attempts >= MAX_ATTEMPTS:
+        return None
+    delay = RETRY_SECONDS * 2 ** max(export.attempts - 1, 0)
+    return export.updated + datetime.timedelta(seconds=delay)
+
+
+def _stalled(export):
+    """Return True if export has been pending for over PENDING_SECONDS."""
+    started = export.started or export.created
+    return export.status == PENDING and started + datetime.timedelta(
+        seconds=PENDING_SECONDS) < datetime.datetime.utcnow()
+
+
+@ndb.transactional
+def _start(export_id, url, fmt):
+    """Return the export, creating it and enqueueing its task if needed.
+
+    Failed exports, and exports pending for too long, are started again
+    once their retry delay has passed, up to MAX_ATTEMPTS times."""
+    export = Export.get_by_id(export_id)
+    if export and _stalled(export):
+        export.status = ERROR
+        export.error = 'Export did not finish in %s seconds' % PENDING_SECONDS
+        export.put()
+    if export and export.status != ERROR:
+        return export
+    if export:
+        retry_at = _retry_at(export)
+        if not retry_at or retry_at > datetime.datetime.utcnow():
+            return export
+    attempts = export.attempts + 1 if export else 1
+    export = Export(id=export_id, url=url, fmt=fmt, status=PENDING,
+                    attempts=attempts, started=datetime.datetime.utcnow())
+    export.put()
+    taskqueue.add(url='/cache/tasks/export', queue_name=QUEUE,
+                  params=dict(id=export_id), transactional=True)
+    return export
+
+
+def download(url, fmt, version=None):
+    """Return (action, data) for a CartoDB download URL.
+
+    Redirects to the stored file once exported, otherwise responds with
+    the export status."""
+    export = _start(get_id(url, version), url, fmt)
+    if export.status == DONE:
+        return 'redirect', file_url(export)
+    return 'respond', status(export)
+
+
+def _fetch(url):
+    """Return the body of the CartoDB export at url."""
+    try:
+        response = urlfetch.fetch(url, deadline=FETCH_DEADLINE)
+    except urlfetch.ResponseTooLargeError:
+        raise ValueError('Export is too large to store, try a smaller area')
+    if response.status_code != 200:
+        raise ValueError('CartoDB Error: %s' % response.content)
+    return response.content
+
+
+def run(export_id):
+    """Run the CartoDB export for export_id and store the file."""
+    export = Export.get_by_id(export_id)
+    if not export or export.status != PENDING:
+        return export
+    try:
+        gcs.create_file(_fetch(export.url),
+                        '%s.%s' % (_filename(export_id), export.fmt),
+                        CONTENT_TYPES.get(export.fmt,
+                                          'application/octet-stream'))
+        export.status = DONE
+    except Exception, e:
+        logging.exception(e)
+        export.status = ERROR
+        export.error = '%s' % (e.message or e)
+    export.put()
+    return export
@@ -19,10 +19,18 @@
 
 """This module is the entry point for the forest change API."""
 
+import collections
+import json
 import logging
 import re
+import threading
 import webapp2
 
+from hashlib import md5
+
+from gfw import cache
+from gfw import exports
+from gfw import geometry
 from gfw.forestchange import forma
 from gfw.forestchange import fires
 from gfw.forestchange import umd
@@ -36,6 +44,9 @@ from gfw.forestchange import glad
 from gfw.forestchange import viirs
 from gfw.forestchange import loss_by_type
 from gfw.forestchange import args
+from gfw.forestchange import common
+from gfw.forestchange import series
+from gfw.forestchange import versions
 
 from gfw.middlewares.cors import CORSRequestHandler
 from gfw.common import APP_BASE_URL
@@ -67,14 +78,14 @@ META = {
             "id": "forma-alerts"
         },
         'apis': {
-            'world': '%s{?period,geojson,download,bust,dev}' % FORMA_API,
-            'national': '%s/admin{/iso}{?period,download,bust,dev}' %
+            'world': '%s{?period,interval,geojson,download,bust,dev}' % FORMA_API,
+            'national': '%s/admin{/iso}{?period,interval,download,bust,dev}' %
             FORMA_API,
-            'subnational': '%s/admin{/iso}{/id1}{?period,download,bust,dev}' %
+            'subnational': '%s/admin{/iso}{/id1}{?period,interval,download,bust,dev}' %
             FORMA_API,
-            'use': '%s/use/{/name}{/id}{?period,download,bust,dev}' %
+            'use': '%s/use/{/name}{/id}{?period,interval,download,bust,dev}' %
             FORMA_API,
-            'wdpa': '%s/wdpa/{/id}{?period,download,bust,dev}' %
+            'wdpa': '%s/wdpa/{/id}{?period,interval,download,bust,dev}' %
             FORMA_API
         }
     },
@@ -91,14 +102,14 @@ META = {
             "id": "nasa-active-fires"
         },
         'apis': {
-            'world': '%s{?period,geojson,download,bust,dev}' % FIRES_API,
-            'national': '%s/admin{/iso}{?period,download,bust,dev}' %
+            'world': '%s{?period,interval,geojson,download,bust,dev}' % FIRES_API,
+            'national': '%s/admin{/iso}{?period,interval,download,bust,dev}' %
             FIRES_API,
-            'subnational': '%s/admin{/iso}{/id1}{?period,download,bust,dev}' %
+            'subnational': '%s/admin{/iso}{/id1}{?period,interval,download,bust,dev}' %
             FIRES_API,
-            'use': '%s/use/{/name}{/id}{?period,download,bust,dev}' %
+            'use': '%s/use/{/name}{/id}{?period,interval,download,bust,dev}' %
             FIRES_API,
-            'wdpa': '%s/wdpa/{/id}{?period,download,bust,dev}' %
+            'wdpa': '%s/wdpa/{/id}{?period,interval,download,bust,dev}' %
             FIRES_API
         }
     },
@@ -117,14 +128,14 @@ META = {
             "id": "quicc-alerts"
         },
         'apis': {
-            'global': '%s{?period,geojson,download,bust,dev}' % QUICC_API,
-            'national': '%s/admin{/iso}{?period,download,bust,dev}' %
+            'global': '%s{?period,interval,geojson,download,bust,dev}' % QUICC_API,
+            'national': '%s/admin{/iso}{?period,interval,download,bust,dev}' %
             QUICC_API,
-            'subnational': '%s/admin{/iso}{/id1}{?period,download,bust,dev}' %
+            'subnational': '%s/admin{/iso}{/id1}{?period,interval,download,bust,dev}' %
             QUICC_API,
-            'use': '%s/use/{/name}{/id}{?period,download,bust,dev}' %
+            'use': '%s/use/{/name}{/id}{?period,interval,download,bust,dev}' %
             QUICC_API,
-            'wdpa': '%s/wdpa/{/id}{?period,download,bust,dev}' %
+            'wdpa': '%s/wdpa/{/id}{?period,interval,download,bust,dev}' %
             QUICC_API
         }
     },
@@ -219,14 +230,14 @@ META = {
             "id": "terrai-alerts"
         },
         'apis': {
-            'world': '%s{?period,geojson,download,bust,dev}' % TERRAI_API,
-            'national': '%s/admin{/iso}{?period,download,bust,dev}' %
+            'world': '%s{?period,interval,geojson,download,bust,dev}' % TERRAI_API,
+            'national': '%s/admin{/iso}{?period,interval,download,bust,dev}' %
             TERRAI_API,
-            'subnational': '%s/admin{/iso}{/id1}{?period,download,bust,dev}' %
+            'subnational': '%s/admin{/iso}{/id1}{?period,interval,download,bust,dev}' %
             TERRAI_API,
-            'use': '%s/use/{/name}{/id}{?period,download,bust,dev}' %
+            'use': '%s/use/{/name}{/id}{?period,interval,download,bust,dev}' %
             TERRAI_API,
-            'wdpa': '%s/wdpa/{/id}{?period,download,bust,dev}' %
+            'wdpa': '%s/wdpa/{/id}{?period,interval,download,bust,dev}' %
             TERRAI_API
         }
     },
@@ -291,14 +302,14 @@ META = {
             "id": "glad-alerts"
         },
         'apis': {
-            'world': '%s{?period,geojson,download,bust,dev}' % GLAD_API,
-            'national': '%s/admin{/iso}{?period,download,bust,dev}' %
+            'world': '%s{?period,interval,geojson,download,bust,dev}' % GLAD_API,
+            'national': '%s/admin{/iso}{?period,interval,download,bust,dev}' %
             GLAD_API,
-            'subnational': '%s/admin{/iso}{/id1}{?period,download,bust,dev}' %
+            'subnational': '%s/admin{/iso}{/id1}{?period,interval,download,bust,dev}' %
             GLAD_API,
-            'use': '%s/use/{/name}{/id}{?period,download,bust,dev}' %
+            'use': '%s/use/{/name}{/id}{?period,interval,download,bust,dev}' %
             GLAD_API,
-            'wdpa': '%s/wdpa/{/id}{?period,download,bust,dev}' %
+            'wdpa': '%s/wdpa/{/id}{?period,interval,download,bust,dev}' %
             GLAD_API
         }
     },
@@ -315,14 +326,14 @@ META = {
             "id": "viirs-active-fires"
         },
         'apis': {
-            'world': '%s{?period,geojson,download,bust,dev}' % VIIRS_API,
-            'national': '%s/admin{/iso}{?period,download,bust,dev}' %
+            'world': '%s{?period,interval,geojson,download,bust,dev}' % VIIRS_API,
+            'national': '%s/admin{/iso}{?period,interval,download,bust,dev}' %
             VIIRS_API,
-            'subnational': '%s/admin{/iso}{/id1}{?period,download,bust,dev}' %
+            'subnational': '%s/admin{/iso}{/id1}{?period,interval,download,bust,dev}' %
             VIIRS_API,
-            'use': '%s/use/{/name}{/id}{?period,download,bust,dev}' %
+            'use': '%s/use/{/name}{/id}{?period,interval,download,bust,dev}' %
             VIIRS_API,
-            'wdpa': '%s/wdpa/{/id}{?period,download,bust,dev}' %
+            'wdpa': '%s/wdpa/{/id}{?period,interval,download,bust,dev}' %
             VIIRS_API
         }
     },
@@ -336,31 +347,31 @@ META = {
 # Maps dataset to accepted query params
 PARAMS = {
     'forma-alerts': {
-        'all': ['period', 'download', 'geojson', 'dev', 'bust'],
-        'iso': ['period', 'download', 'dev', 'bust'],
-        'id1': ['period', 'download', 'dev', 'bust'],
-        'wdpa': ['period', 'download', 'dev', 'bust'],
-        'use': ['period', 'download', 'dev', 'bust'],
+        'all': ['period', 'interval', 'download', 'geojson', 'geostore', 'dev', 'bust'],
+        'iso': ['period', 'interval', 'download', 'dev', 'bust'],
+        'id1': ['period', 'interval', 'download', 'dev', 'bust'],
+        'wdpa': ['period', 'interval', 'download', 'dev', 'bust'],
+        'use': ['period', 'interval', 'download', 'dev', 'bust'],
         'latest': ['bust', 'limit']
     },
     'nasa-active-fires': {
-        'all': ['period', 'download', 'geojson', 'dev', 'bust'],
-        'iso': ['period', 'download', 'dev', 'bust'],
-        'id1': ['period', 'download', 'dev', 'bust'],
-        'wdpa': ['period', 'download', 'dev', 'bust'],
-        'use': ['period', 'download', 'dev', 'bust'],
+        'all': ['period', 'interval', 'download', 'geojson', 'geostore', 'dev', 'bust'],
+        'iso': ['period', 'interval', 'download', 'dev', 'bust'],
+        'id1': ['period', 'interval', 'download', 'dev', 'bust'],
+        'wdpa': ['period', 'interval', 'download', 'dev', 'bust'],
+        'use': ['period', 'interval', 'download', 'dev', 'bust'],
         'latest': ['bust', 'limit']
     },
     'quicc-alerts': {
-        'all': ['period', 'download', 'geojson', 'dev', 'bust'],
-        'iso': ['period', 'download', 'dev', 'bust'],
-        'id1': ['period', 'download', 'dev', 'bust'],
-        'wdpa': ['period', 'download', 'dev', 'bust'],
-        'use': ['period', 'download', 'dev', 'bust'],
+        'all': ['period', 'interval', 'download', 'geojson', 'geostore', 'dev', 'bust'],
+        'iso': ['period', 'interval', 'download', 'dev', 'bust'],
+        'id1': ['period', 'interval', 'download', 'dev', 'bust'],
+        'wdpa': ['period', 'interval', 'download', 'dev', 'bust'],
+        'use': ['period', 'interval', 'download', 'dev', 'bust'],
         'latest': ['bust', 'limit']
     },
     'imazon-alerts': {
-        'all': ['period', 'download', 'geojson', 'dev', 'bust'],
+        'all': ['period', 'download', 'geojson', 'geostore', 'dev', 'bust'],
         'iso': ['period', 'download', 'dev', 'bust'],
         'id1': ['period', 'download', 'dev', 'bust'],
         'wdpa': ['period', 'download', 'dev', 'bust'],
@@ -368,33 +379,33 @@ PARAMS = {
         'latest': ['bust', 'limit']
     },
     'umd-loss-gain': {
-        'all': ['thresh', 'geojson', 'period', 'dev', 'bust'],
+        'all': ['thresh', 'geojson', 'geostore', 'period', 'dev', 'bust'],
         'iso': ['download', 'dev', 'bust', 'thresh'],
         'ifl': ['download', 'dev', 'bust', 'thresh'],
         'ifl_id1': ['download', 'dev', 'bust', 'thresh'],
         'id1': ['download', 'dev', 'bust', 'thresh'],
-        'wdpa': ['download', 'dev', 'bust', 'thresh'],
-        'use': ['download', 'dev', 'bust', 'thresh']
+        'wdpa': ['period', 'download', 'dev', 'bust', 'thresh'],
+        'use': ['period', 'download', 'dev', 'bust', 'thresh']
     },
     'biomass-loss': {
-        'all': ['thresh', 'geojson', 'period', 'dev', 'bust'],
+        'all': ['thresh', 'geojson', 'geostore', 'period', 'dev', 'bust'],
         'iso': ['download', 'dev', 'bust', 'thresh'],
         'ifl': ['download', 'dev', 'bust', 'thresh'],
         'ifl_id1': ['download', 'dev', 'bust', 'thresh'],
         'id1': ['download', 'dev', 'bust', 'thresh'],
-        'wdpa': ['download', 'dev', 'bust', 'thresh'],
-        'use': ['download', 'dev', 'bust', 'thresh']
+        'wdpa': ['period', 'download', 'dev', 'bust', 'thresh'],
+        'use': ['period', 'download', 'dev', 'bust', 'thresh']
     },
     'terrai-alerts': {
-        'all': ['period', 'download', 'geojson', 'dev', 'bust'],
-        'iso': ['period', 'download', 'dev', 'bust'],
-        'id1': ['period', 'download', 'dev', 'bust'],
-        'wdpa': ['period', 'download', 'dev', 'bust'],
-        'use': ['period', 'download', 'dev', 'bust'],
+        'all': ['period', 'interval', 'download', 'geojson', 'geostore', 'dev', 'bust'],
+        'iso': ['period', 'interval', 'download', 'dev', 'bust'],
+        'id1': ['period', 'interval', 'download', 'dev', 'bust'],
+        'wdpa': ['period', 'interval', 'download', 'dev', 'bust'],
+        'use': ['period', 'interval', 'download', 'dev', 'bust'],
         'latest': ['bust', 'limit']
     },
     'prodes-loss': {
-        'all': ['period', 'download', 'geojson', 'dev', 'bust'],
+        'all': ['period', 'download', 'geojson', 'geostore', 'dev', 'bust'],
         'iso': ['period', 'download', 'dev', 'bust'],
         'id1': ['period', 'download', 'dev', 'bust'],
         'wdpa': ['period', 'download', 'dev', 'bust'],
@@ -402,7 +413,7 @@ PARAMS = {
         'latest': ['bust', 'limit']
     },
     'guyra-loss': {
-        'all': ['period', 'download', 'geojson', 'dev', 'bust'],
+        'all': ['period', 'download', 'geojson', 'geostore', 'dev', 'bust'],
         'iso': ['period', 'download', 'dev', 'bust'],
         'id1': ['period', 'download', 'dev', 'bust'],
         'wdpa': ['period', 'download', 'dev', 'bust'],
@@ -410,26 +421,32 @@ PARAMS = {
         'latest': ['bust', 'limit']
     },
     'glad-alerts': {
-        'all': ['period', 'download', 'geojson', 'dev', 'bust'],
-        'iso': ['period', 'download', 'dev', 'bust'],
-        'id1': ['period', 'download', 'dev', 'bust'],
-        'wdpa': ['period', 'download', 'dev', 'bust'],
-        'use': ['period', 'download', 'dev', 'bust'],
+        'all': ['period', 'interval', 'download', 'geojson', 'geostore', 'dev', 'bust'],
+        'iso': ['period', 'interval', 'download', 'dev', 'bust'],
+        'id1': ['period', 'interval', 'download', 'dev', 'bust'],
+        'wdpa': ['period', 'interval', 'download', 'dev', 'bust'],
+        'use': ['period', 'interval', 'download', 'dev', 'bust'],
         'latest': ['bust', 'limit']
     },
     'viirs-active-fires': {
-        'all': ['period', 'download', 'geojson', 'dev', 'bust'],
-        'iso': ['period', 'download', 'dev', 'bust'],
-        'id1': ['period', 'download', 'dev', 'bust'],
-        'wdpa': ['period', 'download', 'dev', 'bust'],
-        'use': ['period', 'download', 'dev', 'bust'],
+        'all': ['period', 'interval', 'download', 'geojson', 'geostore', 'dev', 'bust'],
+        'iso': ['period', 'interval', 'download', 'dev', 'bust'],
+        'id1': ['period', 'interval', 'download', 'dev', 'bust'],
+        'wdpa': ['period', 'interval', 'download', 'dev', 'bust'],
+        'use': ['period', 'interval', 'download', 'dev', 'bust'],
         'latest': ['bust', 'limit']
     },
     'loss-by-type': {
-        'all': ['aggregate_by', 'geojson']
+        'all': ['aggregate_by', 'geojson', 'geostore', 'dev', 'bust']
     }
 }
 
+# Query args that define the analysis area for world queries
+AREA_ARGS = ['geojson', 'geostore']
+
+# Upper bound on datasets running at once for one batch request
+MAX_CONCURRENT_DATASETS = 4
+
 # Maps dataset name to target module for execution
 TARGETS = {
     'forma-alerts': forma,
@@ -448,12 +465,143 @@ TARGETS = {
 }
 
 
-def _dataset_from_path(path):
-    """Return dataset name from supplied request path.
+# Seconds before cached results turn stale, keyed on META 'updates':
+DAY = 24 * 60 * 60
+SOFT_TTLS = {
+    'Daily': DAY,
+    'Weekly': 7 * DAY,
+    'Monthly': 30 * DAY,
+}
+DEFAULT_SOFT_TTL = 30 * DAY
+
+
+def soft_ttl(dataset):
+    """Return seconds before a cached dataset result should be refreshed."""
+    updates = META[dataset]['meta'].get('updates', '')
+    return SOFT_TTLS.get(updates, DEFAULT_SOFT_TTL)
+
+
+def get_area(raw_args):
+    """Return area params for the geojson or geostore query args.
+
+    Geostore ids are resolved to their geometry, and detailed polygons are
+    simplified before queries and cache keys are built from them."""
+    area = args.process(
+        dict((k, v) for k, v in raw_args.iteritems() if k in AREA_ARGS))
+
+    # Areas saved in the geostore are resolved server-side
+    if 'geostore' in area:
+        area['geojson'] = args.geostore_geojson(area['geostore'])
+
+    if 'geojson' in area:
+        simplified, simplification = _simplify(area['geojson'])
+        if simplification:
+            area['geojson'] = simplified
+            area['simplification'] = simplification
+    return area
+
+
+def _simplify(geojson):
+    """Return (geojson, simplification) from geometry.simplify(), cached on
+    the raw geojson so repeated requests don't simplify it again."""
+    if not isinstance(geojson, basestring):
+        geojson = json.dumps(geojson, sort_keys=True)
+    key = 'simplified:%s' % md5(geojson).hexdigest()
+    result = cache.get(key)
+    if result is None:
+        simplified, simplification = geometry.simplify(geojson)
+        if simplification:
+            result = json.dumps(simplified), simplification
+        else:
+            result = None, None
+        cache.set(key, result)
+    return result
+
+
+def get_params(path, raw_args, area=None):
+    """Return (dataset, rtype, params) for a request path and query args.
+
+    Query args not listed in PARAMS[dataset][rtype] are ignored. An area
+    from get_area() may be passed in when it is shared across requests.
+    Returns (None, None, None) for unsupported paths."""
+    dataset, rtype, path_args = dispatch(path)
+    if not rtype:
+        return None, None, None
+    only = PARAMS[dataset][rtype]
+    query_args = args.process(dict((k, v) for k, v in raw_args.iteritems()
+                                   if k in only and k not in AREA_ARGS))
+    params = dict(query_args, **path_args)
+    if 'geojson' in only:
+        params.update(get_area(raw_args) if area is None else area)
+
+    # Queries for all require a geojson constraint for performance
+    if rtype == 'all' and 'geojson' not in params:
+        raise args.GeoJsonArgError()
+    return dataset, rtype, params
+
+
+def get_rid(path, dataset, params):
+    """Return the cache key for a request, keyed on the dataset version."""
+    return cache.get_key(path, params, versions.get(dataset))
+
+
+# Request types by path suffix after /forest-change/{dataset}, in order of
+# precedence. Named groups become path args.
+ROUTES = [
+    ('all', r''),
+    ('latest', r'/latest'),
+    ('ifl', r'(?:/admin)?/ifl/(?P<iso>[A-z]{3})'),
+    ('ifl_id1', r'(?:/admin)?/ifl/(?P<iso>[A-z]{3})/(?P<id1>\d+)'),
+    ('iso', r'/(?:admin|iso)/(?P<iso>[A-z]{3})'),
+    ('id1', r'/(?:admin|iso)/(?P<iso>[A-z]{3})/(?P<id1>\d+)'),
+    ('wdpa', r'/wdpa/(?P<wdpaid>\d+(?:,\d+)*)'),
+    ('use', r'/use/(?P<use>[A-z]+)/(?P<useid>\d+(?:,\d+)*)'),
+]
+
+# Path args implied by the request type alone
+ROUTE_FLAGS = {
+    'latest': dict(latest=True),
+    'ifl': dict(ifl=True),
+    'ifl_id1': dict(ifl_id1=True),
+}
+
+
+def _compile_routes(routes):
+    """Return one regex for all routes and (rtype, {group: arg}) by index.
+
+    Each route is wrapped in its own group with uniquely prefixed inner
+    groups, so the match's lastgroup identifies the route."""
+    alternatives = []
+    names = {}
+    for index, (rtype, pattern) in enumerate(routes):
+        prefix = 'r%s_' % index
+        pattern = pattern.replace('(?P<', '(?P<%s' % prefix)
+        alternatives.append('(?P<r%s>%s)' % (index, pattern))
+        arg_names = re.findall(r'\(\?P<%s(\w+)>' % prefix, pattern)
+        names['r%s' % index] = (
+            rtype, dict((prefix + arg, arg) for arg in arg_names))
+    regex = re.compile(r'^/?forest-change/(?P<dataset>[^/]+)(?:%s)/?$' %
+                       '|'.join(alternatives))
+    return regex, names
 
-    Path format: /forest-change/{dataset}/..."""
-    tokens = path.split('/')
-    return tokens[2] if len(tokens) >= 1 else None
+_DISPATCH, _DISPATCH_ROUTES = _compile_routes(ROUTES)
+
+
+def dispatch(path):
+    """Return (dataset, rtype, path_args) for supplied request path.
+
+    Returns (None, None, None) if the path matches no request type.
+
+    Example: /forest-change/forma-alerts/admin/BRA/1 =>
+        (forma-alerts, id1, {'iso': 'BRA', 'id1': '1'})"""
+    match = _DISPATCH.match(path)
+    if not match:
+        return None, None, None
+    rtype, names = _DISPATCH_ROUTES[match.lastgroup]
+    path_args = dict(ROUTE_FLAGS.get(rtype, {}))
+    for group, arg in names.iteritems():
+        path_args[arg] = match.group(group)
+    return match.group('dataset'), rtype, path_args
 
 
 def _classify_request(path):
@@ -462,37 +610,22 @@ def _classify_request(path):
     Returns 2-tuple (dataset,request_type)
 
     Example: /forest-change/forma-alerts/admin/iso => (forma-alerts, iso)"""
+    dataset, rtype, path_args = dispatch(path)
+    return dataset, rtype
 
-    dataset = _dataset_from_path(path)
-    path = path.strip("/")
-    rtype = None
-
-    if re.match(r'forest-change/%s$' % dataset, path):
-        rtype = 'all'
-    elif re.match(r'forest-change/%s/latest$' % dataset, path):
-        rtype = 'latest'
-    elif re.match(r'forest-change/%s/admin/ifl/[A-z]{3,3}$' % dataset, path):
-        rtype = 'ifl'
-    elif re.match(r'forest-change/%s/admin/ifl/[A-z]{3,3}/\d+$' % dataset, path):
-        rtype = 'ifl_id1'
-    elif re.match(r'forest-change/%s/ifl/[A-z]{3,3}$' % dataset, path):
-        rtype = 'ifl'
-    elif re.match(r'forest-change/%s/ifl/[A-z]{3,3}/\d+$' % dataset, path):
-        rtype = 'ifl_id1'
-    elif re.match(r'forest-change/%s/admin/[A-z]{3,3}$' % dataset, path):
-        rtype = 'iso'
-    elif re.match(r'forest-change/%s/admin/[A-z]{3,3}/\d+$' % dataset, path):
-        rtype = 'id1'
-    elif re.match(r'forest-change/%s/iso/[A-z]{3,3}$' % dataset, path):
-        rtype = 'iso'
-    elif re.match(r'forest-change/%s/iso/[A-z]{3,3}/\d+$' % dataset, path):
-        rtype = 'id1'
-    elif re.match(r'forest-change/%s/wdpa/\d+$' % dataset, path):
-        rtype = 'wdpa'
-    elif re.match(r'forest-change/%s/use/[A-z]+/\d+$' % dataset, path):
-        rtype = 'use'
 
-    return dataset, rtype
+def _batch_path(dataset, params):
+    """Return the single dataset request path for a batch area."""
+    tokens = ['', 'forest-change', dataset]
+    if params.get('wdpaid'):
+        tokens += ['wdpa', params['wdpaid']]
+    elif params.get('use'):
+        tokens += ['use', params['use'], params.get('useid', '')]
+    elif params.get('iso'):
+        tokens += ['admin', params['iso']]
+        if params.get('id1'):
+            tokens.append(params['id1'])
+    return '/'.join(tokens)
 
 
 class Handler(CORSRequestHandler):
@@ -510,7 +643,15 @@ class Handler(CORSRequestHandler):
                 self.complete('respond', META)
                 return
 
-            dataset, rtype = _classify_request(path)
+            if path.rstrip('/') == '/forest-change/batch':
+                self.complete('respond', self.batch(self.args()))
+                return
+
+            if path.startswith('/forest-change/exports/'):
+                self.export_status(path.rstrip('/').split('/')[-1])
+                return
+
+            dataset, rtype, params = get_params(path, self.args())
 
             # Unsupported dataset or reqest type
             if not dataset or not rtype:
@@ -518,27 +659,162 @@ class Handler(CORSRequestHandler):
                 return
 
             # Handle request
-            query_args = args.process(self.args(only=PARAMS[dataset][rtype]))
-            path_args = args.process_path(path, rtype)
-            params = dict(query_args, **path_args)
-
-            # Queries for all require a geojson constraint for performance
-            if rtype == 'all' and 'geojson' not in params:
-                raise args.GeoJsonArgError()
-
-            rid = self.get_id(params)
-            target = TARGETS[dataset]
-            action, data = self.get_or_execute(params, target, rid)
-
-            # Redirect if needed
-            if action != 'redirect':
-                data.update(META[dataset])
-
+            action, data = self.execute_dataset(path, dataset, params)
             self.complete(action, data)
         except (Exception, args.ArgError), e:
             logging.exception(e)
             self.write_error(400, e.message)
 
+    def execute_dataset(self, path, dataset, params):
+        """Return (action, data) for one dataset request, using the cache."""
+        key = common.AREA_KEYS.get(common.classify_query(params))
+        if key and ',' in params[key]:
+            return 'respond', self.execute_areas(path, dataset, params, key)
+
+        if 'format' in params:
+            return self.download(dataset, params)
+
+        if 'interval' in params:
+            action, data = series.execute(
+                path, dataset, params, soft_ttl(dataset))
+            if action == 'respond':
+                data.update(META[dataset])
+            return action, data
+
+        rid = get_rid(path, dataset, params)
+        target = TARGETS[dataset]
+        action, data = self.get_or_execute(
+            params, target, rid, soft_ttl=soft_ttl(dataset))
+
+        # Redirect if needed
+        if action != 'redirect':
+            data.update(META[dataset])
+        return action, data
+
+    def download(self, dataset, params):
+        """Return (action, data) for a download, exported once to GCS."""
+        action, data = TARGETS[dataset].execute(dict(params))
+        if action != 'redirect':
+            return action, data
+        return exports.download(data, params['format'], versions.get(dataset))
+
+    def export_status(self, export_id):
+        """Redirect to a finished export or respond with its status."""
+        export = exports.Export.get_by_id(export_id)
+        if not export:
+            self.error(404)
+        elif export.status == exports.DONE:
+            self.redirect(exports.file_url(export))
+        else:
+            if export.status == exports.PENDING:
+                self.response.set_status(202)
+            self.write(json.dumps(exports.status(export), sort_keys=True))
+
+    def execute_areas(self, path, dataset, params, key):
+        """Return results for a wdpa or use request over several area ids.
+
+        Each area is cached under the key of its single area request, and
+        areas missing from the cache are queried with one CartoDB request."""
+        ids = []
+        for area_id in params[key].split(','):
+            if area_id not in ids:
+                ids.append(area_id)
+        base = path.rstrip('/').rsplit('/', 1)[0]
+        if 'interval' in params:
+            return {'areas': dict(
+                (area_id, self.execute_dataset(
+                    '%s/%s' % (base, area_id), dataset,
+                    dict(params, **{key: area_id}))[1])
+                for area_id in ids)}
+        target = TARGETS[dataset]
+        results = {}
+        missing = []
+        for area_id in ids:
+            area_path = '%s/%s' % (base, area_id)
+            area_params = dict(params, **{key: area_id})
+            rid = get_rid(area_path, dataset, area_params)
+            result = None if 'bust' in params else cache.get(rid)
+            if result:
+                results[area_id] = result[1]
+            else:
+                missing.append((area_id, area_params, rid))
+
+        with common.multi_area([area_id for area_id, _, _ in missing]):
+            for area_id, area_params, rid in missing:
+                action, data = self.execute_and_cache(
+                    area_params, target, rid, soft_ttl(dataset))
+                if action != 'respond':
+                    data = {'error': data.get('error')
+                            if isinstance(data, dict) else '%s' % (data,)}
+                results[area_id] = data
+
+        for data in results.values():
+            data.update(META[dataset])
+        return {'areas': results}
+
+    def batch(self, raw_args):
+        """Return results of several datasets for one area.
+
+        The area is parsed once and the datasets run concurrently, at most
+        MAX_CONCURRENT_DATASETS at a time, each cached under the same key as
+        its single dataset request."""
+        datasets = []
+        for dataset in raw_args.get('datasets', '').split(','):
+            if dataset and dataset not in datasets:
+                datasets.append(dataset)
+        if not datasets:
+            raise ValueError('datasets is required, e.g. '
+                             'datasets=glad-alerts,terrai-alerts')
+        if len(datasets) > len(TARGETS):
+            raise ValueError('At most %d datasets are supported' %
+                             len(TARGETS))
+        area = get_area(raw_args)
+        raw_args = dict((k, v) for k, v in raw_args.iteritems()
+                        if k not in ['datasets', 'download'])
+        results = {}
+        requests = []
+        for dataset in datasets:
+            try:
+                if dataset not in TARGETS:
+                    raise ValueError('Unknown dataset %s' % dataset)
+                path = _batch_path(dataset, raw_args)
+                if dispatch(path)[1] not in PARAMS[dataset]:
+                    raise ValueError('Unsupported request %s' % path)
+                params = get_params(path, raw_args, area)[2]
+                requests.append((dataset, path, params))
+            except Exception, e:
+                results[dataset] = {'error': '%s' % (e.message or e)}
+
+        def run(dataset, path, params):
+            try:
+                action, data = self.execute_dataset(path, dataset, params)
+                if action == 'error':
+                    data = {'error': data.get('error') or data.get('message')}
+                elif action != 'respond':
+                    data = {'error': '%s' % (data,)}
+            except Exception, e:
+                logging.exception(e)
+                data = {'error': '%s' % (e.message or e)}
+            results[dataset] = data
+
+        pending = collections.deque(requests)
+
+        def work():
+            while True:
+                try:
+                    request = pending.popleft()
+                except IndexError:
+                    return
+                run(*request)
+
+        threads = [threading.Thread(target=work) for _ in
+                   range(min(MAX_CONCURRENT_DATASETS, len(requests)))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return {'datasets': results}
+
 
 handlers = webapp2.WSGIApplication([
     (r'/forest-change.*', Handler)],
@@ -20,15 +20,21 @@
 import datetime
 import json
 
-
-def process_path(path, *params):
-    return PathProcessor.process(path, params)
+from gfw.geostore import geostore
 
 
 def process(args):
     return ArgProcessor.process(args)
 
 
+def geostore_geojson(geostore_id):
+    """Return the geometry stored under geostore_id as a GeoJSON string."""
+    try:
+        return geostore.get_geometry(geostore_id)[0]
+    except Exception:
+        raise GeostoreArgError()
+
+
 class ArgError(ValueError):
     def __init__(self, msg):
         super(ArgError, self).__init__(msg)
@@ -66,6 +72,14 @@ class PeriodArgError(ArgError):
         super(PeriodArgError, self).__init__(msg)
 
 
+class IntervalArgError(ArgError):
+    USAGE = """One of day, week, month or year."""
+
+    def __init__(self):
+        msg = 'Invalid interval parameter! Usage: %s' % self.USAGE
+        super(IntervalArgError, self).__init__(msg)
+
+
 class GeoJsonArgError(ArgError):
     USAGE = """Valid Polygon or MultiPolygon GeoJSON string."""
 
@@ -74,6 +88,14 @@ class GeoJsonArgError(ArgError):
         super(GeoJsonArgError, self).__init__(msg)
 
 
+class GeostoreArgError(ArgError):
+    USAGE = """Id of a Polygon or MultiPolygon saved with /geostore."""
+
+    def __init__(self):
+        msg = 'Invalid geostore parameter! Usage: %s' % self.USAGE
+        super(GeostoreArgError, self).__init__(msg)
+
+
 class DownloadArgError(ArgError):
     USAGE = """filename.{csv | kml | shp | geojson | svg}"""
 
@@ -99,89 +121,13 @@ class WdpaIdArgError(ArgError):
 
 
 class ThreshArgError(ArgError):
-    USAGE = """thresh must be either 10, 15, 20, 25, 30, 50, 75"""
+    USAGE = """thresh must be either 10, 15, 20, 25, 30, 50, 75 or all"""
 
     def __init__(self):
         msg = 'Invalid wdpaid parameter! Usage: %s' % self.USAGE
         super(ThreshArgError, self).__init__(msg)
 
 
-class PathProcessor():
-    @classmethod
-    def iso(cls, path):
-        try:
-            return dict(iso=path.split('/')[4])
-        except:
-            raise Exception('Unable to process iso from request path')
-
-    @classmethod
-    def id1(cls, path):
-        try:
-            arg = dict(id1=path.split('/')[5])
-            arg.update(cls.iso(path))
-            return arg
-        except:
-            raise Exception('Unable to process id1 from request path')
-
-    @classmethod
-    def ifl(cls, path):
-        try:
-            return dict(ifl=True,iso=path.split('/')[5])
-        except:
-            raise Exception('Unable to process iso from request path')
-
-    @classmethod
-    def ifl_id1(cls, path):
-        try:
-            parts = path.split('/')
-            return dict(ifl_id1=True,iso=parts[5],id1=parts[6])
-        except:
-            raise Exception('Unable to process iso from request path')
-
-    @classmethod
-    def wdpa(cls, path):
-        return cls.wdpaid(path)
-
-    @classmethod
-    def wdpaid(cls, path):
-        try:
-            return dict(wdpaid=path.split('/')[4])
-        except:
-            raise Exception('Unable to process wpdaid from request path')
-
-    @classmethod
-    def use(cls, path):
-        try:
-            arg = dict(use=path.split('/')[4])
-            arg.update(cls.useid(path))
-            return arg
-        except:
-            raise Exception('Unable to process name from request path')
-
-    @classmethod
-    def useid(cls, path):
-        try:
-            return dict(useid=path.split('/')[5])
-        except:
-            raise Exception('Unable to process nameid from request path')
-
-    @classmethod
-    def latest(cls, path):
-        try:
-            return dict(latest=True)
-        except:
-            raise Exception('Unable to process latest from request path')
-
-    @classmethod
-    def process(cls, path, params):
-        """Process parameter from supplied request path"""
-        result = {}
-        for param in params:
-            if hasattr(cls, param):
-                result.update(getattr(cls, param)(path))
-        return result
-
-
 class ArgProcessor():
 
     @classmethod
@@ -191,7 +137,7 @@ class ArgProcessor():
     @classmethod
     def thresh(cls, value):
         try:
-            if int(value) in [10, 15, 20, 25, 30, 50, 75]:
+            if value == 'all' or int(value) in [10, 15, 20, 25, 30, 50, 75]:
                 return dict(thresh=value)
             else:
                 raise
@@ -210,6 +156,12 @@ class ArgProcessor():
         except:
             raise PeriodArgError()
 
+    @classmethod
+    def interval(cls, value):
+        if value not in ['day', 'week', 'month', 'year']:
+            raise IntervalArgError()
+        return dict(interval=value)
+
     @classmethod
     def geojson(cls, value):
         try:
@@ -220,6 +172,12 @@ class ArgProcessor():
         except:
             raise GeoJsonArgError()
 
+    @classmethod
+    def geostore(cls, value):
+        if not value:
+            raise GeostoreArgError()
+        return {'geostore': value}
+
     @classmethod
     def download(cls, value):
         try:
@@ -22,9 +22,16 @@ import ee
 import logging
 import config
 
+from gfw import gee
+from gfw.forestchange.common import ALL_THRESH
 from gfw.forestchange.common import CartoDbExecutor
 from gfw.forestchange.common import Sql
+from gfw.forestchange.common import THRESHOLDS
 from gfw.forestchange.common import classify_query
+from gfw.forestchange.common import geometry_key
+from gfw.forestchange.common import get_loss
+from gfw.forestchange.common import loss_result
+from gfw.forestchange.common import split_thresholds
 
 
 def _get_coords(geojson):
@@ -37,8 +44,13 @@ def _sum_range(data, begin, end):
             if (key !='carbon') and (int(key) >= int(begin)) and (int(key) < int(end))])
 
 def _get_thresh_image(thresh, asset_id):
-    """Renames image bands using supplied threshold and returns image."""
+    """Renames image bands using supplied threshold and returns image.
+
+    With ALL_THRESH, the bands of every threshold are kept with their
+    threshold suffix."""
     image = ee.Image(asset_id)
+    if thresh == ALL_THRESH:
+        return image.select('.*_(%s)' % '|'.join(THRESHOLDS))
 
     before = image.select('.*_' + thresh).bandNames()
 
@@ -289,16 +301,18 @@ def _executeIflId1(args):
     return action, data
 
 
-def _execute_geojson(args):
-    """Query GEE using supplied args with threshold and geojson."""
+def _loss_key(args):
+    """Return the cache key of the loss vectors of args for any period."""
+    return 'biomass-loss:%s:%s:%s:%s' % (
+        config.assets['hansen_loss_thresh'], config.assets['biomass_2000'],
+        args.get('thresh'), geometry_key(args))
 
-    # Authenticate to GEE and maximize the deadline
-    ee.Initialize(config.EE_CREDENTIALS, config.EE_URL)
-    ee.data.setDeadline(60000)
 
-    # The forest cover threshold and polygon
-    thresh = str(args.get('thresh'))
-    geojson = json.loads(args.get('geojson'))
+def _ee_loss(geojson, thresh):
+    """Return {biomass, biomass_loss, tree_loss}, losses being by year.
+
+    With ALL_THRESH, return them by threshold."""
+    gee.initialize()
     # hansen tree cover loss by year
     hansen_loss_by_year = _ee(geojson, thresh, config.assets['hansen_loss_thresh'])
     logging.info('TREE_LOSS_RESULTS: %s' % hansen_loss_by_year)
@@ -306,9 +320,25 @@ def _execute_geojson(args):
     loss_by_year = _ee_biomass(geojson, thresh, config.assets['hansen_loss_thresh'], config.assets['biomass_2000'])
     logging.info('BIOMASS_LOSS_RESULTS: %s' % loss_by_year)
     # biomass (UMD doesn't permit disaggregation of forest gain by threshold).
-    biomass = loss_by_year['carbon']
+    biomass = loss_by_year.pop('carbon', None)
     logging.info('BIOMASS: %s' % biomass)
-    loss_by_year.pop("carbon",None)
+    if thresh != ALL_THRESH:
+        return dict(biomass=biomass, biomass_loss=loss_by_year,
+                    tree_loss=hansen_loss_by_year)
+    tree_loss = split_thresholds(hansen_loss_by_year)
+    biomass_loss = split_thresholds(loss_by_year)
+    return dict((t, dict(biomass=biomass, biomass_loss=biomass_loss[t],
+                         tree_loss=tree_loss[t])) for t in THRESHOLDS)
+
+
+def _get_loss(args, geojson=None, lookup=True):
+    """Return biomass and tree and biomass loss by year for args' area."""
+    return get_loss(args, _loss_key, _ee_loss, geojson, lookup)
+
+
+def _period_loss(args, loss):
+    """Return biomass and the losses over the period of args."""
+    loss_by_year = loss['biomass_loss']
 
     # Carbon (UMD doesn't permit disaggregation of forest gain by threshold).
     carbon_loss = _dict_unit_transform(loss_by_year, 0.5)
@@ -323,23 +353,41 @@ def _execute_geojson(args):
     end = args.get('end').split('-')[0]
     biomass_loss = _sum_range(loss_by_year, begin, end)
 
-    # Prepare result object
     result = {}
-    result['params'] = args
-    result['params']['geojson'] = json.loads(result['params']['geojson'])
-    result['biomass'] = biomass
+    result['biomass'] = loss['biomass']
     result['biomass_loss'] = biomass_loss
     result['biomass_loss_by_year'] = _dates_selector(loss_by_year,begin,end)
-    result['tree_loss_by_year'] = _dates_selector(hansen_loss_by_year,begin,end)
+    result['tree_loss_by_year'] = _dates_selector(loss['tree_loss'],begin,end)
     result['c_loss_by_year'] = _dates_selector(carbon_loss,begin,end)
     result['co2_loss_by_year'] = _dates_selector(carbon_dioxide_loss,begin,end)
+    return result
+
 
-    return 'respond', result
+def _loss_result(args, loss):
+    """Return the response for args from their area's loss vectors."""
+    return loss_result(args, loss, _period_loss)
+
+
+def _analyze_geojson(args, lookup=True):
+    """Query GEE for threshold and geojson unless their loss is cached.
+
+    lookup is False when the cache is already known to miss."""
+    geojson = json.loads(args.get('geojson'))
+    return _loss_result(args, _get_loss(args, geojson, lookup))
 
 
 def _executeWdpa(args):
     """Query GEE using supplied WDPA id."""
-    action, data = CartoDbExecutor.execute(args, BiomasLossSql)
+    args['begin'] = args['begin'] if 'begin' in args else '2001-01-01'
+    args['end'] = args['end'] if 'end' in args else '2013-01-01'
+    loss = _get_loss(args)
+    if loss is not None:
+        return _loss_result(args, loss)
+
+    # Authenticate to GEE while the geometry query is in flight
+    future = CartoDbExecutor.execute_async(args, BiomasLossSql)
+    gee.initialize()
+    action, data = CartoDbExecutor.get_result(future)
     if action == 'error':
         return action, data
     rows = data['rows']
@@ -347,8 +395,6 @@ def _executeWdpa(args):
     data.pop('download_urls')
     if rows[0]['geojson']==None:
         args['geojson'] = rows[0]['geojson']
-        args['begin'] = args['begin'] if 'begin' in args else '2001-01-01'
-        args['end'] = args['end'] if 'end' in args else '2013-01-01'
         data['params'].pop('geojson')
         data['gain'] = None
         data['loss'] = None
@@ -360,16 +406,23 @@ def _executeWdpa(args):
         data['co2_loss_by_year'] = None
     elif rows:
         args['geojson'] = rows[0]['geojson']
-        args['begin'] = args['begin'] if 'begin' in args else '2001-01-01'
-        args['end'] = args['end'] if 'end' in args else '2013-01-01'
-        action, data = _execute_geojson(args)
+        action, data = _analyze_geojson(args, lookup=False)
         data['params'].pop('geojson')
     return action, data
 
 
 def _executeUse(args):
     """Query GEE using supplied concession id."""
-    action, data = CartoDbExecutor.execute(args, BiomasLossSql)
+    args['begin'] = args['begin'] if 'begin' in args else '2001-01-01'
+    args['end'] = args['end'] if 'end' in args else '2013-01-01'
+    loss = _get_loss(args)
+    if loss is not None:
+        return _loss_result(args, loss)
+
+    # Authenticate to GEE while the geometry query is in flight
+    future = CartoDbExecutor.execute_async(args, BiomasLossSql)
+    gee.initialize()
+    action, data = CartoDbExecutor.get_result(future)
     if action == 'error':
         return action, data
     rows = data['rows']
@@ -377,16 +430,14 @@ def _executeUse(args):
     data.pop('download_urls')
     if rows:
         args['geojson'] = rows[0]['geojson']
-        args['begin'] = args['begin'] if 'begin' in args else '2001-01-01'
-        args['end'] = args['end'] if 'end' in args else '2013-01-01'
-        action, data = _execute_geojson(args)
+        action, data = _analyze_geojson(args, lookup=False)
         data['params'].pop('geojson')
     return action, data
 
 
 def _executeWorld(args):
     """Query GEE using supplied args with threshold and polygon."""
-    return _execute_geojson(args)
+    return _analyze_geojson(args)
 
 
 def execute(args):
@@ -401,6 +452,11 @@ def execute(args):
     if 'thresh' not in args:
         args['thresh'] = 30
 
+    # All thresholds at once are only computed on GEE
+    if (args['thresh'] == ALL_THRESH and
+            query_type not in ['use', 'wdpa', 'world']):
+        return 'error', {'error': 'thresh=all requires geojson, wdpa or use'}
+
     if query_type == 'iso':
         return _executeIso(args)
     elif query_type == 'id1':
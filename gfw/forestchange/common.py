@@ -17,10 +17,36 @@
 
 """Module with common stuff for forestchange."""
 
+import contextlib
 import copy
 import json
+import re
+import string
+import threading
+from hashlib import md5
 
+from gfw import cache
 from gfw import cdb
+from gfw import geometry
+
+# Tree cover density thresholds and the value selecting all of them
+THRESHOLDS = ['10', '15', '20', '25', '30', '50', '75']
+ALL_THRESH = 'all'
+
+# Seconds the loss by year vectors of an area are kept before being
+# recomputed
+LOSS_TTL = 30 * 24 * 60 * 60
+
+# Area id arg by query type for multi-area queries
+AREA_KEYS = {'wdpa': 'wdpaid', 'use': 'useid'}
+
+# Runs one area query for each of several area ids in a single request
+AREAS_SQL = """SELECT a.area_id AS _area_id, q.*
+    FROM unnest(ARRAY[{ids}]) AS a(area_id),
+    LATERAL ({query}) q"""
+
+# Per-thread state of multi_area()
+_areas = threading.local()
 
 
 def classify_query(args):
@@ -44,6 +70,69 @@ def classify_query(args):
         return 'world'
 
 
+def geometry_key(args):
+    """Return what identifies the geometry of an analysis request.
+
+    Protected areas and concessions are identified by id and other
+    polygons by a hash of their canonical GeoJSON."""
+    query_type = classify_query(args)
+    if query_type == 'wdpa':
+        return 'wdpa:%s' % args['wdpaid']
+    elif query_type == 'use':
+        return 'use:%s:%s' % (args['use'], args['useid'])
+    geojson = args.get('geojson')
+    if isinstance(geojson, basestring):
+        geojson = json.loads(geojson)
+    return 'geojson:%s' % md5(geometry.fingerprint(geojson)).hexdigest()
+
+
+def split_thresholds(results):
+    """Return {thresh: {band: value}} from results of bands named band_thresh."""
+    matrix = dict((thresh, {}) for thresh in THRESHOLDS)
+    for band, value in results.iteritems():
+        name, thresh = band.rsplit('_', 1)
+        matrix[thresh][name] = value
+    return matrix
+
+
+def get_loss(args, key, analyze, geojson=None, lookup=True):
+    """Return the loss vectors of the area of args, for any period.
+
+    key(args) returns their cache key and analyze(geojson, thresh) computes
+    them on GEE, which is done on a miss if geojson is supplied. A single
+    threshold is also answered from the cached vectors of all of them.
+    With lookup False, the cache is known to miss and isn't read again."""
+    thresh = str(args.get('thresh'))
+    loss = None
+    if lookup and 'bust' not in args:
+        loss = cache.get(key(args))
+        if loss is None and thresh != ALL_THRESH:
+            matrix = cache.get(key(dict(args, thresh=ALL_THRESH)))
+            loss = matrix and matrix[thresh]
+    if loss is None and geojson is not None:
+        loss = analyze(geojson, thresh)
+        cache.set(key(args), loss, durable=True, soft_ttl=LOSS_TTL)
+    return loss
+
+
+def loss_result(args, loss, period_loss):
+    """Return the response for args from their area's loss vectors.
+
+    period_loss(args, loss) sums the vectors of one threshold over the
+    period of args."""
+    result = {}
+    result['params'] = args
+    if isinstance(args.get('geojson'), basestring):
+        result['params']['geojson'] = json.loads(args['geojson'])
+    if str(args.get('thresh')) == ALL_THRESH:
+        result['thresholds'] = dict(
+            (thresh, period_loss(args, loss[thresh]))
+            for thresh in THRESHOLDS)
+    else:
+        result.update(period_loss(args, loss))
+    return 'respond', result
+
+
 def args_params(params, args, min_max_sql):
     if args.get('alert_query'):
         params['additional_select'] = min_max_sql
@@ -60,14 +149,170 @@ def args_params(params, args, min_max_sql):
     return params
 
 
+class LocalResponse(object):
+    """Stands in for a CartoDB response answered without a request."""
+
+    def __init__(self, rows, status_code=200, content=None):
+        self.status_code = status_code
+        self.content = content or json.dumps({'rows': rows})
+
+
+@contextlib.contextmanager
+def multi_area(ids):
+    """Serve wdpa and use queries for any of ids from one CartoDB request.
+
+    Within the block, the first wdpa or use query of each Sql class is run
+    for all ids at once with AREAS_SQL, and the rows are split by area to
+    answer that query for every id."""
+    _areas.ids = [int(i) for i in ids]
+    _areas.responses = {}
+    try:
+        yield
+    finally:
+        del _areas.ids, _areas.responses
+
+
+def _area_response(args, sql):
+    """Return the multi-area response for args if in a multi_area() block."""
+    ids = getattr(_areas, 'ids', None)
+    key = AREA_KEYS.get(classify_query(args))
+    if not ids or not key or 'format' in args:
+        return None
+    area_id = int(args[key])
+    if area_id not in ids:
+        return None
+    if sql not in _areas.responses:
+        area_args = copy.copy(args)
+        area_args[key] = SqlFragment('a.area_id')
+        query = AREAS_SQL.format(
+            ids=','.join(map(str, ids)), query=sql.process(area_args)[0])
+        response = cdb.execute(query)
+        if response.status_code == 200:
+            rows = dict((i, []) for i in ids)
+            for row in json.loads(response.content)['rows']:
+                rows.setdefault(row.pop('_area_id'), []).append(row)
+            responses = dict((i, LocalResponse(r)) for i, r in rows.iteritems())
+        else:
+            error = LocalResponse(None, response.status_code, response.content)
+            responses = dict((i, error) for i in ids)
+        _areas.responses[sql] = responses
+    return _areas.responses[sql][area_id]
+
+
+def _cube_response(args, sql):
+    """Return the response for args answered from an alert cube, if any."""
+    from gfw.forestchange import cube
+    rows = cube.lookup(args, sql)
+    if rows is not None:
+        return LocalResponse(rows)
+
+
+def _grid_response(args, sql):
+    """Return the response for args answered from the alert grid, if any."""
+    from gfw.forestchange import grid
+    rows = grid.lookup(args, sql)
+    if rows is not None:
+        return LocalResponse(rows)
+
+
 class SqlError(ValueError):
     def __init__(self, msg):
         super(SqlError, self).__init__(msg)
 
+
+class SqlFragment(str):
+    """SQL text bound into a statement verbatim, never escaped."""
+
+
+_IDENTIFIER = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+
+def _bind_literal(value):
+    """Bind value inside a quoted SQL string literal."""
+    return ('%s' % value).replace("'", "''")
+
+
+def _bind_integer(value):
+    try:
+        return '%d' % int(value)
+    except (TypeError, ValueError):
+        raise SqlError('Invalid integer parameter: %s' % value)
+
+
+def _bind_identifier(value):
+    if not _IDENTIFIER.match('%s' % value):
+        raise SqlError('Invalid table parameter: %s' % value)
+    return value
+
+
+def _bind_fragment(value):
+    return '%s' % value
+
+# Binders by placeholder name; other placeholders are quoted literals
+BINDERS = {
+    'id1': _bind_integer,
+    'wdpaid': _bind_integer,
+    'pid': _bind_integer,
+    'thresh': _bind_integer,
+    'limit': _bind_integer,
+    'use_table': _bind_identifier,
+    'additional_select': _bind_fragment,
+    'the_geom': _bind_fragment,
+    'date': _bind_fragment,
+    'query': _bind_fragment,
+}
+
+
+class Statement(object):
+    """A SQL template normalized once and bound to params per request.
+
+    Binding gives the same text as formatting the template and collapsing
+    whitespace, without reprocessing the template for each request."""
+
+    def __init__(self, template):
+        self.text = ' '.join(template.split())
+        parsed = list(string.Formatter().parse(self.text))
+        self.parts = []
+        for index, (literal, name, spec, conversion) in enumerate(parsed):
+            after = parsed[index + 1][0] if index + 1 < len(parsed) else ''
+            # An empty value leaves a double space to collapse
+            collapse = literal.endswith(' ') and after[:1] in ['', ' ']
+            self.parts.append((literal, name, collapse))
+
+    def bind(self, params):
+        """Return the statement text with params bound to its placeholders."""
+        pieces = []
+        for literal, name, collapse in self.parts:
+            if name is None:
+                pieces.append(literal)
+                continue
+            if isinstance(params[name], SqlFragment):
+                value = params[name]
+            else:
+                value = BINDERS.get(name, _bind_literal)(params[name])
+            pieces.append(literal[:-1] if collapse and not value else literal)
+            pieces.append(value)
+        return ''.join(pieces)
+
+
+# Compiled statements keyed by (Sql class, template text)
+_statements = {}
+
+
 class Sql(object):
 
     MIN_MAX_DATE_SQL = ', MIN(date) as min_date, MAX(date) as max_date'
 
+    # Date column of download rows, set by datasets with a time series
+    SERIES_DATE = None
+
+    SERIES = """
+        SELECT date_trunc('{interval}', s.{date})::date AS date,
+               COUNT(*) AS value
+        FROM ({query}) s
+        GROUP BY 1
+        ORDER BY 1"""
+
     @classmethod
     def get_query_type(cls, params, args, the_geom_table=''):
         """Return query type (download or analysis) with updated params."""
@@ -97,6 +342,39 @@ class Sql(object):
         if sql:
             return ' '.join(sql.split())
 
+    @classmethod
+    def statements(cls, name):
+        """Return (query, alert, download, alert_download) statements.
+
+        The alert variant drops ALERT_SQL_REMOVALS. The download variants
+        are the template passed through download() once additional_select
+        is filled as for other and for alert queries, since download() may
+        strip MIN_MAX_DATE_SQL. They are compiled once per template text."""
+        template = getattr(cls, name)
+        key = (cls, template)
+        if key not in _statements:
+            _statements[key] = (
+                Statement(template),
+                Statement(cls.cleanAlert(dict(alert_query=True), template)),
+                cls._download_statement(template, ''),
+                cls._download_statement(template, cls.MIN_MAX_DATE_SQL))
+        return _statements[key]
+
+    @classmethod
+    def _download_statement(cls, template, additional_select):
+        template = template.replace('{additional_select}', additional_select)
+        return Statement(cls.download(template) or '')
+
+    @classmethod
+    def bind(cls, name, params, alert=False):
+        """Return (query, download_query) of template name bound to params."""
+        query, alert_query, download, alert_download = cls.statements(name)
+        if alert:
+            query = alert_query
+        if params.get('additional_select'):
+            download = alert_download
+        return query.bind(params), download.bind(params)
+
     @classmethod
     def process(cls, args):
         begin = args['begin'] if 'begin' in args else '2014-01-01'
@@ -104,61 +382,45 @@ class Sql(object):
         params = dict(begin=begin, end=end)
         classification = classify_query(args)
         if hasattr(cls, classification):
-            return map(cls.clean, getattr(cls, classification)(params, args))
+            return getattr(cls, classification)(params, args)
 
     @classmethod
-    def world(cls, params, args):
+    def series(cls, args, interval='day'):
+        """Return query counting download rows by interval over the period."""
+        query, download_query = cls.process(args)
+        params = dict(interval=interval, date=cls.SERIES_DATE,
+                      query=download_query)
+        return cls.statements('SERIES')[0].bind(params)
+
+    @classmethod
+    def _bind_area(cls, name, params, args, alert=True):
         params = args_params(params, args, cls.MIN_MAX_DATE_SQL)
         query_type, params = cls.get_query_type(params, args)
-        query = cls.WORLD.format(**params)
-        query = cls.cleanAlert(args, query)
-        download_query = cls.download(query)
-        return query, download_query
+        return cls.bind(name, params, alert and args.get('alert_query'))
+
+    @classmethod
+    def world(cls, params, args):
+        return cls._bind_area('WORLD', params, args)
 
     @classmethod
     def ifl(cls, params, args):
-        params = args_params(params, args, cls.MIN_MAX_DATE_SQL)
-        query_type, params = cls.get_query_type(params, args)
-        query = cls.IFL.format(**params)
-        query = cls.cleanAlert(args, query)
-        download_query = cls.download(cls.IFL.format(**params))
-        return query, download_query
+        return cls._bind_area('IFL', params, args)
 
     @classmethod
     def ifl_id1(cls, params, args):
-        params = args_params(params, args, cls.MIN_MAX_DATE_SQL)
-        query_type, params = cls.get_query_type(params, args)
-        query = cls.IFL_ID1.format(**params)
-        query = cls.cleanAlert(args, query)
-        download_query = cls.download(cls.IFL_ID1.format(**params))
-        return query, download_query
+        return cls._bind_area('IFL_ID1', params, args)
 
     @classmethod
     def iso(cls, params, args):
-        params = args_params(params, args, cls.MIN_MAX_DATE_SQL)
-        query_type, params = cls.get_query_type(params, args)
-        query = cls.ISO.format(**params)
-        query = cls.cleanAlert(args, query)
-        download_query = cls.download(cls.ISO.format(**params))
-        return query, download_query
+        return cls._bind_area('ISO', params, args)
 
     @classmethod
     def id1(cls, params, args):
-        params = args_params(params, args, cls.MIN_MAX_DATE_SQL)
-        query_type, params = cls.get_query_type(params, args)
-        query = cls.ID1.format(**params)
-        query = cls.cleanAlert(args, query)
-        download_query = cls.download(cls.ID1.format(**params))
-        return query, download_query
+        return cls._bind_area('ID1', params, args)
 
     @classmethod
     def wdpa(cls, params, args):
-        params = args_params(params, args, cls.MIN_MAX_DATE_SQL)
-        query_type, params = cls.get_query_type(params, args)
-        query = cls.WDPA.format(**params)
-        query = cls.cleanAlert(args, query)
-        download_query = cls.download(cls.WDPA.format(**params))
-        return query, download_query
+        return cls._bind_area('WDPA', params, args)
 
     @classmethod
     def use(cls, params, args):
@@ -170,17 +432,12 @@ class Sql(object):
         }
         params['use_table'] = concessions.get(args['use']) or args['use']
         params['pid'] = args['useid']
-        params = args_params(params, args, cls.MIN_MAX_DATE_SQL)
-        query_type, params = cls.get_query_type(params, args)
-        query = cls.USE.format(**params)
-        download_query = cls.download(cls.USE.format(**params))
-        return query, download_query
+        return cls._bind_area('USE', params, args, alert=False)
 
     @classmethod
     def latest(cls, params, args):
         params['limit'] = args.get('limit') or 3
-        query = cls.LATEST.format(**params)
-        return query, None
+        return cls.bind('LATEST', params)[0], None
 
 
 def get_download_urls(query, params):
@@ -215,7 +472,10 @@ class CartoDbExecutor():
         return result
 
     @classmethod
-    def execute(cls, args, sql):
+    def execute_async(cls, args, sql):
+        """Start query for supplied args and return a cdb.Future.
+
+        The future resolves to the same (action, data) tuple as execute()."""
         try:
             query, download_query = sql.process(args)
 
@@ -224,14 +484,34 @@ class CartoDbExecutor():
 
             download_url = cdb.get_url(download_query, args)
             if 'format' in args:
-                return 'redirect', download_url
-            else:
-                action, response = 'respond', cdb.execute(query)
+                return cdb.Future.resolved(('redirect', download_url))
+
+            def respond(response):
+                action = 'respond'
                 response = cls._query_response(response, args, query)
                 response['download_urls'] = get_download_urls(
                     download_query, args)
                 if 'error' in response:
                     action = 'error'
                 return action, response
+
+            response = (_area_response(args, sql) or
+                        _cube_response(args, sql) or
+                        _grid_response(args, sql))
+            if response:
+                return cdb.Future.resolved(response).then(respond)
+            return cdb.execute_async(query).then(respond)
+        except Exception, e:
+            return cdb.Future.resolved(('execute() error', e))
+
+    @classmethod
+    def get_result(cls, future):
+        """Return (action, data) for a future from execute_async()."""
+        try:
+            return future.get_result()
         except Exception, e:
             return 'execute() error', e
+
+    @classmethod
+    def execute(cls, args, sql):
+        return cls.get_result(cls.execute_async(args, sql))
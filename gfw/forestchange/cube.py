@@ -0,0 +1,194 @@
+# Global Forest Watch API
+# Copyright (C) 2015 World Resource Institute
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""This module answers national and subnational alert counts from cubes.
+
+A cube holds the daily alert counts of one country and each of its
+provinces for a dataset version. Cubes are built in the background with
+the dataset's own ISO and ID1 queries, and national and subnational
+requests for any period are then summed in-process instead of querying
+CartoDB."""
+
+import bisect
+import datetime
+import logging
+
+from google.appengine.api import taskqueue
+
+from gfw import cache
+from gfw import cdb
+from gfw.forestchange import common
+from gfw.forestchange import forma
+from gfw.forestchange import glad
+from gfw.forestchange import quicc
+from gfw.forestchange import terrai
+from gfw.forestchange import versions
+
+# Datasets answered from cubes
+CUBE_SQL = {
+    'glad-alerts': glad.GladSql,
+    'terrai-alerts': terrai.TerraiSql,
+    'quicc-alerts': quicc.QuiccSql,
+    'forma-alerts': forma.FormaSql,
+}
+
+_DATASETS = dict((sql, dataset) for dataset, sql in CUBE_SQL.iteritems())
+
+QUEUE = 'cube-build'
+
+# Period counted by cubes, wider than any dataset
+CUBE_BEGIN = '2000-01-01'
+CUBE_END = '2100-01-01'
+
+# Seconds a cube build waits for CartoDB
+BUILD_DEADLINE = 600
+
+# Seconds a cube is kept without being rebuilt
+CUBE_TTL = 30 * 24 * 60 * 60
+
+# Period used when the request has none, as in Sql.process()
+DEFAULT_BEGIN = '2014-01-01'
+DEFAULT_END = '2015-01-01'
+
+ISOS_SQL = common.Statement("""
+    SELECT iso FROM gadm2_countries_simple ORDER BY iso""")
+
+ID1S_SQL = common.Statement("""
+    SELECT id_1 FROM gadm2_provinces_simple
+    WHERE iso = UPPER('{iso}') ORDER BY id_1""")
+
+
+class Counts(object):
+    """Daily counts of an area with prefix sums for period lookups."""
+
+    def __init__(self, days):
+        days = sorted(days)
+        self.days = [day for day, value in days]
+        self.sums = [0]
+        for day, value in days:
+            self.sums.append(self.sums[-1] + value)
+
+    def period(self, begin, end):
+        """Return (count, first day, last day) from begin to end inclusive."""
+        i = bisect.bisect_left(self.days, begin)
+        j = bisect.bisect_right(self.days, end)
+        if i >= j:
+            return 0, None, None
+        return (self.sums[j] - self.sums[i],
+                datetime.date.fromordinal(self.days[i]),
+                datetime.date.fromordinal(self.days[j - 1]))
+
+
+# Decoded cubes by cache key, sized by their number of days
+_cubes = cache.LocalCache(
+    max_entries=64, max_bytes=4 * 1000 * 1000,
+    sizeof=lambda cube: 16 * sum(len(c.days) for c in cube.itervalues()))
+
+
+def _key(dataset, iso):
+    return 'cube:%s:%s' % (dataset, iso.upper())
+
+
+def _days(rows):
+    f = datetime.datetime.strptime
+    return [(f(row['date'][:10], '%Y-%m-%d').toordinal(), row['value'])
+            for row in rows]
+
+
+def get(dataset, iso, version):
+    """Return {'iso': Counts, id1: Counts} for dataset and iso or None.
+
+    Cubes built from another version of the dataset are ignored."""
+    key = _key(dataset, iso)
+    cube = _cubes.get((key, version))
+    if cube is not None:
+        return cube
+    entry = cache.get(key)
+    if not entry or entry['version'] != version:
+        return None
+    cube = dict((area, Counts(days)) for area, days in entry['areas'])
+    _cubes.set((key, version), cube)
+    return cube
+
+
+def lookup(args, sql):
+    """Return CartoDB-like rows answering an iso or id1 query or None."""
+    dataset = _DATASETS.get(sql)
+    query_type = common.classify_query(args)
+    if (not dataset or query_type not in ['iso', 'id1']
+            or 'format' in args or args.get('alert_query')
+            or args.get('for_subscription')):
+        return None
+    version = versions.get(dataset)
+    cube = get(dataset, args['iso'], version) if version else None
+    if cube is None:
+        return None
+    counts = cube.get(int(args['id1']) if query_type == 'id1' else 'iso')
+    if counts is None:
+        return None
+
+    f = datetime.datetime.strptime
+    begin = f(args.get('begin') or DEFAULT_BEGIN, '%Y-%m-%d').toordinal()
+    end = f(args.get('end') or DEFAULT_END, '%Y-%m-%d').toordinal()
+    value, first, last = counts.period(begin, end)
+    row = dict(value=value)
+    # Only datasets selecting the alert dates get them
+    if 'min_date' in sql.statements(query_type.upper())[0].text:
+        row['min_date'] = first and '%sT00:00:00Z' % first.isoformat()
+        row['max_date'] = last and '%sT00:00:00Z' % last.isoformat()
+    return [row]
+
+
+def build(dataset, iso):
+    """Build and store the cube for dataset and iso unless it is current."""
+    version = versions.get(dataset)
+    if not version:
+        return None
+    entry = cache.get(_key(dataset, iso))
+    if entry and entry['version'] == version:
+        return entry
+
+    sql = CUBE_SQL[dataset]
+    args = dict(iso=iso, begin=CUBE_BEGIN, end=CUBE_END)
+    ids = [row['id_1'] for row in
+           cdb.execute_batch([ID1S_SQL.bind(dict(iso=iso))])[0]]
+    queries = [sql.series(args)]
+    if ids:
+        area_args = dict(args, id1=common.SqlFragment('a.area_id'))
+        queries.append(common.AREAS_SQL.format(
+            ids=','.join('%d' % i for i in ids), query=sql.series(area_args)))
+    results = cdb.execute_batch_async(
+        queries, deadline=BUILD_DEADLINE).get_result()
+
+    areas = {'iso': _days(results[0])}
+    for area_id in ids:
+        areas[area_id] = []
+    for row in results[1] if ids else []:
+        areas[row.pop('_area_id')].extend(_days([row]))
+    entry = dict(version=version, areas=areas.items())
+    cache.set(_key(dataset, iso), entry, durable=True, soft_ttl=CUBE_TTL)
+    return entry
+
+
+def start(dataset):
+    """Enqueue a cube build for each country and return how many."""
+    isos = [row['iso'] for row in cdb.execute_batch([ISOS_SQL.bind({})])[0]]
+    for iso in isos:
+        taskqueue.add(url='/cache/tasks/cube', queue_name=QUEUE,
+                      params=dict(dataset=dataset, iso=iso))
+    logging.info('Queued %s %s cubes' % (len(isos), dataset))
+    return len(isos)
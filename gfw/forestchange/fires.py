@@ -25,6 +25,8 @@ from gfw.forestchange.common import Sql
 
 class FiresSql(Sql):
 
+    SERIES_DATE = 'acq_date::date'
+
     WORLD = """
         SELECT COUNT(pt.*) AS value
         FROM global_7d pt
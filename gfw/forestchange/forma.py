@@ -23,6 +23,8 @@ from gfw.forestchange.common import Sql
 
 class FormaSql(Sql):
 
+    SERIES_DATE = 'date'
+
     WORLD = """
         SELECT COUNT(f.*) AS value
             {additional_select}
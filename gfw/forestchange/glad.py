@@ -17,6 +17,7 @@
 
 """This module supports accessing UMD/GLAD data."""
 import math
+import re
 import arrow
 import logging
 
@@ -25,6 +26,8 @@ from gfw.forestchange.common import Sql
 
 class GladSql(Sql):
 
+    SERIES_DATE = 'date'
+
     WORLD = """
         SELECT COUNT(iso) AS value, MIN(date) as min_date, MAX(date) as max_date
         FROM  umd_alerts_agg_analysis f
@@ -86,9 +89,12 @@ class GladSql(Sql):
         ORDER BY date DESC
         LIMIT {limit}"""
 
+    # Aggregate select of the analysis queries, counting iso or f.iso
+    AGGREGATE = re.compile(r"COUNT\((?:f\.)?iso\) AS value, MIN\(date\) as min_date, MAX\(date\) as max_date")
+
     @classmethod
     def download(cls, sql):
-        return sql.replace("COUNT(iso) AS value, MIN(date) as min_date, MAX(date) as max_date", " f.date, st_transform(f.the_geom_webmercator, 4326) as the_geom, ST_Y(st_transform(the_geom_webmercator, 4326)) as lat, ST_X(st_transform(the_geom_webmercator, 4326)) as long")
+        return cls.AGGREGATE.sub(" f.date, st_transform(f.the_geom_webmercator, 4326) as the_geom, ST_Y(st_transform(f.the_geom_webmercator, 4326)) as lat, ST_X(st_transform(f.the_geom_webmercator, 4326)) as long", sql)
 
 def _processResults(action, data):
     if 'rows' in data:
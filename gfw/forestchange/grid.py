@@ -0,0 +1,383 @@
+# Global Forest Watch API
+# Copyright (C) 2015 World Resource Institute
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""This module answers alert counts for custom polygons from a grid.
+
+Alerts are pre-aggregated into daily counts per grid cell for each dataset
+version, stored by tile. For a polygon, cells entirely inside it are
+summed in-process and only alerts in cells crossed by its boundary are
+counted by CartoDB. Points are assigned to cells the same way on both
+sides, and cells are classified in the projection the dataset's query
+intersects in, so the total matches the plain polygon query."""
+
+import datetime
+import json
+import logging
+import math
+
+from google.appengine.api import taskqueue
+
+from gfw import cache
+from gfw import cdb
+from gfw.forestchange import common
+from gfw.forestchange import cube
+from gfw.forestchange import forma
+from gfw.forestchange import glad
+from gfw.forestchange import quicc
+from gfw.forestchange import terrai
+from gfw.forestchange import versions
+
+# Datasets answered from the grid
+GRID_SQL = {
+    'glad-alerts': glad.GladSql,
+    'terrai-alerts': terrai.TerraiSql,
+    'quicc-alerts': quicc.QuiccSql,
+    'forma-alerts': forma.FormaSql,
+}
+
+_DATASETS = dict((sql, dataset) for dataset, sql in GRID_SQL.iteritems())
+
+QUEUE = 'grid-build'
+
+# Cell size in degrees and cells per tile side
+CELL_DEGREES = 0.25
+TILE_CELLS = 20
+ROWS = int(180 / CELL_DEGREES)
+
+# Polygons spanning more cells than this are queried on CartoDB
+MAX_CELLS = 250000
+
+# Boundary cells sent to CartoDB at most
+MAX_BOUNDARY_CELLS = 5000
+
+# Latitudes covered by the grid, within Web Mercator bounds
+MAX_LATITUDE = 85
+
+# Period counted by the grid, wider than any dataset
+GRID_BEGIN = '2000-01-01'
+GRID_END = '2100-01-01'
+
+BUILD_DEADLINE = 600
+
+# Seconds a tile is kept without being rebuilt
+GRID_TTL = 30 * 24 * 60 * 60
+
+DEFAULT_BEGIN = '2014-01-01'
+DEFAULT_END = '2015-01-01'
+
+# Cell id of an alert, computed identically for tiles and boundaries
+_CELL = """(floor((ST_X(s.the_geom) + 180) / {size})::int * {rows}
+    + floor((ST_Y(s.the_geom) + 90) / {size})::int)"""
+
+CELLS_SQL = common.Statement("""
+    SELECT %s AS cell, date_trunc('day', s.{date})::date AS date,
+           COUNT(*) AS value
+    FROM ({query}) s
+    GROUP BY 1, 2""" % _CELL)
+
+TILES_SQL = common.Statement("""
+    SELECT DISTINCT %s / {rows} / {tile} AS x,
+           %s %% {rows} / {tile} AS y
+    FROM ({query}) s""" % (_CELL, _CELL))
+
+BOUNDARY_SQL = common.Statement("""
+    SELECT COUNT(*) AS value, MIN(s.{date}) AS min_date,
+           MAX(s.{date}) AS max_date
+    FROM ({query}) s
+    WHERE %s = ANY(ARRAY[{cells}])""" % _CELL)
+
+
+def _cell(col, row):
+    return col * ROWS + row
+
+
+def _tile(cell):
+    return cell // ROWS // TILE_CELLS, cell % ROWS // TILE_CELLS
+
+
+def _col(x):
+    return int(math.floor((x + 180) / CELL_DEGREES))
+
+
+def _row(y):
+    return int(math.floor((y + 90) / CELL_DEGREES))
+
+
+def _mercator_y(lat):
+    """Return the Web Mercator y of a latitude, in earth radii."""
+    return math.log(math.tan(math.pi / 4 + math.radians(lat) / 2))
+
+
+# Projections polygon edges are straight in, as the projected y of a
+# latitude. Both keep longitude linear, so cells stay rectangles and an
+# edge stays within the rows of its ends.
+PLATE_CARREE = float
+MERCATOR = _mercator_y
+
+
+def _projection(sql):
+    """Return the projection the polygon query of sql intersects in."""
+    if 'the_geom_webmercator' in sql.WORLD:
+        return MERCATOR
+    return PLATE_CARREE
+
+
+def _hits_cell(a, b, col, row, projection=PLATE_CARREE):
+    """Return True if segment a-b touches the closed rectangle of a cell.
+
+    a and b are projected, the cell is not."""
+    x0, x1 = col * CELL_DEGREES - 180, (col + 1) * CELL_DEGREES - 180
+    y0 = projection(row * CELL_DEGREES - 90)
+    y1 = projection((row + 1) * CELL_DEGREES - 90)
+    t0, t1 = 0.0, 1.0
+    dx, dy = b[0] - a[0], b[1] - a[1]
+    for p, q in [(-dx, a[0] - x0), (dx, x1 - a[0]),
+                 (-dy, a[1] - y0), (dy, y1 - a[1])]:
+        if p == 0:
+            if q < 0:
+                return False
+        else:
+            t = float(q) / p
+            if p < 0:
+                t0 = max(t0, t)
+            else:
+                t1 = min(t1, t)
+            if t0 > t1:
+                return False
+    return True
+
+
+def _polygon_cells(rings, projection=PLATE_CARREE):
+    """Return (inside, boundary) cell ids of one polygon's rings.
+
+    Edges are straight lines in projection."""
+    edges = [(ring[i], ring[i + 1]) for ring in rings
+             for i in range(len(ring) - 1) if ring[i] != ring[i + 1]]
+    projected = [((a[0], projection(a[1])), (b[0], projection(b[1])))
+                 for a, b in edges]
+    boundary = set()
+    for (a, b), (pa, pb) in zip(edges, projected):
+        for col in range(_col(min(a[0], b[0])), _col(max(a[0], b[0])) + 1):
+            for row in range(_row(min(a[1], b[1])),
+                             _row(max(a[1], b[1])) + 1):
+                if _hits_cell(pa, pb, col, row, projection):
+                    boundary.add(_cell(col, row))
+
+    # Cells not crossed by an edge are inside if their center is
+    inside = set()
+    ys = [y for ring in rings for x, y in ring]
+    for row in range(_row(min(ys)), _row(max(ys)) + 1):
+        yc = projection((row + 0.5) * CELL_DEGREES - 90)
+        xs = sorted(a[0] + (yc - a[1]) * (b[0] - a[0]) / (b[1] - a[1])
+                    for a, b in projected if (a[1] > yc) != (b[1] > yc))
+        for begin, end in zip(xs[::2], xs[1::2]):
+            for col in range(_col(begin), _col(end) + 1):
+                xc = (col + 0.5) * CELL_DEGREES - 180
+                cell = _cell(col, row)
+                if begin < xc < end and cell not in boundary:
+                    inside.add(cell)
+    return inside, boundary
+
+
+def cells(geojson, projection=PLATE_CARREE):
+    """Return (inside, boundary) cell ids for a Polygon or MultiPolygon.
+
+    The polygon's edges are straight lines in projection. Returns
+    (None, None) when the polygon spans too many cells."""
+    if isinstance(geojson, basestring):
+        geojson = json.loads(geojson)
+    polygons = geojson['coordinates']
+    if geojson['type'] == 'Polygon':
+        polygons = [polygons]
+    points = [p for polygon in polygons for ring in polygon for p in ring]
+    xs, ys = [p[0] for p in points], [p[1] for p in points]
+    if (max(abs(y) for y in ys) > MAX_LATITUDE or
+            (_col(max(xs)) - _col(min(xs)) + 1) *
+            (_row(max(ys)) - _row(min(ys)) + 1) > MAX_CELLS):
+        return None, None
+    inside, boundary = set(), set()
+    for polygon in polygons:
+        rings = [[tuple(p[:2]) for p in ring] for ring in polygon]
+        polygon_inside, polygon_boundary = _polygon_cells(rings, projection)
+        inside |= polygon_inside
+        boundary |= polygon_boundary
+    return inside - boundary, boundary
+
+
+def _index_key(dataset):
+    return 'grid:%s' % dataset
+
+
+def _tile_key(dataset, tile):
+    return 'grid:%s:%s:%s' % (dataset, tile[0], tile[1])
+
+
+# Decoded tiles by cache key and version
+_tiles = cache.LocalCache(
+    max_entries=256, max_bytes=16 * 1000 * 1000,
+    sizeof=lambda tile: 16 * sum(len(c.days) for c in tile.itervalues()))
+
+
+def _get_tiles(dataset, tiles, version):
+    """Return {tile: {cell: Counts}} for tiles or None if one isn't built.
+
+    Tiles not decoded yet are read from the cache together."""
+    result, missing = {}, {}
+    for tile in tiles:
+        key = _tile_key(dataset, tile)
+        counts = _tiles.get((key, version))
+        if counts is None:
+            missing[key] = tile
+        else:
+            result[tile] = counts
+    entries = cache.get_multi(missing.keys()) if missing else {}
+    for key, tile in missing.iteritems():
+        entry = entries.get(key)
+        if not entry or entry['version'] != version:
+            return None
+        counts = dict((cell, cube.Counts(days))
+                      for cell, days in entry['cells'])
+        _tiles.set((key, version), counts)
+        result[tile] = counts
+    return result
+
+
+def _interior(dataset, version, inside, begin, end):
+    """Return (value, first, last) for inside cells or None if not built."""
+    index = cache.get(_index_key(dataset))
+    if not index or index['version'] != version:
+        return None
+    by_tile = {}
+    for cell in inside:
+        by_tile.setdefault(_tile(cell), []).append(cell)
+    tiles = [tile for tile in by_tile if tile in index['tiles']]
+    counts = _get_tiles(dataset, tiles, version)
+    if counts is None:
+        return None
+    value, first, last = 0, None, None
+    for tile in tiles:
+        tile_counts = counts[tile]
+        for cell in by_tile[tile]:
+            if cell in tile_counts:
+                n, a, b = tile_counts[cell].period(begin, end)
+                if n:
+                    value += n
+                    first = min(first or a, a)
+                    last = max(last or b, b)
+    return value, first, last
+
+
+def _date(value):
+    if value:
+        return datetime.datetime.strptime(value[:10], '%Y-%m-%d').date()
+
+
+def lookup(args, sql):
+    """Return CartoDB-like rows answering a polygon query or None."""
+    dataset = _DATASETS.get(sql)
+    if (not dataset or common.classify_query(args) != 'world'
+            or not args.get('geojson') or 'format' in args
+            or args.get('alert_query') or args.get('for_subscription')):
+        return None
+    version = versions.get(dataset)
+    inside, boundary = cells(args['geojson'], _projection(sql))
+    if not version or not inside or len(boundary) > MAX_BOUNDARY_CELLS:
+        return None
+
+    f = datetime.datetime.strptime
+    begin = f(args.get('begin') or DEFAULT_BEGIN, '%Y-%m-%d').toordinal()
+    end = f(args.get('end') or DEFAULT_END, '%Y-%m-%d').toordinal()
+    interior = _interior(dataset, version, inside, begin, end)
+    if interior is None:
+        return None
+    value, first, last = interior
+
+    query = BOUNDARY_SQL.bind(dict(
+        size=CELL_DEGREES, rows=ROWS, date=sql.SERIES_DATE,
+        query=sql.process(args)[1],
+        cells=','.join('%d' % cell for cell in sorted(boundary))))
+    response = cdb.execute(query)
+    if response.status_code != 200:
+        return None
+    row = json.loads(response.content)['rows'][0]
+    value += row['value'] or 0
+    dates = [d for d in [first, last, _date(row['min_date']),
+                         _date(row['max_date'])] if d]
+
+    result = dict(value=value)
+    if 'min_date' in sql.statements('WORLD')[0].text:
+        result['min_date'] = dates and '%sT00:00:00Z' % min(dates).isoformat()
+        result['max_date'] = dates and '%sT00:00:00Z' % max(dates).isoformat()
+    return [result]
+
+
+def _tile_geojson(tile):
+    size = CELL_DEGREES * TILE_CELLS
+    x0, y0 = tile[0] * size - 180, tile[1] * size - 90
+    return json.dumps(dict(type='Polygon', coordinates=[[
+        [x0, y0], [x0 + size, y0], [x0 + size, y0 + size], [x0, y0 + size],
+        [x0, y0]]]))
+
+
+def _world_query(sql, geojson):
+    args = dict(geojson=geojson, begin=GRID_BEGIN, end=GRID_END)
+    return sql.process(args)[1]
+
+
+def build(dataset, tile, version):
+    """Build and store the cell counts of one tile for a dataset version."""
+    if versions.get(dataset) != version:
+        return None
+    sql = GRID_SQL[dataset]
+    query = CELLS_SQL.bind(dict(
+        size=CELL_DEGREES, rows=ROWS, date=sql.SERIES_DATE,
+        query=_world_query(sql, _tile_geojson(tile))))
+    rows = cdb.execute_batch_async(
+        [query], deadline=BUILD_DEADLINE).get_result()[0]
+    days = {}
+    for row in rows:
+        # Alerts on the tile edge belong to the neighbouring tile
+        if _tile(row['cell']) == tuple(tile):
+            days.setdefault(row['cell'], []).append(
+                (_date(row['date']).toordinal(), row['value']))
+    entry = dict(version=version, cells=days.items())
+    cache.set(_tile_key(dataset, tile), entry, durable=True,
+              soft_ttl=GRID_TTL)
+    return entry
+
+
+def start(dataset):
+    """Index the tiles with alerts and enqueue a build for each."""
+    version = versions.get(dataset)
+    if not version:
+        return 0
+    world = json.dumps(dict(type='Polygon', coordinates=[[
+        [-180, -MAX_LATITUDE], [180, -MAX_LATITUDE], [180, MAX_LATITUDE],
+        [-180, MAX_LATITUDE], [-180, -MAX_LATITUDE]]]))
+    query = TILES_SQL.bind(dict(
+        size=CELL_DEGREES, rows=ROWS, tile=TILE_CELLS,
+        query=_world_query(GRID_SQL[dataset], world)))
+    rows = cdb.execute_batch_async(
+        [query], deadline=BUILD_DEADLINE).get_result()[0]
+    tiles = set((row['x'], row['y']) for row in rows)
+    cache.set(_index_key(dataset), dict(version=version, tiles=tiles),
+              durable=True, soft_ttl=GRID_TTL)
+    for x, y in tiles:
+        taskqueue.add(url='/cache/tasks/grid', queue_name=QUEUE,
+                      params=dict(dataset=dataset, x=x, y=y, version=version))
+    logging.info('Queued %s %s grid tiles' % (len(tiles), dataset))
+    return len(tiles)
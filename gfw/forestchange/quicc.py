@@ -23,6 +23,8 @@ from gfw.forestchange.common import Sql
 
 class QuiccSql(Sql):
 
+    SERIES_DATE = 'date'
+
     WORLD = """
         SELECT COUNT(pt.*) AS value
             {additional_select}
@@ -0,0 +1,137 @@
+# Global Forest Watch API
+# Copyright (C) 2015 World Resource Institute
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""This module supports time series of alert counts.
+
+Alerts are counted per day with one query and cached per area and dataset
+version. Series for any interval and any period within the cached days are
+rolled up from them without querying CartoDB again."""
+
+import copy
+import datetime
+import json
+
+from gfw import cache
+from gfw import cdb
+from gfw.forestchange import fires
+from gfw.forestchange import forma
+from gfw.forestchange import glad
+from gfw.forestchange import quicc
+from gfw.forestchange import terrai
+from gfw.forestchange import versions
+from gfw.forestchange import viirs
+
+# Datasets with a time series
+SERIES_SQL = {
+    'forma-alerts': forma.FormaSql,
+    'nasa-active-fires': fires.FiresSql,
+    'quicc-alerts': quicc.QuiccSql,
+    'terrai-alerts': terrai.TerraiSql,
+    'glad-alerts': glad.GladSql,
+    'viirs-active-fires': viirs.FiresSql,
+}
+
+# Period used when the request has none, as in Sql.process()
+DEFAULT_BEGIN = datetime.datetime(2014, 1, 1)
+DEFAULT_END = datetime.datetime(2015, 1, 1)
+
+# Params that don't change the daily counts of an area
+_PERIOD_PARAMS = ['begin', 'end', 'interval', 'bust', 'dev']
+
+
+def bucket(day, interval):
+    """Return the first day of the interval containing day."""
+    if interval == 'week':
+        return day - datetime.timedelta(days=day.weekday())
+    elif interval == 'month':
+        return day.replace(day=1)
+    elif interval == 'year':
+        return day.replace(month=1, day=1)
+    return day
+
+
+def rollup(days, interval, begin, end):
+    """Return ordered [{date, value}] for interval from (date, value) days.
+
+    Only days from begin to end, inclusive, are counted."""
+    totals = {}
+    for day, value in days:
+        if begin <= day <= end:
+            start = bucket(day, interval)
+            totals[start] = totals.get(start, 0) + value
+    return [dict(date=date.strftime('%Y-%m-%d'), value=totals[date])
+            for date in sorted(totals)]
+
+
+def get_key(path, dataset, params):
+    """Return the cache key of the daily counts for a request's area."""
+    area = dict((k, v) for k, v in params.iteritems()
+                if k not in _PERIOD_PARAMS)
+    area['series'] = 'day'
+    return cache.get_key(path, area, versions.get(dataset))
+
+
+def _query_days(dataset, params, begin, end):
+    """Return (query, [(date, value)]) of daily counts from CartoDB."""
+    args = copy.copy(params)
+    args['begin'] = begin.strftime('%Y-%m-%d')
+    args['end'] = end.strftime('%Y-%m-%d')
+    query = SERIES_SQL[dataset].series(args)
+    response = cdb.execute(query)
+    if response.status_code != 200:
+        raise ValueError('CartoDB Error: %s' % response.content)
+    f = datetime.datetime.strptime
+    days = [(f(row['date'][:10], '%Y-%m-%d').date(), row['value'])
+            for row in json.loads(response.content)['rows']]
+    return query, days
+
+
+def get_days(path, dataset, params, begin, end, soft_ttl=None):
+    """Return (query, days) covering begin to end, from the cache if it can.
+
+    A cached series covering a wider period answers narrower requests. On a
+    miss the series is queried for the union of both periods and cached."""
+    key = get_key(path, dataset, params)
+    cached = None if 'bust' in params else cache.get(key)
+    if cached and cached['begin'] <= begin and end <= cached['end']:
+        return None, cached['days']
+    if cached:
+        begin, end = min(begin, cached['begin']), max(end, cached['end'])
+    query, days = _query_days(dataset, params, begin, end)
+    cache.set(key, dict(begin=begin, end=end, days=days), soft_ttl=soft_ttl)
+    return query, days
+
+
+def execute(path, dataset, params, soft_ttl=None):
+    """Return (action, data) with the series of a request's interval."""
+    begin = (params.get('begin') or DEFAULT_BEGIN).date()
+    end = (params.get('end') or DEFAULT_END).date()
+    try:
+        query, days = get_days(path, dataset, params, begin, end, soft_ttl)
+    except Exception, e:
+        return 'error', {'error': '%s' % (e.message or e)}
+
+    result = {}
+    result['params'] = dict(params, begin=begin.strftime('%Y-%m-%d'),
+                            end=end.strftime('%Y-%m-%d'))
+    if 'geojson' in params:
+        result['params']['geojson'] = json.loads(params['geojson'])
+    result['series'] = rollup(days, params['interval'], begin, end)
+    result['value'] = sum(row['value'] for row in result['series'])
+    if 'dev' in params:
+        result['dev'] = {'sql': query}
+    return 'respond', result
@@ -24,6 +24,8 @@ from gfw.forestchange.common import Sql
 
 class TerraiSql(Sql):
 
+    SERIES_DATE = 'date'
+
     MIN_MAX_DATE_SQL = ", MIN(date) as min_date, MAX(date) as max_date"
 
     WORLD = """
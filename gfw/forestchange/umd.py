@@ -22,9 +22,24 @@ import ee
 import logging
 import config
 
+from gfw import cache
+from gfw import gee
+from gfw import geometry
+from gfw.forestchange.common import ALL_THRESH
+from gfw.forestchange.common import AREA_KEYS
 from gfw.forestchange.common import CartoDbExecutor
+from gfw.forestchange.common import LOSS_TTL
 from gfw.forestchange.common import Sql
+from gfw.forestchange.common import THRESHOLDS
 from gfw.forestchange.common import classify_query
+from gfw.forestchange.common import geometry_key
+from gfw.forestchange.common import get_loss
+from gfw.forestchange.common import loss_result
+from gfw.forestchange.common import multi_area
+from gfw.forestchange.common import split_thresholds
+
+# Vertices of the geometries reduced together by execute_batch()
+BATCH_VERTICES = 50000
 
 
 def _get_coords(geojson):
@@ -38,8 +53,16 @@ def _sum_range(data, begin, end):
 
 
 def _get_thresh_image(thresh, asset_id):
-    """Renames image bands using supplied threshold and returns image."""
+    """Renames image bands using supplied threshold and returns image.
+
+    With ALL_THRESH, the bands of every threshold are kept with their
+    threshold suffix."""
     image = ee.Image(asset_id)
+    if thresh == ALL_THRESH:
+        bands = ['.*_(%s)' % '|'.join(THRESHOLDS)]
+        if 'gain' in asset_id:
+            bands.append('gain')
+        return image.select(*bands)
 
     # Select out the gain band if it exists
     if 'gain' in asset_id:
@@ -65,27 +88,104 @@ def _get_region(geom):
     return region
 
 
-def _ee(geom, thresh, asset_id):
-    image = _get_thresh_image(thresh, asset_id)
-    region = _get_region(geom)
+def _area_image(image):
+    """Return image in hectares per pixel."""
+    return image.divide(10000 * 255.0).multiply(ee.Image.pixelArea())
 
-    # Reducer arguments
-    reduce_args = {
+
+def _reduce_args(region):
+    """Return reduceRegion arguments, the same for single and batch runs."""
+    return {
         'reducer': ee.Reducer.sum(),
         'geometry': region,
         'bestEffort': True,
         'scale': 90
     }
 
+
+def _reduce(image, geom):
+    """Return hectares per band of image summed over the GeoJSON region."""
+    region = _get_region(geom)
+
     # Calculate stats
-    area_stats = image.divide(10000 * 255.0) \
-        .multiply(ee.Image.pixelArea()) \
-        .reduceRegion(**reduce_args)
+    area_stats = _area_image(image).reduceRegion(**_reduce_args(region))
     area_results = area_stats.getInfo()
 
     return area_results
 
 
+def _reduce_regions(image, geoms):
+    """Return hectares per band of image summed over each GeoJSON region.
+
+    Each region is reduced like _reduce() does, and only the sums come
+    back, without the geometries."""
+    area_image = _area_image(image)
+
+    def reduce_feature(feature):
+        stats = area_image.reduceRegion(**_reduce_args(feature.geometry()))
+        return ee.Feature(None, stats).set('index', feature.get('index'))
+
+    features = ee.FeatureCollection([
+        ee.Feature(_get_region(geom), {'index': i})
+        for i, geom in enumerate(geoms)])
+
+    # Calculate stats of every region at once
+    area_stats = features.map(reduce_feature)
+
+    area_results = [None] * len(geoms)
+    for feature in area_stats.getInfo()['features']:
+        properties = feature['properties']
+        area_results[properties.pop('index')] = properties
+    return area_results
+
+
+def _chunks(batch):
+    """Yield runs of (args, geom) pairs within BATCH_VERTICES in all.
+
+    Geometries bigger than that are reduced on their own."""
+    chunk, vertices = [], 0
+    for args, geom in batch:
+        size = geometry.vertices(geom)
+        if chunk and vertices + size > BATCH_VERTICES:
+            yield chunk
+            chunk, vertices = [], 0
+        chunk.append((args, geom))
+        vertices += size
+    if chunk:
+        yield chunk
+
+
+def _get_hansen_image(thresh):
+    """Return gain and tree extent bands with a loss band per year."""
+    extent = _get_thresh_image(thresh, config.assets['hansen_all_thresh'])
+    loss = _get_thresh_image(thresh, config.assets['hansen_loss_thresh'])
+    if thresh == ALL_THRESH:
+        return extent.select('gain', 'tree_.*').addBands(loss)
+    return extent.select(['gain', 'tree']).addBands(loss)
+
+
+def _split_hansen(results, thresh):
+    """Return {gain, tree, loss} from reduced bands, loss being by year.
+
+    With ALL_THRESH, return them by threshold."""
+    gain = results.pop('gain')
+    if thresh != ALL_THRESH:
+        return dict(gain=gain, tree=results.pop('tree'), loss=results)
+    matrix = split_thresholds(results)
+    return dict((t, dict(gain=gain, tree=bands.pop('tree'), loss=bands))
+                for t, bands in matrix.iteritems())
+
+
+def _ee_hansen(geom, thresh):
+    """Return {gain, tree, loss} for geom from a single reduction."""
+    gee.initialize()
+    # gain (UMD doesn't permit disaggregation of forest gain by
+    # threshold), tree extent in 2000 and loss by year
+    loss = _split_hansen(_reduce(_get_hansen_image(thresh), geom), thresh)
+    logging.info('LOSS_RESULTS: %s' % loss)
+    return loss
+
+
 def _loss_area(row):
     """Return hectares of loss."""
     return row['year'], row['loss']
@@ -230,53 +330,59 @@ def _executeIflId1(args):
     return action, data
 
 
-def _execute_geojson(args):
-    """Query GEE using supplied args with threshold and geojson."""
+def _loss_key(args):
+    """Return the cache key of the loss vectors of args for any period."""
+    return 'umd:%s:%s:%s:%s' % (
+        config.assets['hansen_all_thresh'], config.assets['hansen_loss_thresh'],
+        args.get('thresh'), geometry_key(args))
 
-    # Authenticate to GEE and maximize the deadline
-    ee.Initialize(config.EE_CREDENTIALS, config.EE_URL)
-    ee.data.setDeadline(60000)
 
-    # The forest cover threshold and polygon
-    thresh = str(args.get('thresh'))
+def _get_loss(args, geojson=None, lookup=True):
+    """Return gain, tree extent and loss by year for the area of args."""
+    return get_loss(args, _loss_key, _ee_hansen, geojson, lookup)
 
-    try:
-        geojson = json.loads(args.get('geojson'))
-    except Exception:
-        geojson = args.get('geojson')
-
-    # hansen_all_thresh
-    hansen_all = _ee(geojson, thresh, config.assets['hansen_all_thresh'])
-    # gain (UMD doesn't permit disaggregation of forest gain by threshold).
-    gain = hansen_all['gain']
-    logging.info('GAIN: %s' % gain)
-    # tree extent in 2000
-    tree_extent = hansen_all['tree']
-    logging.info('TREE_EXTENT: %s' % tree_extent)
 
-    # Loss by year
-    loss_by_year = _ee(geojson, thresh, config.assets['hansen_loss_thresh'])
-    logging.info('LOSS_RESULTS: %s' % loss_by_year)
+def _period_loss(args, loss):
+    """Return gain, loss over the period of args and tree extent."""
 
     # Reduce loss by year for supplied begin and end year
     begin = args.get('begin').split('-')[0]
     end = args.get('end').split('-')[0]
-    loss = _sum_range(loss_by_year, begin, end)
+    return {
+        'gain': loss['gain'],
+        'loss': _sum_range(loss['loss'], begin, end),
+        'tree-extent': loss['tree']
+    }
+
+
+def _loss_result(args, loss):
+    """Return the response for args from their area's loss vectors."""
+    return loss_result(args, loss, _period_loss)
 
-    # Prepare result object
-    result = {}
-    result['params'] = args
-    result['params']['geojson'] = json.loads(result['params']['geojson'])
-    result['gain'] = gain
-    result['loss'] = loss
-    result['tree-extent'] = tree_extent
 
-    return 'respond', result
+def _analyze_geojson(args, lookup=True):
+    """Query GEE for threshold and geojson unless their loss is cached.
+
+    lookup is False when the cache is already known to miss."""
+    try:
+        geojson = json.loads(args.get('geojson'))
+    except Exception:
+        geojson = args.get('geojson')
+    return _loss_result(args, _get_loss(args, geojson, lookup))
 
 
 def _executeWdpa(args):
     """Query GEE using supplied WDPA id."""
-    action, data = CartoDbExecutor.execute(args, UmdSql)
+    args['begin'] = args['begin'] if 'begin' in args else '2001-01-01'
+    args['end'] = args['end'] if 'end' in args else '2013-01-01'
+    loss = _get_loss(args)
+    if loss is not None:
+        return _loss_result(args, loss)
+
+    # Authenticate to GEE while the geometry query is in flight
+    future = CartoDbExecutor.execute_async(args, UmdSql)
+    gee.initialize()
+    action, data = CartoDbExecutor.get_result(future)
     if action == 'error':
         return action, data
     rows = data['rows']
@@ -284,24 +390,29 @@ def _executeWdpa(args):
     data.pop('download_urls')
     if rows[0]['geojson']==None:
         args['geojson'] = rows[0]['geojson']
-        args['begin'] = args['begin'] if 'begin' in args else '2001-01-01'
-        args['end'] = args['end'] if 'end' in args else '2013-01-01'
         data['params'].pop('geojson')
         data['gain'] = 0
         data['loss'] = 0
         data['tree-extent'] = 0
     elif rows:
         args['geojson'] = rows[0]['geojson']
-        args['begin'] = args['begin'] if 'begin' in args else '2001-01-01'
-        args['end'] = args['end'] if 'end' in args else '2013-01-01'
-        action, data = _execute_geojson(args)
+        action, data = _analyze_geojson(args, lookup=False)
         data['params'].pop('geojson')
     return action, data
 
 
 def _executeUse(args):
     """Query GEE using supplied concession id."""
-    action, data = CartoDbExecutor.execute(args, UmdSql)
+    args['begin'] = args['begin'] if 'begin' in args else '2001-01-01'
+    args['end'] = args['end'] if 'end' in args else '2013-01-01'
+    loss = _get_loss(args)
+    if loss is not None:
+        return _loss_result(args, loss)
+
+    # Authenticate to GEE while the geometry query is in flight
+    future = CartoDbExecutor.execute_async(args, UmdSql)
+    gee.initialize()
+    action, data = CartoDbExecutor.get_result(future)
     if action == 'error':
         return action, data
     rows = data['rows']
@@ -309,16 +420,14 @@ def _executeUse(args):
     data.pop('download_urls')
     if rows:
         args['geojson'] = rows[0]['geojson']
-        args['begin'] = args['begin'] if 'begin' in args else '2001-01-01'
-        args['end'] = args['end'] if 'end' in args else '2013-01-01'
-        action, data = _execute_geojson(args)
+        action, data = _analyze_geojson(args, lookup=False)
         data['params'].pop('geojson')
     return action, data
 
 
 def _executeWorld(args):
     """Query GEE using supplied args with threshold and polygon."""
-    return _execute_geojson(args)
+    return _analyze_geojson(args)
 
 
 def execute(args):
@@ -333,6 +442,11 @@ def execute(args):
     if 'thresh' not in args:
         args['thresh'] = 30
 
+    # All thresholds at once are only computed on GEE
+    if (args['thresh'] == ALL_THRESH and
+            query_type not in ['use', 'wdpa', 'world']):
+        return 'error', {'error': 'thresh=all requires geojson, wdpa or use'}
+
     if query_type == 'iso':
         return _executeIso(args)
     elif query_type == 'id1':
@@ -347,3 +461,90 @@ def execute(args):
         return _executeWdpa(args)
     elif query_type == 'world':
         return _executeWorld(args)
+
+
+def _fetch_geometries(args_list):
+    """Return the geojson of wdpa and use args with one query per table."""
+    tables = {}
+    for i, args in enumerate(args_list):
+        tables.setdefault((classify_query(args), args.get('use')), []).append(i)
+    geoms = [None] * len(args_list)
+    for (query_type, use), indexes in tables.iteritems():
+        key = AREA_KEYS[query_type]
+        with multi_area([args_list[i][key] for i in indexes]):
+            for i in indexes:
+                action, data = CartoDbExecutor.execute(
+                    dict(args_list[i]), UmdSql)
+                rows = data.get('rows') if action == 'respond' else None
+                geoms[i] = rows[0]['geojson'] if rows else None
+    return geoms
+
+
+def _analyze_batch(batch):
+    """Compute and cache the loss of (args, geom) pairs in one reduction.
+
+    Every args of batch has the same threshold."""
+    thresh = str(batch[0][0]['thresh'])
+    geoms = [geom for args, geom in batch]
+    results = _reduce_regions(_get_hansen_image(thresh), geoms)
+    for (args, geom), result in zip(batch, results):
+        loss = _split_hansen(result, thresh)
+        cache.set(_loss_key(args), loss, durable=True, soft_ttl=LOSS_TTL)
+
+
+def analyze_batch(args_list):
+    """Compute and cache the GEE analyses of args_list missing from the cache.
+
+    Custom polygons, protected areas and concessions are reduced with one
+    call per threshold and BATCH_VERTICES vertices. Failures are logged and
+    leave the analyses uncached."""
+    world, areas = [], []
+    for args in args_list:
+        query_type = classify_query(args)
+        if 'thresh' not in args:
+            args['thresh'] = 30
+        if query_type in ['use', 'wdpa', 'world'] and _get_loss(args) is None:
+            (world if query_type == 'world' else areas).append(args)
+
+    pending = [(args, args.get('geojson')) for args in world]
+    if areas:
+        try:
+            pending.extend(zip(areas, _fetch_geometries(areas)))
+        except Exception, e:
+            # Left to execute() to fetch and compute one by one
+            logging.exception(e)
+    batches = {}
+    for args, geojson in pending:
+        if geojson:
+            geom = json.loads(geojson) \
+                if isinstance(geojson, basestring) else geojson
+            batches.setdefault(str(args['thresh']), []).append((args, geom))
+    if not batches:
+        return
+    try:
+        gee.initialize()
+    except Exception, e:
+        logging.exception(e)
+        return
+    for batch in batches.itervalues():
+        for chunk in _chunks(batch):
+            try:
+                _analyze_batch(chunk)
+            except Exception, e:
+                # Left to execute() to compute one by one
+                logging.exception(e)
+
+
+def execute_batch(args_list):
+    """Return [(action, data)] of execute() for each of args_list.
+
+    GEE analyses are computed together by analyze_batch() first and then
+    answered from the cache."""
+    analyze_batch(args_list)
+    results = []
+    for args in args_list:
+        try:
+            results.append(execute(args))
+        except Exception, e:
+            results.append(('error', {'error': '%s' % (e.message or e)}))
+    return results
@@ -0,0 +1,121 @@
+# Global Forest Watch API
+# Copyright (C) 2015 World Resource Institute
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""This module tracks a version token per dataset for cache keys.
+
+The token is a hash of the newest rows returned by the dataset's LATEST
+query, so it changes when new alerts are ingested. Tokens are refreshed on
+a schedule and held in memcache."""
+
+import json
+import logging
+from hashlib import md5
+
+from google.appengine.api import memcache
+
+from gfw import cdb
+from gfw.forestchange import fires
+from gfw.forestchange import forma
+from gfw.forestchange import glad
+from gfw.forestchange import guyra
+from gfw.forestchange import imazon
+from gfw.forestchange import prodes
+from gfw.forestchange import quicc
+from gfw.forestchange import terrai
+from gfw.forestchange import viirs
+
+# Datasets with a LATEST query; others have a static version:
+LATEST_SQL = {
+    'forma-alerts': forma.FormaSql,
+    'nasa-active-fires': fires.FiresSql,
+    'quicc-alerts': quicc.QuiccSql,
+    'imazon-alerts': imazon.ImazonSql,
+    'terrai-alerts': terrai.TerraiSql,
+    'glad-alerts': glad.GladSql,
+    'prodes-loss': prodes.ProdesSql,
+    'guyra-loss': guyra.GuyraSql,
+    'viirs-active-fires': viirs.FiresSql,
+}
+
+STATIC_VERSION = 'static'
+
+# Seconds a failed fetch keeps get() from fetching the token again
+ERROR_SECONDS = 60
+
+# Last token seen by this instance, by dataset
+_last = {}
+
+
+def _key(dataset):
+    return 'version:%s' % dataset
+
+
+def _error_key(dataset):
+    return 'version-error:%s' % dataset
+
+
+def _token(response):
+    if response.status_code != 200:
+        raise Exception('CartoDB error: %s' % response.content)
+    rows = json.loads(response.content)['rows']
+    return md5(json.dumps(rows, sort_keys=True)).hexdigest()[:12]
+
+
+def _fetch_async(dataset):
+    query = LATEST_SQL[dataset].latest({}, {'limit': 1})[0]
+    return cdb.execute_async(query).then(_token)
+
+
+def get(dataset):
+    """Return the current version token for dataset.
+
+    Falls back to fetching the token when memcache has lost it. When that
+    fails, fetching is skipped for ERROR_SECONDS and the last token seen
+    by the instance is returned. Returns None if there is none, so callers
+    key on the dataset alone."""
+    if dataset not in LATEST_SQL:
+        return STATIC_VERSION
+    token = memcache.get(_key(dataset))
+    if token is None and not memcache.get(_error_key(dataset)):
+        try:
+            token = _fetch_async(dataset).get_result()
+            memcache.add(_key(dataset), token)
+        except Exception, e:
+            logging.exception(e)
+            memcache.set(_error_key(dataset), True, time=ERROR_SECONDS)
+    if token is None:
+        return _last.get(dataset)
+    _last[dataset] = token
+    return token
+
+
+def refresh():
+    """Refresh all version tokens and return {dataset: (old, new)}."""
+    futures = dict((dataset, _fetch_async(dataset)) for dataset in LATEST_SQL)
+    result = {}
+    for dataset, future in futures.iteritems():
+        old = memcache.get(_key(dataset))
+        try:
+            token = future.get_result()
+        except Exception, e:
+            logging.exception(e)
+            continue
+        memcache.set(_key(dataset), token)
+        memcache.delete(_error_key(dataset))
+        _last[dataset] = token
+        result[dataset] = (old, token)
+    return result
@@ -59,3 +59,25 @@ def create_file(value, filename, content_type):
     gcs_file.write(value)
     gcs_file.close()
     return '/gs%s' % path
+
+
+def read_file(filename):
+    """Return contents of supplied file in the analysis bucket or None."""
+    path = ''.join([ANALYSIS_BUCKET, filename])
+    try:
+        gcs_file = gcs.open(path, 'r')
+        value = gcs_file.read()
+        gcs_file.close()
+        return value
+    except gcs.NotFoundError:
+        logging.info('GCS NOT FOUND %s' % path)
+        return None
+
+
+def delete_file(filename):
+    """Delete supplied file from the analysis bucket if it exists."""
+    path = ''.join([ANALYSIS_BUCKET, filename])
+    try:
+        gcs.delete(path)
+    except gcs.NotFoundError:
+        pass
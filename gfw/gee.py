@@ -0,0 +1,93 @@
+# Global Forest Watch API
+# Copyright (C) 2015 World Resource Institute
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""This module holds the per-instance Earth Engine session.
+
+The session is initialized on first use and shared by every request and
+thread of the instance. Its OAuth token is refreshed shortly before it
+expires so requests don't wait on it."""
+
+import datetime
+import logging
+import threading
+import time
+
+import config
+import ee
+import httplib2
+
+# Milliseconds Earth Engine requests may take
+DEADLINE = 60000
+
+# Seconds before expiry an access token is refreshed
+REFRESH_SECONDS = 5 * 60
+
+_lock = threading.Lock()
+_initialized = False
+_stats = dict(initialize=dict(count=0, seconds=0.0, errors=0),
+              refresh=dict(count=0, seconds=0.0, errors=0))
+
+
+def stats():
+    """Return per-instance session setup counts and seconds spent."""
+    return dict((name, dict(counts)) for name, counts in _stats.iteritems())
+
+
+def _expiring(credentials):
+    """Return True if the credentials' token is missing or about to expire."""
+    if credentials is None:
+        return False
+    if not getattr(credentials, 'access_token', None):
+        return True
+    expiry = getattr(credentials, 'token_expiry', None)
+    return expiry is not None and expiry - datetime.datetime.utcnow() < \
+        datetime.timedelta(seconds=REFRESH_SECONDS)
+
+
+def _timed(name, function, *args):
+    start = time.time()
+    try:
+        return function(*args)
+    except Exception:
+        _stats[name]['errors'] += 1
+        raise
+    finally:
+        _stats[name]['count'] += 1
+        _stats[name]['seconds'] += time.time() - start
+
+
+def _initialize():
+    ee.Initialize(config.EE_CREDENTIALS, config.EE_URL)
+    ee.data.setDeadline(DEADLINE)
+
+
+def initialize():
+    """Initialize the Earth Engine session unless it is ready."""
+    global _initialized
+    if _initialized and not _expiring(config.EE_CREDENTIALS):
+        return
+    with _lock:
+        if not _initialized:
+            _timed('initialize', _initialize)
+            _initialized = True
+        if _expiring(config.EE_CREDENTIALS):
+            try:
+                _timed('refresh', config.EE_CREDENTIALS.refresh,
+                       httplib2.Http())
+            except Exception, e:
+                # Requests still refresh the token when it is rejected
+                logging.exception(e)
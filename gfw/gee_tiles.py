@@ -24,13 +24,14 @@ import time
 import math
 import webapp2
 import json
-import config
 import logging
 
 from google.appengine.api import memcache
 from google.appengine.api import urlfetch
 from google.appengine.ext import ndb
 
+from gfw import gee
+
 
 
 # definition of auxiliar functions
@@ -44,14 +45,14 @@ def _get_key(reqid, request):
 
 def _get_landsat_tokens(year):
   #retrieve tokens for the landsat images.
-  ee.Initialize(config.EE_CREDENTIALS, config.EE_URL)
+  gee.initialize()
   landSat = ee.Image("LE7_TOA_1YEAR/" + year).select("B3","B2","B1")
   return landSat.getMapId({'opacity': 1, 'gain':3.5, 'bias':4, 'gamma':1.5})
 
 def _get_gcoverage_token():
   # The Green Forest Coverage background created by Andrew Hill
   # example here: http://ee-api.appspot.com/#331746de9233cf1ee6a4afd043b1dd8f
-  ee.Initialize(config.EE_CREDENTIALS, config.EE_URL)
+  gee.initialize()
   treeHeight = ee.Image("Simard_Pinto_3DGlobalVeg_JGR")
   elev = ee.Image('srtm90_v4')
   mask2 = elev.gt(0).add(treeHeight.mask())
@@ -61,7 +62,7 @@ def _get_gcoverage_token():
 def _get_bwcoverage_token():
   # The Green Forest Coverage background created by Andrew Hill
   # example here: http://ee-api.appspot.com/#331746de9233cf1ee6a4afd043b1dd8f
-  ee.Initialize(config.EE_CREDENTIALS, config.EE_URL)
+  gee.initialize()
   treeHeight = ee.Image("Simard_Pinto_3DGlobalVeg_JGR")
   elev = ee.Image('srtm90_v4')
   mask2 = elev.gt(0).add(treeHeight.mask())
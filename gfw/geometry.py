@@ -0,0 +1,415 @@
+# Global Forest Watch API
+# Copyright (C) 2015 World Resource Institute
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""This module supports GeoJSON geometry normalization and simplification.
+
+Equivalent polygons normalize to the same structure regardless of
+coordinate precision, ring start vertex, ring orientation or member order,
+so they can share cache entries. Detailed polygons are simplified to a
+vertex budget before they are inlined into SQL or sent to Earth Engine."""
+
+import json
+import math
+
+# Decimal places kept for coordinates (about 0.1 meters at the equator):
+PRECISION = 6
+
+# Polygons with more vertices than this are simplified:
+MAX_VERTICES = 2000
+
+# Simplification never uses a tolerance finer than this share of the
+# polygon's extent (its bounding box diagonal):
+MIN_TOLERANCE_RATIO = 1e-5
+
+
+def _signed_area(ring):
+    """Return twice the signed area of ring, positive when counterclockwise."""
+    return sum(x0 * y1 - x1 * y0
+               for (x0, y0), (x1, y1) in zip(ring, ring[1:] + ring[:1]))
+
+
+def _normalize_ring(ring, precision, clockwise):
+    points = []
+    for point in ring:
+        # Adding 0.0 turns -0.0 into 0.0
+        point = [round(float(point[0]), precision) + 0.0,
+                 round(float(point[1]), precision) + 0.0]
+        if not points or points[-1] != point:
+            points.append(point)
+    if len(points) > 1 and points[0] == points[-1]:
+        points.pop()
+    if not points:
+        return points
+    if (_signed_area(points) < 0) != clockwise:
+        points.reverse()
+    start = points.index(min(points))
+    points = points[start:] + points[:start]
+    return points + points[:1]
+
+
+def _normalize_polygon(rings, precision):
+    """Exterior ring counterclockwise and holes clockwise, per RFC 7946."""
+    if not rings:
+        return []
+    exterior = _normalize_ring(rings[0], precision, False)
+    holes = sorted(_normalize_ring(ring, precision, True) for ring in rings[1:])
+    return [exterior] + holes
+
+
+def normalize(geojson, precision=PRECISION):
+    """Return supplied GeoJSON geometry (dict or string) in canonical form.
+
+    Features and FeatureCollections are reduced to their geometries, since
+    properties don't affect analysis."""
+    if isinstance(geojson, basestring):
+        geojson = json.loads(geojson)
+    if not isinstance(geojson, dict):
+        return geojson
+    gtype = geojson.get('type')
+    if gtype == 'Polygon':
+        return dict(type=gtype, coordinates=_normalize_polygon(
+            geojson['coordinates'], precision))
+    if gtype == 'MultiPolygon':
+        return dict(type=gtype, coordinates=sorted(
+            _normalize_polygon(polygon, precision)
+            for polygon in geojson['coordinates']))
+    if gtype == 'Feature':
+        return normalize(geojson.get('geometry'), precision)
+    if gtype == 'FeatureCollection':
+        geometries = [normalize(f.get('geometry'), precision)
+                      for f in geojson.get('features', [])]
+        return dict(type='GeometryCollection', geometries=sorted(geometries))
+    if gtype == 'GeometryCollection':
+        return dict(type=gtype, geometries=sorted(
+            normalize(g, precision) for g in geojson.get('geometries', [])))
+    return geojson
+
+
+def fingerprint(geojson, precision=PRECISION):
+    """Return a canonical JSON string for supplied GeoJSON geometry."""
+    return json.dumps(normalize(geojson, precision), sort_keys=True,
+                      separators=(',', ':'))
+
+
+def vertices(geojson):
+    """Return the number of positions in a GeoJSON geometry."""
+    def count(coordinates):
+        if not coordinates or not isinstance(coordinates[0], list):
+            return 1 if coordinates else 0
+        return sum(count(c) for c in coordinates)
+    if geojson.get('type') == 'GeometryCollection':
+        return sum(vertices(g) for g in geojson.get('geometries', []))
+    return count(geojson.get('coordinates', []))
+
+
+def _rings(geojson):
+    """Return the list of rings of each polygon in a Polygon or MultiPolygon."""
+    if geojson['type'] == 'Polygon':
+        return [geojson['coordinates']]
+    return geojson['coordinates']
+
+
+def _segment_distance(point, start, end):
+    """Return the distance from point to the segment from start to end."""
+    x, y = point[0], point[1]
+    x0, y0 = start[0], start[1]
+    dx, dy = end[0] - x0, end[1] - y0
+    if dx or dy:
+        t = ((x - x0) * dx + (y - y0) * dy) / float(dx * dx + dy * dy)
+        t = max(0.0, min(1.0, t))
+        x0, y0 = x0 + t * dx, y0 + t * dy
+    return math.hypot(x - x0, y - y0)
+
+
+def _importance(ring):
+    """Return the Douglas-Peucker importance of each vertex of an open ring.
+
+    A vertex is kept for any tolerance below its importance. Runs the
+    split iteratively and caps each vertex at its parent's importance, so
+    keeping vertices above a tolerance gives the same result as
+    Douglas-Peucker with that tolerance. The three vertices spanning the
+    ring are always kept so rings never collapse."""
+    size = len(ring)
+    importance = [0.0] * size
+    if size < 4:
+        return [float('inf')] * size
+    # Anchor on the vertex farthest from the first one, then on the vertex
+    # farthest from the chord between the two
+    anchor = max(range(size), key=lambda i: math.hypot(
+        ring[i][0] - ring[0][0], ring[i][1] - ring[0][1]))
+    third = max(range(size), key=lambda i: _segment_distance(
+        ring[i], ring[0], ring[anchor]))
+    points = ring + ring[:1]
+    for index in (0, anchor, third):
+        importance[index] = float('inf')
+    splits = sorted(set([0, anchor, third, size]))
+    stack = [(first, last, float('inf'))
+             for first, last in zip(splits, splits[1:])]
+    while stack:
+        first, last, cap = stack.pop()
+        best, best_distance = None, -1.0
+        for index in range(first + 1, last):
+            distance = _segment_distance(
+                points[index], points[first], points[last])
+            if distance > best_distance:
+                best, best_distance = index, distance
+        if best is None:
+            continue
+        importance[best] = min(best_distance, cap)
+        stack.append((first, best, importance[best]))
+        stack.append((best, last, importance[best]))
+    return importance
+
+
+def _ring_anchors(ring):
+    """Return how many vertices of an open ring are kept at any tolerance."""
+    return min(len(ring), 3)
+
+
+def _drop_small_rings(polygons, max_vertices):
+    """Return polygons without their smallest holes and parts.
+
+    Holes and whole polygons are dropped by increasing area until the
+    vertices kept at any tolerance fit max_vertices. The exterior ring of
+    a kept polygon and the largest polygon are never dropped."""
+    areas = [[abs(_signed_area(ring)) for ring in rings] for rings in polygons]
+    anchors = sum(_ring_anchors(ring) for rings in polygons for ring in rings)
+    if anchors <= max_vertices:
+        return polygons
+    largest = max(range(len(polygons)), key=lambda p: areas[p][0])
+    candidates = sorted(
+        (areas[p][r], p, r) for p, rings in enumerate(polygons)
+        for r in range(len(rings)) if r or p != largest)
+    dropped = set()
+    for _, p, r in candidates:
+        if anchors <= max_vertices:
+            break
+        if (p, 0) in dropped or (p, r) in dropped:
+            continue
+        indexes = [r] if r else range(len(polygons[p]))
+        for index in indexes:
+            if (p, index) not in dropped:
+                dropped.add((p, index))
+                anchors -= _ring_anchors(polygons[p][index])
+    return [[ring for r, ring in enumerate(rings) if (p, r) not in dropped]
+            for p, rings in enumerate(polygons) if (p, 0) not in dropped]
+
+
+def _simplify_ring(ring, importance, tolerance, precision):
+    simplified = []
+    for point, weight in zip(ring, importance):
+        if weight > tolerance:
+            point = [round(point[0], precision) + 0.0,
+                     round(point[1], precision) + 0.0]
+            if not simplified or simplified[-1] != point:
+                simplified.append(point)
+    if len(simplified) > 1 and simplified[0] == simplified[-1]:
+        simplified.pop()
+    return simplified
+
+
+def _orientation(a, b, c):
+    cross = (b[0] - a[0]) * (c[1] - a[1]) - (b[1] - a[1]) * (c[0] - a[0])
+    return (cross > 0) - (cross < 0)
+
+
+def _between(a, b, c):
+    """Return True if c, collinear with a and b, lies on segment ab."""
+    return (min(a[0], b[0]) <= c[0] <= max(a[0], b[0]) and
+            min(a[1], b[1]) <= c[1] <= max(a[1], b[1]))
+
+
+def _segments_intersect(a, b, c, d):
+    o1, o2 = _orientation(a, b, c), _orientation(a, b, d)
+    o3, o4 = _orientation(c, d, a), _orientation(c, d, b)
+    if o1 != o2 and o3 != o4:
+        return True
+    return ((o1 == 0 and _between(a, b, c)) or
+            (o2 == 0 and _between(a, b, d)) or
+            (o3 == 0 and _between(c, d, a)) or
+            (o4 == 0 and _between(c, d, b)))
+
+
+def _rings_cross(rings):
+    """Return True if any ring crosses itself or another ring.
+
+    Rings are open. Segments are swept by x so only those with overlapping
+    extents are compared. Rings touching at a point count as crossing."""
+    segments = []
+    for r, ring in enumerate(rings):
+        for i, a in enumerate(ring):
+            b = ring[(i + 1) % len(ring)]
+            segments.append((min(a[0], b[0]), max(a[0], b[0]),
+                             min(a[1], b[1]), max(a[1], b[1]), a, b, r, i))
+    segments.sort()
+    active = []
+    for segment in segments:
+        x0, x1, y0, y1, a, b, r, i = segment
+        active = [s for s in active if s[1] >= x0]
+        for _, _, oy0, oy1, c, d, other_r, j in active:
+            if oy1 < y0 or oy0 > y1:
+                continue
+            size = len(rings[r])
+            if other_r == r and (abs(i - j) in (1, size - 1)):
+                # Neighbours share a vertex and only fold back onto each
+                # other in a spike
+                shared, p, q = (b, a, d) if j == (i + 1) % size else (a, b, c)
+                if _orientation(shared, p, q) == 0 and \
+                        (_between(shared, p, q) or _between(shared, q, p)):
+                    return True
+                continue
+            if _segments_intersect(a, b, c, d):
+                return True
+        active.append(segment)
+    return False
+
+
+def _bounds(ring):
+    xs, ys = [p[0] for p in ring], [p[1] for p in ring]
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def _inside(point, ring, bounds):
+    """Return True if point is inside open ring, by ray casting."""
+    x, y = point[0], point[1]
+    if not (bounds[0] <= x <= bounds[2] and bounds[1] <= y <= bounds[3]):
+        return False
+    inside = False
+    for (x0, y0), (x1, y1) in zip(ring, ring[-1:] + ring[:-1]):
+        if (y0 > y) != (y1 > y) and \
+                x < x0 + (y - y0) * (x1 - x0) / float(y1 - y0):
+            inside = not inside
+    return inside
+
+
+def _valid(polygons):
+    """Return True if open-ring polygons form a valid (Multi)Polygon.
+
+    No ring may cross itself or any other ring or have zero area, each
+    hole must lie inside its exterior and outside the other holes, and no
+    part may lie inside another part's area."""
+    every_ring = [ring for rings in polygons for ring in rings]
+    if any(not _signed_area(ring) for ring in every_ring) or \
+            _rings_cross(every_ring):
+        return False
+    # Without crossings, one vertex tells on which side of a ring a ring is
+    bounds = [[_bounds(ring) for ring in rings] for rings in polygons]
+    for p, rings in enumerate(polygons):
+        for r, hole in enumerate(rings[1:], 1):
+            if not _inside(hole[0], rings[0], bounds[p][0]):
+                return False
+            if any(_inside(hole[0], other, bounds[p][o])
+                   for o, other in enumerate(rings[1:], 1) if o != r):
+                return False
+        for q, others in enumerate(polygons):
+            if q != p and _inside(rings[0][0], others[0], bounds[q][0]) and \
+                    not any(_inside(rings[0][0], hole, bounds[q][h])
+                            for h, hole in enumerate(others[1:], 1)):
+                return False
+    return True
+
+
+def _precision(tolerance):
+    """Return decimal places quantizing coordinates to a tenth of tolerance."""
+    quantum = tolerance / 10.0
+    if quantum <= 0:
+        return PRECISION
+    return max(0, min(PRECISION, int(math.ceil(-math.log10(quantum)))))
+
+
+def _simplify_polygons(polygons, importances, tolerance, precision):
+    """Return (simplified open-ring polygons, vertices kept)."""
+    simplified_polygons = []
+    kept = 0
+    for rings, ring_importances in zip(polygons, importances):
+        polygon = []
+        for ring, importance in zip(rings, ring_importances):
+            simplified = _simplify_ring(ring, importance, tolerance, precision)
+            if len(simplified) < 3:
+                # A collapsed exterior takes its holes with it
+                if not polygon:
+                    break
+                continue
+            kept += len(simplified)
+            polygon.append(simplified)
+        if polygon:
+            simplified_polygons.append(polygon)
+    return simplified_polygons, kept
+
+
+def simplify(geojson, max_vertices=MAX_VERTICES):
+    """Simplify a Polygon or MultiPolygon to at most max_vertices vertices.
+
+    The tolerance is the smallest that meets the vertex budget, but no finer
+    than MIN_TOLERANCE_RATIO of the polygon's extent, and coordinates are
+    quantized to a tenth of it. When the budget can't even hold three
+    vertices per ring, the smallest holes and parts are dropped first.
+
+    A result with crossing rings or holes outside their exterior is retried
+    with half the tolerance, over budget if need be, and the geometry is
+    returned unchanged if none down to the finest tolerance is valid.
+    Returns (geometry, simplification) where simplification describes what
+    was applied, or is None when the geometry is returned unchanged."""
+    if isinstance(geojson, basestring):
+        geojson = json.loads(geojson)
+    if geojson.get('type') not in ('Polygon', 'MultiPolygon'):
+        return geojson, None
+
+    # Open rings, without the closing position
+    polygons = [[ring[:-1] if len(ring) > 1 and ring[0] == ring[-1] else ring
+                 for ring in rings] for rings in _rings(geojson) if rings]
+    vertices = sum(len(ring) for rings in polygons for ring in rings)
+    if vertices <= max_vertices:
+        return geojson, None
+    rings_count = sum(len(rings) for rings in polygons)
+    polygons = _drop_small_rings(polygons, max_vertices)
+
+    points = [point for rings in polygons for ring in rings for point in ring]
+    xs, ys = [p[0] for p in points], [p[1] for p in points]
+    extent = math.hypot(max(xs) - min(xs), max(ys) - min(ys))
+
+    importances = [[_importance(ring) for ring in rings] for rings in polygons]
+    ranked = sorted((i for rings in importances for ring in rings for i in ring),
+                    reverse=True)
+    finest = extent * MIN_TOLERANCE_RATIO
+    tolerance = max(ranked[max_vertices] if len(ranked) > max_vertices else 0,
+                    finest)
+    if math.isinf(tolerance):
+        return geojson, None
+
+    while True:
+        precision = _precision(tolerance)
+        simplified, kept = _simplify_polygons(
+            polygons, importances, tolerance, precision)
+        if not simplified:
+            return geojson, None
+        if _valid(simplified):
+            break
+        if tolerance <= finest:
+            return geojson, None
+        tolerance = max(tolerance / 2.0, finest)
+
+    coordinates = [[ring + ring[:1] for ring in rings] for rings in simplified]
+
+    if geojson['type'] == 'Polygon':
+        geometry = dict(type='Polygon', coordinates=coordinates[0])
+    else:
+        geometry = dict(type='MultiPolygon', coordinates=coordinates)
+    return geometry, dict(
+        vertices=vertices, simplified_vertices=kept,
+        tolerance=tolerance, precision=precision,
+        dropped_rings=rings_count - sum(len(rings) for rings in coordinates))
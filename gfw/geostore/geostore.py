@@ -20,8 +20,15 @@ import json
 from appengine_config import runtime_config
 from google.appengine.ext import ndb
 
+from gfw import cache
+
 CHUNK_SIZE = 500000
 
+# Resolved geometries kept per instance, as (geojson, geometry) by id
+_geometries = cache.LocalCache(
+    max_entries=128, max_bytes=32 * 1024 * 1024,
+    sizeof=lambda entry: len(entry[0]))
+
 class Geostore(ndb.Model):
     geojson = ndb.TextProperty()
     next_id = ndb.KeyProperty()
@@ -73,3 +80,43 @@ class Geostore(ndb.Model):
             current_chunk = new_chunk
 
         return first_chunk
+
+
+def _to_geometry(geojson):
+    """Return the Polygon or MultiPolygon for stored geostore GeoJSON."""
+    if isinstance(geojson, basestring):
+        geojson = json.loads(geojson)
+    if 'geojson' in geojson:
+        return _to_geometry(geojson['geojson'])
+    if geojson.get('type') == 'Feature':
+        return _to_geometry(geojson['geometry'])
+    if geojson.get('type') == 'FeatureCollection':
+        geometries = [_to_geometry(f) for f in geojson.get('features', [])]
+        if len(geometries) == 1:
+            return geometries[0]
+        polygons = []
+        for geometry in geometries:
+            if geometry['type'] == 'Polygon':
+                polygons.append(geometry['coordinates'])
+            else:
+                polygons.extend(geometry['coordinates'])
+        return dict(type='MultiPolygon', coordinates=polygons)
+    if geojson.get('type') in ('Polygon', 'MultiPolygon'):
+        return geojson
+    raise ValueError('Unsupported geostore geometry %s' % geojson.get('type'))
+
+
+def get_geometry(geostore_id):
+    """Return (geojson, geometry) for the polygon stored under geostore_id.
+
+    geojson is the geometry serialized as JSON. Results are cached in the
+    instance, since stored geometries never change."""
+    entry = _geometries.get(geostore_id)
+    if entry is None:
+        geostore = ndb.Key(urlsafe=geostore_id).get()
+        if geostore is None:
+            raise ValueError('Geostore %s not found' % geostore_id)
+        geometry = _to_geometry(geostore.get_combined_geojson())
+        entry = (json.dumps(geometry), geometry)
+        _geometries.set(geostore_id, entry)
+    return entry
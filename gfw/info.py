@@ -19,7 +19,9 @@ import webapp2
 
 from google.appengine.api import modules
 
+from gfw import cache
 from gfw import common
+from gfw import gee
 from gfw.middlewares.cors import CORSRequestHandler
 
 class InfoApi(CORSRequestHandler):
@@ -31,7 +33,9 @@ class InfoApi(CORSRequestHandler):
         self.complete('respond', {
             'module': module,
             'instance': instance,
-            'version': version
+            'version': version,
+            'cache': cache.stats(),
+            'ee': gee.stats()
         })
 
 routes = [
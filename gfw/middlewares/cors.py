@@ -16,17 +16,16 @@
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
 import json
-import copy
-import re
 import logging
 import webapp2
 import datetime;
-from hashlib import md5
+import time
 from urlparse import urlparse
 
-from google.appengine.api import memcache
+from google.appengine.api import taskqueue
 from google.appengine.ext import ndb
 
+from gfw import cache
 from gfw.common import ALLOWED_DOMAINS
 
 class CORSRequestHandler(webapp2.RequestHandler):
@@ -74,21 +73,80 @@ class CORSRequestHandler(webapp2.RequestHandler):
         self.response.out.write(str(data))
 
     @classmethod
-    def get_or_execute(cls, args, target, rid):
+    def get_or_execute(cls, args, target, rid, soft_ttl=None):
+        """Returns cached (action, data) for rid or executes target.
+
+        With soft_ttl, results older than soft_ttl seconds are still served
+        while a task refreshes them in the background."""
         if 'bust' in args:
-            memcache.delete(rid)
-            result = target.execute(args)
+            cache.delete(rid)
+            result = None
         else:
-            result = memcache.get(rid)
-            if not result:
-                result = target.execute(args)
-                try:
-                    memcache.set(key=rid, value=result)
-                except Exception as e:
-                    logging.exception(e)
+            result, stale = cache.lookup(rid)
+            if result and stale:
+                cls._schedule_refresh(args, target, rid, soft_ttl)
+        if not result:
+            result = cls._execute_once(args, target, rid, soft_ttl)
         action, data = result
         return action, data
 
+    @classmethod
+    def _execute_once(cls, args, target, rid, soft_ttl=None):
+        """Executes target unless another caller already is for rid.
+
+        Concurrent misses on the same rid wait for the lease holder to
+        fill the cache instead of repeating the upstream work."""
+        token = cache.acquire_lease(rid)
+        if not token:
+            result = cache.wait(rid)
+            if result:
+                return result
+        try:
+            return cls.execute_and_cache(args, target, rid, soft_ttl)
+        finally:
+            if token:
+                cache.release_lease(rid, token)
+
+    @classmethod
+    def execute_and_cache(cls, args, target, rid, soft_ttl=None):
+        """Executes target and caches the result under rid."""
+        start = time.time()
+        result = target.execute(args)
+        elapsed = time.time() - start
+        try:
+            # Partial results are served but not cached
+            if isinstance(result[1], dict) and result[1].get('errors'):
+                return result
+            cache.set(rid, result, soft_ttl=soft_ttl,
+                      durable=elapsed >= cache.DURABLE_MIN_SECONDS)
+        except Exception as e:
+            logging.exception(e)
+        return result
+
+    @staticmethod
+    def _refresh_args_key(rid):
+        return 'refresh-args:%s' % rid
+
+    @classmethod
+    def _schedule_refresh(cls, args, target, rid, soft_ttl):
+        """Enqueues a background refresh of stale rid, once per key.
+
+        The args are cached beside rid rather than sent with the task, as
+        a custom polygon would not fit in a task payload."""
+        if not cache.acquire_refresh(rid):
+            return
+        try:
+            cache.set(cls._refresh_args_key(rid), args)
+            taskqueue.add(url='/cache/tasks/refresh',
+                queue_name='cache-refresh',
+                params=dict(
+                    rid=rid,
+                    target=target.__name__,
+                    soft_ttl=soft_ttl or ''))
+        except Exception as e:
+            logging.exception(e)
+            cache.release_refresh(rid)
+
     def args(self, only=[]):
         raw = {}
         if not self.request.arguments():
@@ -99,14 +157,9 @@ class CORSRequestHandler(webapp2.RequestHandler):
             vals = map(self.request.get, args)
             raw = dict(zip(args, vals))
 
-        result = {}
-        for key, val in raw.iteritems():
-            if only and key in only:
-                result[key] = val
-            else:
-                result[key] = val
-
-        return result
+        if not only:
+            return raw
+        return dict((key, val) for key, val in raw.iteritems() if key in only)
 
     def json_serial(self, obj):
         """JSON serializer for objects not serializable by default json code"""
@@ -127,11 +180,7 @@ class CORSRequestHandler(webapp2.RequestHandler):
         else:
             self.write_error(400, 'Unknown action %s' % action)
 
-    def get_id(self, params):
-        normalized_params = copy.copy(params)
-        if 'bust' in normalized_params: normalized_params.pop('bust')
-        normalized_params = json.dumps(normalized_params, sort_keys=True, default=self.json_serial)
-        normalized_params = re.sub(re.compile(r'\s+'), '', normalized_params)
-
-        return md5(self.request.host + self.request.path + normalized_params).hexdigest()
+    def get_id(self, params, version=None):
+        """Returns cache key for params, changing with the data version."""
+        return cache.get_key(self.request.path, params, version)
 
@@ -117,7 +117,7 @@ class Subscription(ndb.Model):
     def unsubscribe(self):
         return self.key.delete()
 
-    def run_analysis(self, begin, end):
+    def analysis_params(self, begin, end):
         params = copy.copy(self.params)
         params['begin'] = begin
         params['end'] = end
@@ -128,5 +128,20 @@ class Subscription(ndb.Model):
                 geom = geom['geometry']
             params['geojson'] = json.dumps(geom)
 
+        return params
+
+    def run_analysis(self, begin, end):
         topic = Topic.get_by_id(self.topic)
-        return topic.execute(params)
+        return topic.execute(self.analysis_params(begin, end))
+
+    @classmethod
+    def prepare_analyses(cls, topic, subscriptions, begin, end):
+        """Compute and cache the analyses of subscriptions as one batch."""
+        topic.prepare_batch(
+            [s.analysis_params(begin, end) for s in subscriptions])
+
+    @classmethod
+    def run_analyses(cls, topic, subscriptions, begin, end):
+        """Return the TopicResult of each subscription, run as one batch."""
+        return topic.execute_batch(
+            [s.analysis_params(begin, end) for s in subscriptions])
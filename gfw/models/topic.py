@@ -116,6 +116,29 @@ class Topic():
         action, data = self.analysis_class.execute(params)
         return TopicResult(self, data)
 
+    def can_batch(self):
+        return hasattr(self.analysis_class, 'execute_batch')
+
+    def prepare_batch(self, params_list):
+        """Compute and cache the analyses of several params at once."""
+        if self.can_batch():
+            self.analysis_class.analyze_batch(params_list)
+
+    def execute_batch(self, params_list):
+        """Return a TopicResult for each params, batched when supported."""
+        for params in params_list:
+            params['for_subscription'] = True
+        if self.can_batch():
+            results = self.analysis_class.execute_batch(params_list)
+        else:
+            results = []
+            for params in params_list:
+                try:
+                    results.append(self.analysis_class.execute(params))
+                except Exception, e:
+                    results.append(('error', {'error': '%s' % e}))
+        return [TopicResult(self, data) for action, data in results]
+
     @classmethod
     def get_by_id(cls, id):
         topic_attributes = next((t for t in TOPICS if t['id'] == id), None)
@@ -72,7 +72,9 @@ with iso as (
   FROM gadm2_provinces_simple 
   WHERE iso = UPPER('{iso}'))
  
-    SELECT   cartodb_id as id, date 
+    SELECT t.details, t.email, t.name, t.title, t.visible, t.date,
+        t.location, t.cartodb_id as id, ST_Y(t.the_geom) AS lat,
+        ST_X(t.the_geom) AS lng, t.media, ST_AsGeoJSON(t.the_geom) as the_geom
     FROM {table} t, iso 
     WHERE visible = True 
     and ST_Intersects(t.the_geom_webmercator, iso.the_geom_webmercator) 
@@ -172,12 +174,14 @@ def get_story(params):
             return _prep_story(story)
 
 def get_country_story(params):
+    """Return the latest story in the country, fetched in one query."""
     params['table'] = TABLE
     result = cdb.execute(COUTRY_STORY.format(**params), auth=True)
-    story_id = json.loads(result.content)
-    if story_id['total_rows'] == 1:
-        params['id'] = story_id['rows'][0]['id']
-        return get_story(params)
+    if result.status_code != 200:
+        raise Exception('CartoDB error getting story (%s)' % result.content)
+    data = json.loads(result.content)
+    if data.get('total_rows') == 1:
+        return _prep_story(data['rows'][0])
     else: 
         return
 
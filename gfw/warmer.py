@@ -0,0 +1,149 @@
+# Global Forest Watch API
+# Copyright (C) 2015 World Resource Institute
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""This module warms the result cache for the most requested analyses.
+
+A cron task enqueues one task per configured combination on the
+rate-limited cache-warm queue; each task runs the same target, params and
+cache key a user request would and records how long it took."""
+
+import datetime
+import json
+import logging
+import time
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from appengine_config import runtime_config
+from gfw import cache
+from gfw.countries import api as countries_api
+from gfw.countries import countries
+from gfw.forestchange import api as forestchange_api
+from gfw.middlewares.cors import CORSRequestHandler
+
+WARM_ISOS = [
+    'BRA', 'IDN', 'COD', 'PER', 'COL', 'BOL', 'MYS', 'CMR', 'AGO', 'RUS',
+    'CAN', 'USA', 'MEX', 'PNG', 'GAB', 'COG', 'VEN', 'ARG', 'PRY', 'MMR']
+
+WARM_DATASETS = [
+    ('countries', {'thresh': '30'}),
+    ('umd-loss-gain', {'thresh': '30'}),
+    ('glad-alerts', {}),
+    ('terrai-alerts', {}),
+]
+
+QUEUE = 'cache-warm'
+
+
+class WarmResult(ndb.Model):
+    """Outcome of warming one combination during a warm run."""
+    run = ndb.StringProperty()
+    path = ndb.StringProperty(indexed=False)
+    args = ndb.JsonProperty()
+    status = ndb.StringProperty(indexed=False)
+    seconds = ndb.FloatProperty(indexed=False)
+    created = ndb.DateTimeProperty(auto_now_add=True)
+
+    kind = 'WarmResult'
+
+
+def get_entries():
+    """Return warm entries from the cache_warm runtime config or defaults.
+
+    Each entry is a dict with dataset, iso and optionally id1, period and
+    thresh."""
+    entries = runtime_config.get('cache_warm')
+    if entries:
+        return entries
+    return [dict(args, dataset=dataset, iso=iso)
+            for dataset, args in WARM_DATASETS for iso in WARM_ISOS]
+
+
+def _path(entry):
+    if entry['dataset'] == 'countries':
+        tokens = ['', 'countries', entry['iso']]
+    else:
+        tokens = ['', 'forest-change', entry['dataset'], 'admin', entry['iso']]
+    if entry.get('id1'):
+        tokens.append(str(entry['id1']))
+    return '/'.join(tokens)
+
+
+def _prepare(entry):
+    """Return (path, target, params, rid, soft_ttl) for a warm entry."""
+    path = _path(entry)
+    rtype = 'id1' if entry.get('id1') else 'iso'
+    raw_args = dict((k, entry[k]) for k in ['period', 'thresh'] if k in entry)
+    if entry['dataset'] == 'countries':
+        params = countries_api.get_params(path.strip('/'), rtype, raw_args)
+        return (path, countries, params,
+                countries_api.get_rid(path, params), countries_api.SOFT_TTL)
+    dataset, rtype, params = forestchange_api.get_params(path, raw_args)
+    return (path, forestchange_api.TARGETS[dataset], params,
+            forestchange_api.get_rid(path, dataset, params),
+            forestchange_api.soft_ttl(dataset))
+
+
+def start():
+    """Enqueue a warm task per entry and return the run id and count."""
+    run = datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%S')
+    entries = get_entries()
+    for entry in entries:
+        taskqueue.add(url='/cache/tasks/warm_one', queue_name=QUEUE,
+                      params=dict(run=run, entry=json.dumps(entry)))
+    return dict(run=run, queued=len(entries))
+
+
+def warm(entry, run=None):
+    """Populate the cache for entry unless it holds a fresh result.
+
+    Returns the stored WarmResult."""
+    result = WarmResult(run=run, args=entry)
+    start = time.time()
+    try:
+        path, target, params, rid, soft_ttl = _prepare(entry)
+        result.path = path
+        value, stale = cache.lookup(rid)
+        if value and not stale:
+            result.status = 'fresh'
+        else:
+            action, data = CORSRequestHandler.execute_and_cache(
+                params, target, rid, soft_ttl)
+            result.status = action
+    except Exception, e:
+        logging.exception(e)
+        result.status = 'error: %s' % e
+    result.seconds = round(time.time() - start, 3)
+    result.put()
+    return result
+
+
+def report(run=None):
+    """Return what a warm run (the latest by default) warmed and how long
+    each combination took."""
+    if not run:
+        latest = WarmResult.query().order(-WarmResult.created).get()
+        if not latest:
+            return dict(run=None, results=[])
+        run = latest.run
+    results = WarmResult.query(WarmResult.run == run).fetch()
+    return dict(
+        run=run,
+        seconds=round(sum(r.seconds or 0 for r in results), 3),
+        results=[dict(path=r.path, args=r.args, status=r.status,
+                      seconds=r.seconds) for r in results])
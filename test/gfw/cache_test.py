@@ -0,0 +1,183 @@
+# Global Forest Watch API
+# Copyright (C) 2015 World Resource Institute
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Unit tests for gfw.cache"""
+
+from test import common
+
+import os
+import time
+import unittest
+
+import mock
+
+from google.appengine.api import memcache
+
+from gfw import cache
+from gfw.middlewares.cors import CORSRequestHandler
+
+
+class LocalCacheTest(unittest.TestCase):
+
+    def testEvictsLeastRecentlyUsed(self):
+        local = cache.LocalCache(max_entries=2)
+        local.set('a', '1')
+        local.set('b', '2')
+        local.get('a')
+        local.set('c', '3')
+        self.assertEqual(local.get('a'), '1')
+        self.assertIsNone(local.get('b'))
+        self.assertEqual(local.get('c'), '3')
+
+    def testByteBound(self):
+        local = cache.LocalCache(max_bytes=4)
+        local.set('a', '12')
+        local.set('b', '34')
+        local.set('c', '56')
+        self.assertIsNone(local.get('a'))
+        self.assertEqual(local.size, 4)
+        local.set('d', '12345')
+        self.assertIsNone(local.get('d'))
+
+    def testExpires(self):
+        local = cache.LocalCache(ttl=60)
+        local.set('a', '1')
+        local.set('b', '2', ttl=-1)
+        self.assertEqual(local.get('a'), '1')
+        self.assertIsNone(local.get('b'))
+        self.assertEqual(local.size, 1)
+        with mock.patch('time.time', return_value=time.time() + 61):
+            self.assertIsNone(local.get('a'))
+
+
+class CacheTest(common.BaseTest):
+
+    def setUp(self):
+        super(CacheTest, self).setUp()
+        cache._local.clear()
+
+    def testSetGet(self):
+        cache.set('rid', ('respond', {'loss': 1}))
+        self.assertEqual(cache.get('rid'), ('respond', {'loss': 1}))
+        self.assertIsNone(cache.CachedResult.get_by_id('rid'))
+
+    def testPromotesFromDurableTier(self):
+        cache.set('rid', ('respond', {'loss': 1}), durable=True)
+        cache._local.clear()
+        memcache.flush_all()
+        self.assertEqual(cache.get('rid'), ('respond', {'loss': 1}))
+        self.assertIsNotNone(memcache.get('rid'))
+        self.assertIsNotNone(cache._local.get('rid'))
+
+    def testGetMulti(self):
+        # b is sharded in memcache
+        big = os.urandom(2 * cache.CHUNK_BYTES)
+        cache.set('a', 1)
+        cache._memcache_set('b', cache._dumps(big))
+        cache._local.clear()
+        cache.set('c', 3)
+        self.assertEqual(cache.get_multi(['a', 'b', 'c', 'd']),
+                         {'a': 1, 'b': big, 'c': 3})
+        self.assertIsNotNone(cache._local.get('a'))
+
+    def testDelete(self):
+        cache.set('rid', ('respond', {'loss': 1}), durable=True)
+        cache.delete('rid')
+        self.assertIsNone(cache.get('rid'))
+        self.assertIsNone(cache.CachedResult.get_by_id('rid'))
+
+    def testLease(self):
+        token = cache.acquire_lease('rid')
+        self.assertIsNotNone(token)
+        self.assertIsNone(cache.acquire_lease('rid'))
+        cache.release_lease('rid', 'other')
+        self.assertIsNone(cache.acquire_lease('rid'))
+        cache.release_lease('rid', token)
+        self.assertEqual(memcache.get(cache._lease_key('rid')),
+                         cache.RELEASED)
+        token = cache.acquire_lease('rid')
+        self.assertIsNotNone(token)
+        self.assertIsNone(cache.acquire_lease('rid'))
+        cache.release_lease('rid', token)
+        cache.release_lease('rid', token)
+        self.assertEqual(memcache.get(cache._lease_key('rid')),
+                         cache.RELEASED)
+
+    def testWaitReturnsFilledValue(self):
+        cache.acquire_lease('rid')
+        memcache.set('rid', cache._dumps(('respond', {'loss': 1})))
+        self.assertEqual(cache.wait('rid'), ('respond', {'loss': 1}))
+
+    def testWaitStopsWhenLeaseReleased(self):
+        self.assertIsNone(cache.wait('rid', timeout=1))
+
+    def testSoftExpiry(self):
+        cache.set('rid', ('respond', {'loss': 1}), soft_ttl=60)
+        self.assertEqual(cache.lookup('rid'), (('respond', {'loss': 1}), False))
+        cache.set('rid', ('respond', {'loss': 1}), soft_ttl=-1)
+        self.assertEqual(cache.lookup('rid'), (('respond', {'loss': 1}), True))
+        self.assertEqual(cache.lookup('other'), (None, False))
+
+    def testStaleLocalCopyRereadsSharedTiers(self):
+        cache.set('rid', ('respond', {'loss': 1}), soft_ttl=60)
+        cache._local.set('rid', cache._dumps(('respond', {'loss': 0}), -1))
+        self.assertEqual(cache.lookup('rid'), (('respond', {'loss': 1}), False))
+        self.assertEqual(cache._local.get('rid'), memcache.get('rid'))
+
+    def testRefreshArgsPassedByKey(self):
+        args = dict(geojson='x' * 200 * 1024)
+        target = mock.Mock(__name__='gfw.forestchange.umd')
+        with mock.patch('google.appengine.api.taskqueue.add') as add:
+            CORSRequestHandler._schedule_refresh(args, target, 'rid', 60)
+        params = add.call_args[1]['params']
+        self.assertNotIn('args', params)
+        self.assertEqual(params['rid'], 'rid')
+        self.assertEqual(
+            cache.get(CORSRequestHandler._refresh_args_key('rid')), args)
+
+    def testOneRefreshPerKey(self):
+        self.assertTrue(cache.acquire_refresh('rid'))
+        self.assertFalse(cache.acquire_refresh('rid'))
+        cache.release_refresh('rid')
+        self.assertTrue(cache.acquire_refresh('rid'))
+
+    def testKeyIgnoresBustAndGeojsonFormatting(self):
+        geojson = '{"type": "Polygon", "coordinates": [[[0,0],[1,0],[1,1],[0,0]]]}'
+        shifted = '{"coordinates":[[[1,0],[1,1],[0,0],[1,0]]],"type":"Polygon"}'
+        a = cache.get_key('/forest-change/glad-alerts', dict(geojson=geojson))
+        b = cache.get_key('/forest-change/glad-alerts/',
+                          dict(geojson=shifted, bust=True))
+        self.assertEqual(a, b)
+        self.assertNotEqual(a, cache.get_key(
+            '/forest-change/glad-alerts', dict(geojson=geojson), 'v2'))
+
+    def testCompressed(self):
+        value = ('respond', {'rows': [{'value': 1}] * 1000})
+        cache.set('rid', value)
+        self.assertLess(len(memcache.get('rid')), 1000)
+        self.assertEqual(cache.get('rid'), value)
+
+    def testChunkedMemcacheValue(self):
+        value = os.urandom(cache.CHUNK_BYTES * 2 + 10)
+        cache._memcache_set('rid', value)
+        self.assertEqual(memcache.get('rid')[0], 3)
+        self.assertEqual(cache._memcache_get('rid'), value)
+
+        memcache.set('rid:1', 'corrupt')
+        self.assertIsNone(cache._memcache_get('rid'))
+        cache._memcache_delete('rid')
+        self.assertIsNone(memcache.get('rid:0'))
@@ -0,0 +1,146 @@
+# Global Forest Watch API
+# Copyright (C) 2015 World Resource Institute
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Unit tests for gfw.cdb"""
+
+from test import common
+
+import json
+import unittest
+
+import mock
+
+from gfw import cdb
+
+
+def _response(content, status_code=200):
+    return mock.Mock(content=json.dumps(content), status_code=status_code)
+
+
+class FutureTest(common.BaseTest):
+
+    def setUp(self):
+        super(FutureTest, self).setUp()
+        patcher = mock.patch('gfw.cdb.urlfetch')
+        self.urlfetch = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.rpcs = []
+
+        def create_rpc(deadline=None):
+            rpc = mock.Mock()
+            self.rpcs.append(rpc)
+            return rpc
+        self.urlfetch.create_rpc.side_effect = create_rpc
+
+    def testExecuteAsyncPostsQuery(self):
+        future = cdb.execute_async('SELECT 1', dict(format='csv'))
+        self.assertFalse(future.done())
+        args, kwargs = self.urlfetch.make_fetch_call.call_args
+        self.assertEqual(args, (self.rpcs[0], cdb.ENDPOINT))
+        self.assertEqual(kwargs['method'], 'POST')
+        self.assertIn('q=SELECT+1', kwargs['payload'])
+
+        self.rpcs[0].get_result.return_value = _response({'rows': []})
+        self.assertEqual(future.get_result().status_code, 200)
+        self.assertTrue(future.done())
+
+    def testThenChainsCallbacksOnce(self):
+        future = cdb.execute_async('SELECT 1')
+        self.rpcs[0].get_result.return_value = _response({'rows': [1]})
+        chained = future.then(lambda r: json.loads(r.content)['rows']).then(len)
+        self.assertEqual(chained.get_result(), 1)
+        self.assertEqual(chained.get_result(), 1)
+        self.assertEqual(self.rpcs[0].get_result.call_count, 1)
+
+    def testThenOnResolvedFuture(self):
+        future = cdb.Future.resolved(2).then(lambda value: value * 3)
+        self.assertTrue(future.done())
+        self.assertEqual(future.get_result(), 6)
+
+    def testErrorResponsePassedThrough(self):
+        future = cdb.execute_async('SELECT x')
+        self.rpcs[0].get_result.return_value = _response(
+            {'error': ['column "x" does not exist']}, 400)
+        self.assertEqual(future.get_result().status_code, 400)
+
+    def testCallbackErrorRaisedFromGetResult(self):
+        future = cdb.execute_async('SELECT 1')
+        self.rpcs[0].get_result.return_value = _response({'rows': []})
+
+        def fail(response):
+            raise ValueError('bad rows')
+        self.assertRaises(ValueError, future.then(fail).get_result)
+
+    @mock.patch('gfw.cdb.apiproxy_stub_map')
+    def testWaitAny(self, stub_map):
+        first, second = cdb.execute_async('SELECT 1'), cdb.execute_async(
+            'SELECT 2')
+        stub_map.UserRPC.wait_any.return_value = self.rpcs[1]
+        self.assertIs(cdb.wait_any([first, second]), second)
+        self.assertEqual(set(stub_map.UserRPC.wait_any.call_args[0][0]),
+                         set(self.rpcs))
+
+        # Done futures are returned without waiting
+        resolved = cdb.Future.resolved(1)
+        self.assertIs(cdb.wait_any([first, resolved]), resolved)
+        self.assertEqual(stub_map.UserRPC.wait_any.call_count, 1)
+        self.assertIsNone(cdb.wait_any([]))
+
+    def testWaitAllKeepsOrder(self):
+        futures = [cdb.execute_async('SELECT %d' % i) for i in range(3)]
+        for i, rpc in enumerate(self.rpcs):
+            rpc.get_result.return_value = i
+        self.assertEqual(cdb.wait_all(reversed(futures)), [2, 1, 0])
+
+
+class BatchTest(common.BaseTest):
+
+    def setUp(self):
+        super(BatchTest, self).setUp()
+        patcher = mock.patch('gfw.cdb.urlfetch')
+        self.urlfetch = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.rpc = self.urlfetch.create_rpc.return_value
+
+    def testBatchQueryPacksEachStatement(self):
+        query = cdb.get_batch_query(['SELECT 1 AS a', 'SELECT 2 AS b'])
+        self.assertTrue(query.startswith('SELECT (SELECT'))
+        self.assertIn('FROM (SELECT 1 AS a) b) AS q0', query)
+        self.assertIn('FROM (SELECT 2 AS b) b) AS q1', query)
+        self.assertEqual(query.count('json_agg'), 2)
+
+    def testExecuteBatchSplitsRows(self):
+        # Columns may come back as JSON or as JSON text, and statements
+        # without rows as null
+        self.rpc.get_result.return_value = _response({'rows': [{
+            'q0': [{'a': 1}, {'a': 2}], 'q1': '[{"b": 3}]', 'q2': None}]})
+        results = cdb.execute_batch(['SELECT a', 'SELECT b', 'SELECT c'])
+        self.assertEqual(results, [[{'a': 1}, {'a': 2}], [{'b': 3}], []])
+        self.assertEqual(self.urlfetch.make_fetch_call.call_count, 1)
+        payload = self.urlfetch.make_fetch_call.call_args[1]['payload']
+        self.assertIn('AS+q2', payload)
+
+    def testFailedBatchRaises(self):
+        self.rpc.get_result.return_value = _response(
+            {'error': ['relation "missing" does not exist']}, 400)
+        future = cdb.execute_batch_async(['SELECT 1', 'SELECT * FROM missing'])
+        with self.assertRaises(Exception) as context:
+            future.get_result()
+        self.assertIn('does not exist', str(context.exception))
+
+if __name__ == '__main__':
+    unittest.main(exit=False, failfast=True)
@@ -0,0 +1,101 @@
+# Global Forest Watch API
+# Copyright (C) 2015 World Resource Institute
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""Unit tests for gfw.exports"""
+
+from test import common
+
+import datetime
+import mock
+import unittest
+
+from gfw import exports
+
+URL = 'http://wri-01.cartodb.com/api/v2/sql?q=SELECT+1&format=csv'
+
+
+class ExportsTest(common.BaseTest):
+
+    def testDownloadOnce(self):
+        action, data = exports.download(URL, 'csv', 'v1')
+        self.assertEqual(action, 'respond')
+        self.assertEqual(data['export']['status'], exports.PENDING)
+        exports.download(URL, 'csv', 'v1')
+        tasks = self.taskqueue_stub.get_filtered_tasks(
+            queue_names=exports.QUEUE)
+        self.assertEqual(len(tasks), 1)
+
+        export = exports.Export.get_by_id(exports.get_id(URL, 'v1'))
+        export.status = exports.DONE
+        export.put()
+        action, data = exports.download(URL, 'csv', 'v1')
+        self.assertEqual(action, 'redirect')
+        self.assertEqual(data, exports.file_url(export))
+        self.assertTrue(data.endswith('/exports/%s.csv' % export.key.id()))
+
+    def testVersionChangesId(self):
+        self.assertNotEqual(exports.get_id(URL, 'v1'),
+                            exports.get_id(URL, 'v2'))
+
+    @mock.patch('gfw.exports.urlfetch')
+    def testFetchTooLarge(self, urlfetch):
+        urlfetch.ResponseTooLargeError = type(
+            'ResponseTooLargeError', (Exception,), {})
+        urlfetch.fetch.side_effect = urlfetch.ResponseTooLargeError()
+        self.assertRaises(ValueError, exports._fetch, URL)
+
+    def testStalledExportRestarted(self):
+        export_id = exports.get_id(URL, 'v1')
+        started = datetime.datetime.utcnow() - datetime.timedelta(
+            seconds=exports.PENDING_SECONDS + 1)
+        exports.Export(id=export_id, url=URL, fmt='csv', attempts=1,
+                       status=exports.PENDING, started=started).put()
+        action, data = exports.download(URL, 'csv', 'v1')
+        self.assertEqual(data['export']['status'], exports.ERROR)
+        self.assertTrue(data['export']['error'])
+
+        # Out of attempts, it stays failed instead of pending forever
+        export = exports.Export.get_by_id(export_id)
+        export.attempts = exports.MAX_ATTEMPTS
+        export.status = exports.PENDING
+        export.put()
+        action, data = exports.download(URL, 'csv', 'v1')
+        self.assertEqual(data['export']['status'], exports.ERROR)
+
+    def testFailedExportRetriedWithBackoff(self):
+        export_id = exports.get_id(URL, 'v1')
+        exports.Export(id=export_id, url=URL, fmt='csv',
+                       status=exports.ERROR, attempts=1).put()
+        action, data = exports.download(URL, 'csv', 'v1')
+        self.assertEqual(data['export']['status'], exports.ERROR)
+
+        export = exports.Export.get_by_id(export_id)
+        export.updated = datetime.datetime.utcnow() - datetime.timedelta(
+            seconds=exports.RETRY_SECONDS + 1)
+        with mock.patch.object(exports.Export.updated, '_auto_now', False):
+            export.put()
+        action, data = exports.download(URL, 'csv', 'v1')
+        self.assertEqual(data['export']['status'], exports.PENDING)
+        self.assertEqual(exports.Export.get_by_id(export_id).attempts, 2)
+
+        export = exports.Export.get_by_id(export_id)
+        export.status = exports.ERROR
+        export.attempts = exports.MAX_ATTEMPTS
+        export.put()
+        self.assertIsNone(exports._retry_at(export))
+
+if __name__ == '__main__':
+    unittest.main(exit=False, failfast=True)
@@ -24,10 +24,13 @@ test/gfw.forestchange.sql for that.
 
 from test import common
 
+import json
+import mock
 import unittest
 import webapp2
 import webtest
 
+from gfw import cache
 from gfw.forestchange import api
 
 
@@ -223,6 +226,20 @@ class UmdApiTest(BaseApiTest):
         self._testGetNational('umd-loss-gain')
 
 
+class MultiAreaApiTest(BaseApiTest):
+
+    def testGetWdpas(self):
+        path = r'/forest-change/glad-alerts/wdpa/1,2,1'
+        cdb_response = '{"rows":[{"_area_id":1,"value":5},' \
+            '{"_area_id":2,"value":7}]}'
+        self.setResponse(content=cdb_response, status_code=200)
+        r = self.api.get(path, {'period': '2016-01-01,2016-02-01'})
+        self.assertEqual(200, r.status_code)
+        self.assertEqual(['1', '2'], sorted(r.json['areas']))
+        self.assertEqual(5, r.json['areas']['1']['value'])
+        self.assertEqual(7, r.json['areas']['2']['value'])
+        self.assertEqual('2', r.json['areas']['2']['params']['wdpaid'])
+
 class TerraiApiTest(BaseApiTest):
 
     def testGetNational(self):
@@ -247,15 +264,6 @@ class FunctionTest(unittest.TestCase):
             ('bust', 1),
             ('period', '2008-01-01,2009-01-01')]
 
-    def test_dataset_from_path(self):
-        path = '/forest-change/forma-alerts/admin/bra'
-        dataset = api._dataset_from_path(path)
-
-        self.assertEqual('forma-alerts', dataset)
-
-        path = '/forest-change/forma-alerts'
-        dataset = api._dataset_from_path(path)
-
     def test_classify_request(self):
         path = '/forest-change/forma-alerts'
         self.assertEqual(('forma-alerts', 'all'), api._classify_request(path))
@@ -287,5 +295,65 @@ class FunctionTest(unittest.TestCase):
         path = '/forest-change/forma-alerts/wdpa/123'
         self.assertEqual(('forma-alerts', 'wdpa'), api._classify_request(path))
 
+    def test_dispatch(self):
+        path = '/forest-change/umd-loss-gain/admin/BRA/12'
+        self.assertEqual(('umd-loss-gain', 'id1', {'iso': 'BRA', 'id1': '12'}),
+                         api.dispatch(path))
+
+        path = '/forest-change/forma-alerts/ifl/bra/123'
+        self.assertEqual(
+            ('forma-alerts', 'ifl_id1',
+             {'ifl_id1': True, 'iso': 'bra', 'id1': '123'}),
+            api.dispatch(path))
+
+        path = '/forest-change/forma-alerts/use/logging/99'
+        self.assertEqual(
+            ('forma-alerts', 'use', {'use': 'logging', 'useid': '99'}),
+            api.dispatch(path))
+
+        path = '/forest-change/glad-alerts/wdpa/10,20'
+        self.assertEqual(('glad-alerts', 'wdpa', {'wdpaid': '10,20'}),
+                         api.dispatch(path))
+
+        path = '/forest-change/forma-alerts/bogus'
+        self.assertEqual((None, None, None), api.dispatch(path))
+
+    def test_batch_path(self):
+        self.assertEqual('/forest-change/glad-alerts',
+                         api._batch_path('glad-alerts', {'geostore': 'abc'}))
+        self.assertEqual('/forest-change/glad-alerts/admin/BRA/12',
+                         api._batch_path('glad-alerts', {'iso': 'BRA', 'id1': '12'}))
+        self.assertEqual('/forest-change/glad-alerts/wdpa/10',
+                         api._batch_path('glad-alerts', {'wdpaid': '10'}))
+
+    @mock.patch('gfw.forestchange.api.MAX_CONCURRENT_DATASETS', 2)
+    @mock.patch.object(api.Handler, 'execute_dataset')
+    def test_batch_caps_datasets(self, execute_dataset):
+        execute_dataset.side_effect = lambda path, dataset, params: (
+            'respond', {'dataset': dataset})
+        handler = api.Handler()
+        datasets = ','.join(['glad-alerts', 'terrai-alerts', 'glad-alerts',
+                             'forma-alerts'])
+        results = handler.batch({'datasets': datasets, 'iso': 'BRA'})
+        self.assertEqual(['forma-alerts', 'glad-alerts', 'terrai-alerts'],
+                         sorted(results['datasets']))
+        self.assertEqual(3, execute_dataset.call_count)
+
+        too_many = ','.join(['dataset-%d' % i
+                             for i in range(len(api.TARGETS) + 1)])
+        self.assertRaises(ValueError, handler.batch,
+                          {'datasets': too_many, 'iso': 'BRA'})
+
+    @mock.patch('gfw.forestchange.api.geometry.simplify')
+    def test_simplify_cached(self, simplify):
+        geojson = json.dumps({'type': 'Polygon', 'coordinates': [
+            [[0, 0], [1, 0], [1, 1], [0, 0]]]})
+        simplify.return_value = ({'type': 'Polygon'}, {'vertices': 3})
+        cache.delete('simplified:%s' % api.md5(geojson).hexdigest())
+        expected = (json.dumps({'type': 'Polygon'}), {'vertices': 3})
+        self.assertEqual(expected, api._simplify(geojson))
+        self.assertEqual(expected, api._simplify(geojson))
+        self.assertEqual(1, simplify.call_count)
+
 if __name__ == '__main__':
     unittest.main(exit=False, failfast=True)
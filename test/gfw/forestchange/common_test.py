@@ -0,0 +1,102 @@
+# Global Forest Watch API
+# Copyright (C) 2015 World Resource Institute
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""Unit tests for the gfw.forestchange.common statement layer."""
+
+import unittest
+
+from gfw.forestchange import common
+from gfw.forestchange import fires
+from gfw.forestchange import forma
+from gfw.forestchange import glad
+from gfw.forestchange import guyra
+from gfw.forestchange import imazon
+from gfw.forestchange import prodes
+from gfw.forestchange import quicc
+from gfw.forestchange import terrai
+from gfw.forestchange import viirs
+
+# Area args of each query type and the params they bind
+AREAS = [
+    ('WORLD', dict(geojson='{"type": "Point"}'), {}),
+    ('ISO', dict(iso='bra'), {}),
+    ('ID1', dict(iso='bra', id1='2'), {}),
+    ('WDPA', dict(wdpaid='10'), {}),
+    ('USE', dict(use='logging', useid='5'),
+     dict(use_table='gfw_logging', pid='5')),
+]
+
+
+class StatementTest(unittest.TestCase):
+
+    def testBind(self):
+        statement = common.Statement("""
+            SELECT COUNT(f.*) AS value
+                {additional_select}
+            FROM t f
+            WHERE iso = UPPER('{iso}') AND id_1 = {id1}""")
+        params = dict(additional_select='', iso="b'ra", id1='2')
+        self.assertEqual(
+            statement.bind(params),
+            "SELECT COUNT(f.*) AS value FROM t f "
+            "WHERE iso = UPPER('b''ra') AND id_1 = 2")
+
+    def testTypedParams(self):
+        statement = common.Statement('SELECT * FROM {use_table} '
+                                     'WHERE cartodb_id = {pid}')
+        with self.assertRaises(common.SqlError):
+            statement.bind(dict(use_table='gfw_mining', pid='1 OR 1=1'))
+        with self.assertRaises(common.SqlError):
+            statement.bind(dict(use_table='gfw_mining; --', pid='1'))
+        self.assertEqual(
+            statement.bind(dict(use_table='gfw_mining',
+                                pid=common.SqlFragment('a.area_id'))),
+            'SELECT * FROM gfw_mining WHERE cartodb_id = a.area_id')
+
+    def testStatementsFollowTemplate(self):
+        template = forma.FormaSql.ISO
+        query, alert, download, _ = forma.FormaSql.statements('ISO')
+        self.assertIs(query, forma.FormaSql.statements('ISO')[0])
+        self.assertTrue(download.text.startswith('SELECT f.*'))
+        try:
+            forma.FormaSql.ISO = "SELECT '{iso}'"
+            self.assertEqual(forma.FormaSql.process({'iso': 'bra'})[0],
+                             "SELECT 'bra'")
+        finally:
+            forma.FormaSql.ISO = template
+
+    def testDownloadMatchesFormattedTemplate(self):
+        datasets = [fires.FiresSql, forma.FormaSql, glad.GladSql,
+                    guyra.GuyraSql, imazon.ImazonSql, prodes.ProdesSql,
+                    quicc.QuiccSql, terrai.TerraiSql, viirs.FiresSql]
+        for sql in datasets:
+            for name, args, extra in AREAS:
+                if not hasattr(sql, name):
+                    continue
+                for alert_query in [False, True]:
+                    params = dict(
+                        args, begin='2014-01-01', end='2015-01-01',
+                        additional_select=sql.MIN_MAX_DATE_SQL
+                        if alert_query else '', **extra)
+                    expected = common.Sql.clean(
+                        sql.download(getattr(sql, name).format(**params)))
+                    download = sql.process(
+                        dict(args, alert_query=alert_query))[1]
+                    self.assertEqual(download, expected,
+                                     (sql, name, alert_query))
+
+if __name__ == '__main__':
+    unittest.main(exit=False, failfast=True)
@@ -0,0 +1,96 @@
+# Global Forest Watch API
+# Copyright (C) 2015 World Resource Institute
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""Unit tests for gfw.forestchange.cube"""
+
+from test import common
+
+import datetime
+import json
+import mock
+import unittest
+
+from gfw import cache
+from gfw.forestchange import cube
+from gfw.forestchange import glad
+from gfw.forestchange import versions
+
+
+def _day(*args):
+    return datetime.date(*args).toordinal()
+
+
+class CubeTest(common.FetchBaseTest):
+
+    def setUp(self):
+        super(CubeTest, self).setUp()
+        self.setResponse(content=json.dumps(dict(rows=[{'date': '2016'}])),
+                         status_code=200)
+        self.version = versions.get('glad-alerts')
+        areas = {'iso': [(_day(2016, 1, 4), 2), (_day(2016, 2, 1), 3)],
+                 1: [(_day(2016, 1, 4), 1)]}
+        cache.set(cube._key('glad-alerts', 'BRA'),
+                  dict(version=self.version, areas=areas.items()))
+
+    def testCountsPeriod(self):
+        counts = cube.Counts([(_day(2016, 1, 4), 2), (_day(2016, 2, 1), 3)])
+        self.assertEqual(counts.period(_day(2016, 1, 1), _day(2016, 2, 1)),
+                         (5, datetime.date(2016, 1, 4),
+                          datetime.date(2016, 2, 1)))
+        self.assertEqual(counts.period(_day(2016, 1, 5), _day(2016, 1, 31)),
+                         (0, None, None))
+
+    def testExecuteFromCube(self):
+        # CartoDB is not queried
+        self.setResponse(content='error', status_code=500)
+        action, data = glad.execute(dict(
+            iso='bra', begin=datetime.datetime(2016, 1, 1),
+            end=datetime.datetime(2016, 1, 31)))
+        self.assertEqual(action, 'respond')
+        self.assertEqual(data['value'], 2)
+        self.assertEqual(data['min_date'], '2016-01-04T00:00:00Z')
+
+        action, data = glad.execute(dict(
+            iso='bra', id1='1', begin=datetime.datetime(2016, 1, 1),
+            end=datetime.datetime(2016, 12, 31)))
+        self.assertEqual(data['value'], 1)
+
+    def testUnknownAreaQueriesCartoDb(self):
+        args = dict(iso='bra', id1='9')
+        self.assertIsNone(cube.lookup(args, glad.GladSql))
+        args = dict(iso='bra', format='csv')
+        self.assertIsNone(cube.lookup(args, glad.GladSql))
+
+    @mock.patch('gfw.forestchange.cube.cdb')
+    def testBuildFromDatasetSql(self, cdb):
+        cdb.execute_batch.return_value = [[{'id_1': 1}, {'id_1': 2}]]
+        for dataset in cube.CUBE_SQL:
+            cdb.execute_batch_async.return_value.get_result.return_value = [
+                [{'date': '2016-01-04', 'value': 2}],
+                [{'_area_id': 2, 'date': '2016-01-04', 'value': 2}]]
+            cache.delete(cube._key(dataset, 'BRA'))
+            entry = cube.build(dataset, 'BRA')
+            self.assertEqual(dict(entry['areas'])[2],
+                             [(_day(2016, 1, 4), 2)])
+            queries = cdb.execute_batch_async.call_args[0][0]
+            self.assertEqual(len(queries), 2)
+            for query in queries:
+                # Download rows are counted, not the analysis aggregate
+                self.assertEqual(query.count('COUNT('), 1, query)
+                self.assertNotIn('min_date', query)
+
+if __name__ == '__main__':
+    unittest.main(exit=False, failfast=True)
@@ -0,0 +1,97 @@
+# Global Forest Watch API
+# Copyright (C) 2015 World Resource Institute
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Micro-benchmark for forest-change request classification.
+
+Compares the precompiled dispatch table with the previous per-request
+re.match chain (kept here for reference) on a mix of request paths.
+
+    python -m test.gfw.forestchange.dispatch_benchmark
+"""
+
+import re
+import timeit
+
+from gfw.forestchange import api
+
+PATHS = [
+    '/forest-change/glad-alerts',
+    '/forest-change/glad-alerts/latest',
+    '/forest-change/umd-loss-gain/admin/BRA',
+    '/forest-change/umd-loss-gain/admin/BRA/12',
+    '/forest-change/umd-loss-gain/admin/ifl/IDN',
+    '/forest-change/terrai-alerts/iso/PER',
+    '/forest-change/nasa-active-fires/wdpa/1234',
+    '/forest-change/forma-alerts/use/logging/99',
+    '/forest-change/viirs-active-fires/admin/COD/3',
+    '/forest-change/prodes-loss/admin/BRA',
+    '/forest-change/guyra-loss/iso/PRY/2',
+    '/forest-change/quicc-alerts/admin/CAN',
+]
+
+
+def legacy_dispatch(path):
+    """The classification path before the dispatch table, without the path
+    args it then extracted."""
+    dataset = path.split('/')[2]
+    stripped = path.strip('/')
+    rtype = None
+    if re.match(r'forest-change/%s$' % dataset, stripped):
+        rtype = 'all'
+    elif re.match(r'forest-change/%s/latest$' % dataset, stripped):
+        rtype = 'latest'
+    elif re.match(r'forest-change/%s/admin/ifl/[A-z]{3,3}$' % dataset, stripped):
+        rtype = 'ifl'
+    elif re.match(r'forest-change/%s/admin/ifl/[A-z]{3,3}/\d+$' % dataset, stripped):
+        rtype = 'ifl_id1'
+    elif re.match(r'forest-change/%s/ifl/[A-z]{3,3}$' % dataset, stripped):
+        rtype = 'ifl'
+    elif re.match(r'forest-change/%s/ifl/[A-z]{3,3}/\d+$' % dataset, stripped):
+        rtype = 'ifl_id1'
+    elif re.match(r'forest-change/%s/admin/[A-z]{3,3}$' % dataset, stripped):
+        rtype = 'iso'
+    elif re.match(r'forest-change/%s/admin/[A-z]{3,3}/\d+$' % dataset, stripped):
+        rtype = 'id1'
+    elif re.match(r'forest-change/%s/iso/[A-z]{3,3}$' % dataset, stripped):
+        rtype = 'iso'
+    elif re.match(r'forest-change/%s/iso/[A-z]{3,3}/\d+$' % dataset, stripped):
+        rtype = 'id1'
+    elif re.match(r'forest-change/%s/wdpa/\d+$' % dataset, stripped):
+        rtype = 'wdpa'
+    elif re.match(r'forest-change/%s/use/[A-z]+/\d+$' % dataset, stripped):
+        rtype = 'use'
+    return dataset, rtype
+
+
+def _per_request_us(func, number):
+    seconds = timeit.timeit(
+        lambda: [func(path) for path in PATHS], number=number)
+    return seconds / (number * len(PATHS)) * 1e6
+
+
+def main(number=20000):
+    for path in PATHS:
+        assert api.dispatch(path)[:2] == legacy_dispatch(path), path
+    legacy = _per_request_us(legacy_dispatch, number)
+    table = _per_request_us(api.dispatch, number)
+    print 'legacy re.match chain: %.2f us/request' % legacy
+    print 'dispatch table:        %.2f us/request' % table
+    print 'speedup:               %.1fx' % (legacy / table)
+
+
+if __name__ == '__main__':
+    main()
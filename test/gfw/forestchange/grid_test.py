@@ -0,0 +1,116 @@
+# Global Forest Watch API
+# Copyright (C) 2015 World Resource Institute
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""Unit tests for gfw.forestchange.grid"""
+
+from test import common
+
+import datetime
+import json
+import unittest
+
+from gfw import cache
+from gfw.forestchange import glad
+from gfw.forestchange import grid
+from gfw.forestchange import versions
+
+
+def _day(*args):
+    return datetime.date(*args).toordinal()
+
+
+def _square(x0, y0, x1, y1):
+    return [[x0, y0], [x1, y0], [x1, y1], [x0, y1], [x0, y0]]
+
+
+SQUARE = json.dumps(dict(type='Polygon', coordinates=[_square(0, 0, 1, 1)]))
+
+# Cells of the 1x1 degree square not crossed by its edges
+INSIDE = set(grid._cell(col, row) for col in [721, 722, 723]
+             for row in [361, 362, 363])
+
+
+class GridTest(common.FetchBaseTest):
+
+    def setUp(self):
+        super(GridTest, self).setUp()
+        self.setResponse(content=json.dumps(dict(rows=[{'date': '2016'}])),
+                         status_code=200)
+        self.version = versions.get('glad-alerts')
+
+    def _build(self):
+        cell = grid._cell(721, 361)
+        cache.set(grid._index_key('glad-alerts'),
+                  dict(version=self.version, tiles=set([grid._tile(cell)])))
+        cache.set(grid._tile_key('glad-alerts', grid._tile(cell)),
+                  dict(version=self.version,
+                       cells=[(cell, [(_day(2016, 1, 4), 2),
+                                      (_day(2016, 3, 1), 5)])]))
+
+    def testCellsOfSquare(self):
+        inside, boundary = grid.cells(SQUARE)
+        self.assertEqual(inside, INSIDE)
+        self.assertFalse(inside & boundary)
+        self.assertIn(grid._cell(720, 360), boundary)
+
+    def testCellsOfSquareWithHole(self):
+        geojson = dict(type='Polygon', coordinates=[
+            _square(0, 0, 2, 2), _square(0.5, 0.5, 1.5, 1.5)])
+        inside, boundary = grid.cells(geojson)
+        self.assertNotIn(grid._cell(723, 363), inside)
+        self.assertIn(grid._cell(721, 361), inside)
+        self.assertEqual(len(inside), 7 * 7 - 5 * 5)
+
+    def testCellsInMercator(self):
+        # The diagonal is straight in Web Mercator, where GLAD intersects,
+        # and bows north of the lon/lat diagonal by about 5 degrees
+        triangle = dict(type='Polygon', coordinates=[
+            [[0, 0], [10, 60], [0, 60], [0, 0]]])
+        cell = grid._cell(grid._col(5.1), grid._row(32))
+        inside, boundary = grid.cells(triangle)
+        self.assertIn(cell, inside)
+        inside, boundary = grid.cells(triangle, grid.MERCATOR)
+        self.assertNotIn(cell, inside | boundary)
+        self.assertIn(grid._cell(grid._col(5.1), grid._row(37)), inside)
+        self.assertEqual(grid._projection(glad.GladSql), grid.MERCATOR)
+
+    def testCellsOfSquareInMercator(self):
+        self.assertEqual(grid.cells(SQUARE, grid.MERCATOR), grid.cells(SQUARE))
+
+    def testExecuteFromGrid(self):
+        self._build()
+        # Only the boundary cells are counted by CartoDB
+        self.setResponse(content=json.dumps(dict(rows=[dict(
+            value=1, min_date='2016-01-02T00:00:00Z',
+            max_date='2016-01-02T00:00:00Z')])), status_code=200)
+        action, data = glad.execute(dict(
+            geojson=SQUARE, begin=datetime.datetime(2016, 1, 1),
+            end=datetime.datetime(2016, 1, 31)))
+        self.assertEqual(action, 'respond')
+        self.assertEqual(data['value'], 3)
+        self.assertEqual(data['min_date'], '2016-01-02T00:00:00Z')
+        self.assertEqual(data['max_date'], '2016-01-04T00:00:00Z')
+
+    def testUnbuiltGridQueriesCartoDb(self):
+        cache.delete(grid._index_key('glad-alerts'))
+        args = dict(geojson=SQUARE)
+        self.assertIsNone(grid.lookup(args, glad.GladSql))
+        self._build()
+        args = dict(geojson=SQUARE, format='csv')
+        self.assertIsNone(grid.lookup(args, glad.GladSql))
+
+if __name__ == '__main__':
+    unittest.main(exit=False, failfast=True)
@@ -0,0 +1,75 @@
+# Global Forest Watch API
+# Copyright (C) 2015 World Resource Institute
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""Unit tests for gfw.forestchange.series"""
+
+from test import common
+
+import datetime
+import json
+import unittest
+
+from gfw.forestchange import series
+
+
+class SeriesTest(common.FetchBaseTest):
+
+    def setRows(self, rows):
+        self.setResponse(content=json.dumps(dict(rows=rows)), status_code=200)
+
+    def testRollup(self):
+        d = datetime.date
+        days = [(d(2016, 1, 4), 2), (d(2016, 1, 30), 3), (d(2016, 2, 2), 4)]
+        self.assertEqual(
+            series.rollup(days, 'month', d(2016, 1, 1), d(2016, 3, 1)),
+            [dict(date='2016-01-01', value=5), dict(date='2016-02-01', value=4)])
+        self.assertEqual(
+            series.rollup(days, 'week', d(2016, 1, 10), d(2016, 2, 1)),
+            [dict(date='2016-01-25', value=3)])
+
+    def testNarrowerPeriodFromCache(self):
+        path = '/forest-change/glad-alerts/admin/bra'
+        params = dict(iso='bra', interval='month',
+                      begin=datetime.datetime(2016, 1, 1),
+                      end=datetime.datetime(2016, 3, 1))
+        self.setRows([{'date': '2016-01-04', 'value': 2},
+                      {'date': '2016-02-02', 'value': 4}])
+        action, data = series.execute(path, 'glad-alerts', params)
+        self.assertEqual(action, 'respond')
+        self.assertEqual(data['value'], 6)
+
+        # Served from the cached days, not the new response
+        self.setResponse(content='error', status_code=500)
+        params.update(begin=datetime.datetime(2016, 2, 1), interval='day')
+        action, data = series.execute(path, 'glad-alerts', params)
+        self.assertEqual(data['series'], [dict(date='2016-02-02', value=4)])
+
+    def testSeriesSqlCountsDownloadRows(self):
+        areas = [dict(geojson='{"type": "Polygon", "coordinates": []}'),
+                 dict(iso='bra'), dict(iso='bra', id1='1'),
+                 dict(wdpaid='10'), dict(use='logging', useid='5')]
+        for dataset, sql in series.SERIES_SQL.iteritems():
+            for area in areas:
+                query = sql.series(dict(area, begin='2016-01-01',
+                                        end='2016-03-01'), 'month')
+                # Only the outer query aggregates
+                self.assertEqual(query.count('COUNT('), 1, (dataset, query))
+                self.assertNotIn('min_date', query, (dataset, area))
+                self.assertIn("date_trunc('month', s.%s)" % sql.SERIES_DATE,
+                              query)
+
+if __name__ == '__main__':
+    unittest.main(exit=False, failfast=True)
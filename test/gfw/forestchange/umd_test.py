@@ -0,0 +1,182 @@
+# Global Forest Watch API
+# Copyright (C) 2015 World Resource Institute
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""Unit tests for gfw.forestchange.umd"""
+
+from test import common
+
+import datetime
+import json
+import unittest
+
+import mock
+
+from gfw import cache
+from gfw.forestchange import umd
+
+GEOJSON = json.dumps(dict(type='Polygon', coordinates=[
+    [[0, 0], [1, 0], [1, 1], [0, 1], [0, 0]]]))
+
+
+class UmdGeojsonTest(common.BaseTest):
+
+    def setUp(self):
+        super(UmdGeojsonTest, self).setUp()
+        cache._local.clear()
+        self.args = dict(thresh=30, geojson=GEOJSON, begin='2001-01-01',
+                         end='2013-01-01')
+
+    @mock.patch('gfw.forestchange.umd.gee')
+    @mock.patch('gfw.forestchange.umd._get_hansen_image')
+    @mock.patch('gfw.forestchange.umd._reduce')
+    def testAnalyzeGeojsonReducesOnce(self, mock_reduce, mock_image,
+                                      mock_gee):
+        mock_reduce.return_value = {
+            'gain': 5.0, 'tree': 100.0, '2001': 1.0, '2002': 2.0,
+            '2013': 4.0}
+        action, data = umd._analyze_geojson(self.args)
+        self.assertEqual(mock_reduce.call_count, 1)
+        mock_image.assert_called_with('30')
+        self.assertEqual(action, 'respond')
+        self.assertEqual(data['gain'], 5.0)
+        self.assertEqual(data['tree-extent'], 100.0)
+        self.assertEqual(data['loss'], 3.0)
+
+    @mock.patch('gfw.forestchange.umd.gee')
+    @mock.patch('gfw.forestchange.umd._get_hansen_image')
+    @mock.patch('gfw.forestchange.umd._reduce')
+    def testPeriodChangeUsesCachedLoss(self, mock_reduce, mock_image,
+                                       mock_gee):
+        mock_reduce.return_value = {
+            'gain': 5.0, 'tree': 100.0, '2001': 1.0, '2002': 2.0}
+        umd._analyze_geojson(dict(self.args))
+        args = dict(self.args, begin='2002-01-01')
+        action, data = umd._analyze_geojson(args)
+        self.assertEqual(mock_reduce.call_count, 1)
+        self.assertEqual(data['loss'], 2.0)
+
+    @mock.patch('gfw.forestchange.umd.CartoDbExecutor.execute_async')
+    def testWdpaFromCachedLoss(self, mock_execute_async):
+        args = dict(wdpaid='1', thresh=30)
+        cache.set(umd._loss_key(args), dict(
+            gain=5.0, tree=100.0, loss={'2001': 1.0, '2002': 2.0}))
+        action, data = umd.execute(dict(
+            args, begin=datetime.datetime(2001, 1, 1),
+            end=datetime.datetime(2002, 1, 1)))
+        self.assertFalse(mock_execute_async.called)
+        self.assertEqual(data['loss'], 1.0)
+        self.assertEqual(data['tree-extent'], 100.0)
+
+    @mock.patch('gfw.forestchange.umd.gee')
+    @mock.patch('gfw.forestchange.umd._get_hansen_image')
+    @mock.patch('gfw.forestchange.umd._reduce')
+    def testAllThresholdsReducedOnce(self, mock_reduce, mock_image,
+                                     mock_gee):
+        results = {'gain': 5.0}
+        for thresh in umd.THRESHOLDS:
+            results['tree_%s' % thresh] = 100.0 - int(thresh)
+            results['2001_%s' % thresh] = 1.0
+        mock_reduce.return_value = results
+        action, data = umd._analyze_geojson(dict(self.args, thresh='all'))
+        mock_image.assert_called_with('all')
+        self.assertEqual(sorted(data['thresholds']), sorted(umd.THRESHOLDS))
+        self.assertEqual(data['thresholds']['75'], {
+            'gain': 5.0, 'loss': 1.0, 'tree-extent': 25.0})
+
+        # Single thresholds are answered from the matrix
+        action, data = umd._analyze_geojson(dict(self.args, thresh='50'))
+        self.assertEqual(mock_reduce.call_count, 1)
+        self.assertEqual(data['tree-extent'], 50.0)
+
+    @mock.patch('gfw.forestchange.umd.gee')
+    @mock.patch('gfw.forestchange.umd.CartoDbExecutor')
+    @mock.patch('gfw.forestchange.umd._get_hansen_image')
+    @mock.patch('gfw.forestchange.umd._reduce')
+    @mock.patch('gfw.forestchange.common.cache.get')
+    def testWdpaMissLooksUpCacheOnce(self, mock_get, mock_reduce, mock_image,
+                                     mock_executor, mock_gee):
+        mock_get.return_value = None
+        mock_executor.get_result.return_value = ('respond', {
+            'rows': [{'geojson': GEOJSON}], 'download_urls': {},
+            'params': {'geojson': GEOJSON}})
+        mock_reduce.return_value = {'gain': 5.0, 'tree': 100.0, '2001': 1.0}
+        action, data = umd.execute(dict(wdpaid='1'))
+        self.assertEqual(data['loss'], 1.0)
+        # The key of the threshold, then of all thresholds
+        self.assertEqual(mock_get.call_count, 2)
+
+    def testAllThresholdsNeedGee(self):
+        action, data = umd.execute(dict(iso='BRA', thresh='all'))
+        self.assertEqual(action, 'error')
+
+    @mock.patch('gfw.forestchange.umd.gee')
+    @mock.patch('gfw.forestchange.umd.CartoDbExecutor.execute')
+    @mock.patch('gfw.forestchange.umd._get_hansen_image')
+    @mock.patch('gfw.forestchange.umd._reduce_regions')
+    @mock.patch('gfw.forestchange.umd._reduce')
+    def testExecuteBatchReducesRegionsOnce(self, mock_reduce,
+                                           mock_reduce_regions, mock_image,
+                                           mock_execute, mock_gee):
+        mock_execute.return_value = ('respond', {'rows': [{
+            'geojson': GEOJSON}]})
+        mock_reduce_regions.side_effect = lambda image, geoms: [
+            {'gain': 5.0, 'tree': 100.0, '2001': float(i)}
+            for i, geom in enumerate(geoms)]
+        period = dict(begin=datetime.datetime(2001, 1, 1),
+                      end=datetime.datetime(2002, 1, 1))
+        polygon = json.dumps(dict(type='Polygon', coordinates=[
+            [[0, 0], [2, 0], [2, 2], [0, 0]]]))
+        results = umd.execute_batch([
+            dict(period, geojson=GEOJSON), dict(period, geojson=polygon),
+            dict(period, wdpaid='1')])
+        self.assertEqual(mock_reduce_regions.call_count, 1)
+        self.assertFalse(mock_reduce.called)
+        self.assertEqual([data['loss'] for action, data in results],
+                         [0.0, 1.0, 2.0])
+        self.assertNotIn('geojson', results[2][1]['params'])
+
+    @mock.patch('gfw.forestchange.umd.gee')
+    @mock.patch('gfw.forestchange.umd._fetch_geometries')
+    @mock.patch('gfw.forestchange.umd.CartoDbExecutor')
+    @mock.patch('gfw.forestchange.umd._get_hansen_image')
+    @mock.patch('gfw.forestchange.umd._reduce')
+    def testExecuteBatchFallsBackOnBatchFailure(self, mock_reduce,
+                                                mock_image, mock_executor,
+                                                mock_fetch, mock_gee):
+        mock_fetch.side_effect = Exception('CartoDB down')
+        mock_executor.get_result.side_effect = lambda future: ('respond', {
+            'rows': [{'geojson': GEOJSON}], 'download_urls': {},
+            'params': {'geojson': GEOJSON}})
+        mock_reduce.side_effect = lambda *args: {
+            'gain': 5.0, 'tree': 100.0, '2001': 1.0}
+        period = dict(begin=datetime.datetime(2001, 1, 1),
+                      end=datetime.datetime(2002, 1, 1))
+        results = umd.execute_batch([dict(period, wdpaid='1'),
+                                     dict(period, wdpaid='2')])
+        self.assertEqual([action for action, data in results],
+                         ['respond', 'respond'])
+        self.assertEqual(mock_reduce.call_count, 2)
+
+    def testChunksByVertexBudget(self):
+        square = dict(type='Polygon', coordinates=[
+            [[0, 0], [1, 0], [1, 1], [0, 1], [0, 0]]])
+        with mock.patch.object(umd, 'BATCH_VERTICES', 10):
+            chunks = list(umd._chunks([(i, square) for i in range(5)]))
+        self.assertEqual([[i for i, geom in chunk] for chunk in chunks],
+                         [[0, 1], [2, 3], [4]])
+
+if __name__ == '__main__':
+    unittest.main(exit=False, failfast=True)
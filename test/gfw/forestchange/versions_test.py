@@ -0,0 +1,68 @@
+# Global Forest Watch API
+# Copyright (C) 2015 World Resource Institute
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Unit tests for gfw.forestchange.versions"""
+
+from test import common
+
+import json
+
+from google.appengine.api import memcache
+
+from gfw.forestchange import versions
+
+
+class VersionsTest(common.FetchBaseTest):
+
+    def setUp(self):
+        super(VersionsTest, self).setUp()
+        versions._last.clear()
+
+    def setRows(self, rows):
+        self.setResponse(content=json.dumps(dict(rows=rows)), status_code=200)
+
+    def testStaticDataset(self):
+        self.assertEqual(versions.get('umd-loss-gain'), versions.STATIC_VERSION)
+
+    def testTokenChangesWithLatestRows(self):
+        self.setRows([{'date': '2016-01-01'}])
+        old = versions.get('glad-alerts')
+        self.assertIsNotNone(old)
+
+        self.setRows([{'date': '2016-01-08'}])
+        self.assertEqual(versions.get('glad-alerts'), old)
+        changes = versions.refresh()
+        self.assertEqual(changes['glad-alerts'][0], old)
+        self.assertNotEqual(versions.get('glad-alerts'), old)
+
+    def testFetchError(self):
+        self.setResponse(content='error', status_code=500)
+        self.assertIsNone(versions.get('glad-alerts'))
+        self.assertEqual(versions.refresh(), {})
+
+    def testFetchErrorCached(self):
+        self.setRows([{'date': '2016-01-01'}])
+        token = versions.get('glad-alerts')
+        memcache.delete(versions._key('glad-alerts'))
+
+        self.setResponse(content='error', status_code=500)
+        self.assertEqual(versions.get('glad-alerts'), token)
+
+        # The failure is remembered instead of fetching again
+        self.setRows([{'date': '2016-01-08'}])
+        self.assertEqual(versions.get('glad-alerts'), token)
+
@@ -0,0 +1,68 @@
+# Global Forest Watch API
+# Copyright (C) 2015 World Resource Institute
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""Unit tests for gfw.gee"""
+
+from test import common
+
+import datetime
+import unittest
+
+import mock
+
+from gfw import gee
+
+
+class GeeTest(common.BaseTest):
+
+    def setUp(self):
+        super(GeeTest, self).setUp()
+        gee._initialized = False
+        self.credentials = mock.Mock(
+            access_token='token',
+            token_expiry=datetime.datetime.utcnow() +
+            datetime.timedelta(hours=1))
+
+    @mock.patch('gfw.gee.ee')
+    def testInitializeOnce(self, mock_ee):
+        with mock.patch('config.EE_CREDENTIALS', self.credentials):
+            count = gee.stats()['initialize']['count']
+            gee.initialize()
+            gee.initialize()
+        self.assertEqual(mock_ee.Initialize.call_count, 1)
+        mock_ee.data.setDeadline.assert_called_with(gee.DEADLINE)
+        self.assertEqual(gee.stats()['initialize']['count'], count + 1)
+        self.assertFalse(self.credentials.refresh.called)
+
+    @mock.patch('gfw.gee.ee')
+    def testRefreshBeforeExpiry(self, mock_ee):
+        self.credentials.token_expiry = datetime.datetime.utcnow() + \
+            datetime.timedelta(seconds=gee.REFRESH_SECONDS - 60)
+        with mock.patch('config.EE_CREDENTIALS', self.credentials):
+            gee.initialize()
+        self.assertEqual(self.credentials.refresh.call_count, 1)
+
+    @mock.patch('gfw.gee.ee')
+    def testInitializeErrorRetries(self, mock_ee):
+        mock_ee.Initialize.side_effect = ValueError('unavailable')
+        with mock.patch('config.EE_CREDENTIALS', self.credentials):
+            self.assertRaises(ValueError, gee.initialize)
+            mock_ee.Initialize.side_effect = None
+            gee.initialize()
+        self.assertEqual(mock_ee.Initialize.call_count, 2)
+
+if __name__ == '__main__':
+    unittest.main(exit=False, failfast=True)
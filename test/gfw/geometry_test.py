@@ -0,0 +1,142 @@
+# Global Forest Watch API
+# Copyright (C) 2015 World Resource Institute
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Unit tests for gfw.geometry"""
+
+import json
+import math
+import unittest
+
+from gfw import geometry
+
+SQUARE = [[0, 0], [1, 0], [1, 1], [0, 1], [0, 0]]
+
+
+class GeometryTest(unittest.TestCase):
+
+    def testRingStartAndOrientation(self):
+        shifted = [[1, 1], [1, 0], [0, 0], [0, 1], [1, 1]]
+        a = geometry.fingerprint({'type': 'Polygon', 'coordinates': [SQUARE]})
+        b = geometry.fingerprint({'coordinates': [shifted], 'type': 'Polygon'})
+        self.assertEqual(a, b)
+
+    def testPrecision(self):
+        noisy = [[x + 1e-9, y - 1e-9] for x, y in SQUARE]
+        a = geometry.fingerprint({'type': 'Polygon', 'coordinates': [SQUARE]})
+        b = geometry.fingerprint(json.dumps(
+            {'type': 'Polygon', 'coordinates': [noisy]}))
+        self.assertEqual(a, b)
+
+    def testMultiPolygonOrder(self):
+        other = [[[x + 5, y] for x, y in SQUARE]]
+        a = geometry.normalize(
+            {'type': 'MultiPolygon', 'coordinates': [[SQUARE], other]})
+        b = geometry.normalize(
+            {'type': 'MultiPolygon', 'coordinates': [other, [SQUARE]]})
+        self.assertEqual(a, b)
+
+    def testExteriorCounterclockwise(self):
+        polygon = geometry.normalize({'type': 'Polygon', 'coordinates': [
+            list(reversed(SQUARE))]})
+        self.assertEqual(polygon['coordinates'][0],
+                         [[0, 0], [1, 0], [1, 1], [0, 1], [0, 0]])
+
+    def testSimplifyWithinBudget(self):
+        polygon = {'type': 'Polygon', 'coordinates': [SQUARE]}
+        self.assertEqual(geometry.simplify(polygon), (polygon, None))
+
+    def testSimplifyToVertexBudget(self):
+        ring = [[math.cos(2 * math.pi * i / 1000) * (1 + 0.01 * (i % 2)),
+                 math.sin(2 * math.pi * i / 1000)] for i in range(1000)]
+        polygon = {'type': 'Polygon', 'coordinates': [ring + ring[:1]]}
+        simplified, simplification = geometry.simplify(polygon, 100)
+        exterior = simplified['coordinates'][0]
+        self.assertLessEqual(len(exterior) - 1, 100)
+        self.assertGreaterEqual(len(exterior) - 1, 3)
+        self.assertEqual(exterior[0], exterior[-1])
+        self.assertEqual(simplification['vertices'], 1000)
+        self.assertEqual(simplification['simplified_vertices'],
+                         len(exterior) - 1)
+
+    def testSimplifyManyParts(self):
+        parts = [[[[x, y], [x + 0.1, y], [x + 0.1, y + 0.1], [x, y + 0.1],
+                   [x, y]]] for x in range(35) for y in range(20)]
+        parts.append([[[-10, -10], [-5, -10], [-5, -5], [-10, -5],
+                       [-10, -10]]])
+        simplified, simplification = geometry.simplify(
+            {'type': 'MultiPolygon', 'coordinates': parts})
+        polygons = simplified['coordinates']
+        self.assertLessEqual(simplification['simplified_vertices'], 2000)
+        self.assertEqual(simplification['dropped_rings'], 701 - len(polygons))
+        self.assertIn([[-10, -10], [-5, -10], [-5, -5], [-10, -5], [-10, -10]],
+                      [rings[0] for rings in polygons])
+
+    def testSimplifyManyHoles(self):
+        exterior = [[0, 0], [100, 0], [100, 100], [0, 100], [0, 0]]
+        holes = [[[x + 0.5, y + 0.5], [x + 0.6, y + 0.5], [x + 0.5, y + 0.6],
+                  [x + 0.5, y + 0.5]] for x in range(40) for y in range(20)]
+        simplified, simplification = geometry.simplify(
+            {'type': 'Polygon', 'coordinates': [exterior] + holes})
+        rings = simplified['coordinates']
+        self.assertEqual(rings[0], exterior)
+        self.assertLessEqual(simplification['simplified_vertices'], 2000)
+        self.assertEqual(simplification['dropped_rings'], 801 - len(rings))
+        self.assertTrue(all(len(ring) == 4 for ring in rings[1:]))
+
+    def testSimplifyNeverPromotesHole(self):
+        exterior = [[0, 0], [1e-9, 0], [1e-9, 1e-9], [0, 1e-9], [0, 0]]
+        hole = [[2, 2], [3, 2], [3, 3], [2, 3], [2, 2]]
+        ring = [[math.cos(2 * math.pi * i / 3000) * 50,
+                 math.sin(2 * math.pi * i / 3000) * 50] for i in range(3000)]
+        simplified, simplification = geometry.simplify(
+            {'type': 'MultiPolygon', 'coordinates': [
+                [exterior, hole], [ring + ring[:1]]]})
+        self.assertEqual(len(simplified['coordinates']), 1)
+        self.assertEqual(len(simplified['coordinates'][0]), 1)
+
+    def testSimplifyKeepsNarrowHoleInside(self):
+        # The hole sits in a shallow bulge of the exterior that the first
+        # tolerance flattens, which would leave the hole outside
+        bulge = [[4 + i / 25.0, -0.01 * math.sin(math.pi * i / 50)]
+                 for i in range(1, 50)]
+        zigzag = [[10 - i / 30.0, 10 + 0.02 * (i % 2)] for i in range(300)]
+        exterior = [[0, 0]] + bulge + [[10, 0]] + zigzag + [[0, 0]]
+        hole = [[4.9, -0.006], [5.0, -0.004], [5.1, -0.006], [4.9, -0.006]]
+        simplified, simplification = geometry.simplify(
+            {'type': 'Polygon', 'coordinates': [exterior, hole]}, 100)
+        rings = [ring[:-1] for ring in simplified['coordinates']]
+        self.assertEqual(len(rings), 2)
+        self.assertTrue(geometry._valid([rings]))
+        self.assertLess(simplification['simplified_vertices'], 354)
+
+    def testSimplifyInvalidResultUnchanged(self):
+        # A bowtie crosses itself at any tolerance
+        ring = [[i / 500.0, i / 500.0] for i in range(500)] + \
+            [[1, 1]] + [[1 - i / 500.0, i / 500.0] for i in range(500)] + \
+            [[0, 1], [0, 0]]
+        polygon = {'type': 'Polygon', 'coordinates': [ring]}
+        self.assertEqual(geometry.simplify(polygon, 100), (polygon, None))
+
+    def testValid(self):
+        hole = [[0.2, 0.2], [0.2, 0.4], [0.4, 0.4]]
+        self.assertTrue(geometry._valid([[SQUARE[:-1], hole]]))
+        self.assertFalse(geometry._valid([[SQUARE[:-1], [[0.5, 0.5],
+                                                        [0.5, 2], [0.6, 2]]]]))
+        self.assertFalse(geometry._valid([[[[0, 0], [1, 1], [1, 0], [0, 1]]]]))
+        self.assertFalse(geometry._valid([[SQUARE[:-1]],
+                                          [[[x / 4.0, y / 4.0]
+                                            for x, y in SQUARE[:-1]]]]))
@@ -0,0 +1,53 @@
+# Global Forest Watch API
+# Copyright (C) 2015 World Resource Institute
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Unit tests for gfw.geostore.geostore"""
+
+from test import common
+
+import json
+
+from gfw.geostore import geostore
+from gfw.geostore.geostore import Geostore
+
+POLYGON = {'type': 'Polygon', 'coordinates': [
+    [[-58.9, -4.1], [-60.7, -7.8], [-55.6, -7.9], [-58.9, -4.1]]]}
+
+
+class GeostoreGeometryTest(common.BaseTest):
+
+    def testGetGeometry(self):
+        feature = {'type': 'Feature', 'properties': {}, 'geometry': POLYGON}
+        body = json.dumps({'geojson': {
+            'type': 'FeatureCollection', 'features': [feature]}})
+        stored = Geostore.create_from_request_body(body)
+
+        geojson, geometry = geostore.get_geometry(stored.key.urlsafe())
+        self.assertEqual(geometry, POLYGON)
+        self.assertEqual(json.loads(geojson), POLYGON)
+
+        # Served from the instance cache once resolved
+        stored.key.delete()
+        self.assertEqual(
+            geostore.get_geometry(stored.key.urlsafe())[1], POLYGON)
+
+    def testMultipleFeatures(self):
+        feature = {'type': 'Feature', 'geometry': POLYGON}
+        geometry = geostore._to_geometry(
+            {'type': 'FeatureCollection', 'features': [feature, feature]})
+        self.assertEqual(geometry['type'], 'MultiPolygon')
+        self.assertEqual(len(geometry['coordinates']), 2)
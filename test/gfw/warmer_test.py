@@ -0,0 +1,104 @@
+# Global Forest Watch API
+# Copyright (C) 2015 World Resource Institute
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Unit tests for gfw.warmer"""
+
+from test import common
+
+import unittest
+
+import mock
+
+from gfw import warmer
+from gfw.countries import api as countries_api
+from gfw.countries import countries
+from gfw.forestchange import api as forestchange_api
+
+
+class WarmerTest(common.BaseTest):
+
+    def setUp(self):
+        super(WarmerTest, self).setUp()
+        patcher = mock.patch('gfw.forestchange.versions.get',
+                             return_value='v1')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _forestchange_rid(self, path, query_args):
+        """Return the rid the forest-change handler uses for a request."""
+        dataset, rtype, params = forestchange_api.get_params(path, query_args)
+        return forestchange_api.get_rid(path, dataset, params)
+
+    def _countries_rid(self, path, query_args):
+        """Return the rid the countries handler uses for a request."""
+        path = path.strip('/')
+        rtype = countries_api._classify_request(path)
+        params = countries_api.get_params(path, rtype, dict(
+            (k, v) for k, v in query_args.iteritems()
+            if k in countries_api.PARAMS))
+        return countries_api.get_rid(path, params)
+
+    def testGetEntries(self):
+        entries = warmer.get_entries()
+        self.assertEqual(len(entries),
+                         len(warmer.WARM_DATASETS) * len(warmer.WARM_ISOS))
+        self.assertIn(dict(dataset='countries', iso='BRA', thresh='30'),
+                      entries)
+        self.assertIn(dict(dataset='glad-alerts', iso='IDN'), entries)
+
+        configured = [dict(dataset='glad-alerts', iso='BRA', id1=1)]
+        with mock.patch.dict(warmer.runtime_config, cache_warm=configured):
+            self.assertEqual(warmer.get_entries(), configured)
+
+    def testPrepareForestChangeMatchesRequest(self):
+        for entry, path, query_args in [
+                (dict(dataset='umd-loss-gain', iso='BRA', thresh='30'),
+                 '/forest-change/umd-loss-gain/admin/BRA', dict(thresh='30')),
+                (dict(dataset='glad-alerts', iso='IDN', id1=3,
+                      period='2016-01-01,2016-02-01'),
+                 '/forest-change/glad-alerts/admin/IDN/3',
+                 dict(period='2016-01-01,2016-02-01'))]:
+            path_, target, params, rid, soft_ttl = warmer._prepare(entry)
+            self.assertEqual(path_, path)
+            self.assertEqual(rid, self._forestchange_rid(path, query_args))
+            self.assertIs(target,
+                          forestchange_api.TARGETS[entry['dataset']])
+            self.assertEqual(soft_ttl,
+                             forestchange_api.soft_ttl(entry['dataset']))
+
+    def testPrepareCountriesMatchesRequest(self):
+        entry = dict(dataset='countries', iso='BRA', thresh='30')
+        path, target, params, rid, soft_ttl = warmer._prepare(entry)
+        self.assertEqual(path, '/countries/BRA')
+        self.assertEqual(rid, self._countries_rid(path, dict(thresh='30')))
+        self.assertIs(target, countries)
+        self.assertEqual(soft_ttl, countries_api.SOFT_TTL)
+
+    def testReport(self):
+        warmer.WarmResult(run='r1', path='/countries/BRA', status='fresh',
+                          seconds=0.5).put()
+        warmer.WarmResult(run='r1', path='/countries/IDN', status='respond',
+                          seconds=2.0).put()
+        report = warmer.report('r1')
+        self.assertEqual(report['run'], 'r1')
+        self.assertEqual(report['seconds'], 2.5)
+        self.assertEqual(sorted(r['path'] for r in report['results']),
+                         ['/countries/BRA', '/countries/IDN'])
+        self.assertEqual(warmer.report('r2')['results'], [])
+
+if __name__ == '__main__':
+    unittest.main(exit=False, failfast=True)